@@ -0,0 +1,133 @@
+"""Background Telegram alert delivery.
+
+Alerts are checked against a per-(device, type) cooldown and queued, so the
+request that raised them never waits on the Telegram API. Alerts raised within
+``digest_window`` seconds of each other go out as one digest message over a
+pooled session. Repeats swallowed by the cooldown are counted and mentioned in
+the next message for that alert.
+"""
+import html
+import threading
+import time
+from datetime import datetime
+
+from forwarder import OutboundQueue, pooled_session
+
+TELEGRAM_API = "https://api.telegram.org/bot{token}/sendMessage"
+
+
+class TelegramDispatcher:
+    """Cooldown gate + coalescing queue in front of the Telegram sendMessage API"""
+
+    def __init__(self, bot_token, chat_id, cooldown=300, digest_window=5.0,
+                 timeout=10, maxsize=500):
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+        self.cooldown = cooldown
+        self.timeout = timeout
+        self.session = pooled_session(pool_size=2)
+        self._last_sent = {}   # (device_id, alert_type) -> time the last alert was let through
+        self._suppressed = {}  # (device_id, alert_type) -> repeats skipped since then
+        self._lock = threading.Lock()
+        self.queue = OutboundQueue(
+            'telegram', self._send_digest, maxsize=maxsize, workers=1, batch_size=20,
+            linger=digest_window, on_give_up=self._release,
+        )
+
+    def configured(self):
+        return bool(self.bot_token and self.chat_id)
+
+    def _admit(self, device_id, alert_type):
+        """Reserve the cooldown slot; returns the repeat count or None if still cooling down"""
+        key = (device_id, alert_type)
+        now = time.time()
+        with self._lock:
+            if now - self._last_sent.get(key, 0) < self.cooldown:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return None
+            self._last_sent[key] = now
+            return self._suppressed.pop(key, 0)
+
+    def _release(self, items):
+        """Delivery failed for good: let the next occurrence through again"""
+        with self._lock:
+            for key, _ in items:
+                self._last_sent.pop(key[:2], None)
+
+    def enqueue(self, message, alert_type="general", device_id=None):
+        """Queue an alert and return at once"""
+        if not self.configured():
+            print("⚠️ Telegram credentials not configured")
+            return {"error": "Telegram credentials not configured"}
+        repeats = self._admit(device_id, alert_type)
+        if repeats is None:
+            return {"status": "skipped", "reason": "cooldown"}
+        # Same message text for the same device/type coalesces while queued
+        self.queue.submit((device_id, alert_type, message), (message, repeats, time.time()))
+        return {"status": "queued"}
+
+    def send_now(self, message, alert_type="general", device_id=None):
+        """Send one alert synchronously (used by the /alert endpoint)"""
+        key, prepared = self.prepare_now(message, alert_type, device_id)
+        if key is None:
+            return prepared
+        try:
+            return self._post(prepared)
+        except Exception as e:
+            return self.failed_now(key, e)
+
+    def prepare_now(self, message, alert_type="general", device_id=None):
+        """(key, message text) of an alert to send right away, or (None, result) if it is not sent"""
+        if not self.configured():
+            print("⚠️ Telegram credentials not configured")
+            return None, {"error": "Telegram credentials not configured"}
+        repeats = self._admit(device_id, alert_type)
+        if repeats is None:
+            return None, {"status": "skipped", "reason": "cooldown"}
+        key = (device_id, alert_type, message)
+        return key, self.format_messages([(key, (message, repeats, time.time()))])
+
+    def failed_now(self, key, e):
+        """Sending a prepared alert failed: reopen its cooldown and describe the error"""
+        self._release([(key, None)])
+        error_msg = f"Failed to send Telegram message: {str(e)}"
+        print(f"❌ {error_msg}")
+        return {"error": error_msg}
+
+    def _send_digest(self, items):
+        self._post(self.format_messages(items))
+        print(f"✅ Alert sent to Telegram: {len(items)} alert(s)")
+
+    def request_for(self, text):
+        """(url, JSON body) of the sendMessage call for a message text"""
+        return (TELEGRAM_API.format(token=self.bot_token),
+                {"chat_id": self.chat_id, "text": text, "parse_mode": "HTML"})
+
+    def _post(self, text):
+        url, body = self.request_for(text)
+        response = self.session.post(url, json=body, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def format_messages(items):
+        """One alert keeps the classic layout; several become a digest.
+
+        Device ids and messages are escaped: the text is sent with parse_mode HTML,
+        where a stray ``<`` or ``&`` makes Telegram reject the whole message.
+        """
+        lines = []
+        for (device_id, alert_type, _), (message, repeats, raised_at) in items:
+            prefix = f"[{html.escape(str(device_id))}] " if device_id else ""
+            suffix = f" (repeated {repeats}× during cooldown)" if repeats else ""
+            lines.append((f"{prefix}{html.escape(str(message))}{suffix}", raised_at))
+        stamp = datetime.fromtimestamp(max(t for _, t in lines)).strftime('%Y-%m-%d %H:%M:%S')
+        if len(lines) == 1:
+            return f"🚨 <b>Solar Monitor Alert</b> 🚨\n\n{lines[0][0]}\n\n<i>Time: {stamp}</i>"
+        body = "\n".join(f"• {text}" for text, _ in lines)
+        return f"🚨 <b>Solar Monitor Alerts ({len(lines)})</b> 🚨\n\n{body}\n\n<i>Time: {stamp}</i>"
+
+    def stats(self):
+        with self._lock:
+            suppressed = sum(self._suppressed.values())
+        return {**self.queue.stats(), "suppressed_pending": suppressed, "cooldown": self.cooldown}
@@ -0,0 +1,318 @@
+"""Declarative alert rules evaluated with NumPy over arrays of readings.
+
+A rule says which alert slot it fills, with what message, when, and which
+relay state it asks for. Conditions are written with ``col()`` / ``param()``
+expressions (``col('battery') < 10``) that compile to whole-array NumPy
+operations, so a batch of many readings is evaluated in a few vector ops and a
+single live reading is just a batch of one.
+
+Rules are applied in order: where two rules write the same slot (or the relay)
+for the same reading, the later one wins, like consecutive ``if`` blocks.
+
+Two rule sets live here: APP_RULES (ServerFolder/app.py) and SCRIPT_RULES
+(python_script.py, the ThingsBoard gateway).
+"""
+import operator
+import string
+
+import numpy as np
+
+
+class Expr:
+    """Lazy array expression over the evaluation context"""
+    __slots__ = ('fn', 'label')
+    __hash__ = object.__hash__
+
+    def __init__(self, fn, label):
+        self.fn = fn
+        self.label = label
+
+    def evaluate(self, ctx):
+        return self.fn(ctx)
+
+    def __repr__(self):
+        return self.label
+
+    def _op(self, other, op, symbol, reflected=False):
+        other = other if isinstance(other, Expr) else const(other)
+        left, right = (other, self) if reflected else (self, other)
+        return Expr(lambda ctx: op(left.fn(ctx), right.fn(ctx)), f"({left.label} {symbol} {right.label})")
+
+    def __add__(self, other): return self._op(other, operator.add, '+')
+    def __radd__(self, other): return self._op(other, operator.add, '+', True)
+    def __sub__(self, other): return self._op(other, operator.sub, '-')
+    def __rsub__(self, other): return self._op(other, operator.sub, '-', True)
+    def __mul__(self, other): return self._op(other, operator.mul, '*')
+    def __rmul__(self, other): return self._op(other, operator.mul, '*', True)
+    def __truediv__(self, other): return self._op(other, operator.truediv, '/')
+    def __rtruediv__(self, other): return self._op(other, operator.truediv, '/', True)
+    def __lt__(self, other): return self._op(other, operator.lt, '<')
+    def __le__(self, other): return self._op(other, operator.le, '<=')
+    def __gt__(self, other): return self._op(other, operator.gt, '>')
+    def __ge__(self, other): return self._op(other, operator.ge, '>=')
+    def __eq__(self, other): return self._op(other, operator.eq, '==')
+    def __ne__(self, other): return self._op(other, operator.ne, '!=')
+    def __and__(self, other): return self._op(other, operator.and_, '&')
+    def __or__(self, other): return self._op(other, operator.or_, '|')
+
+    def __invert__(self):
+        return Expr(lambda ctx: ~self.fn(ctx), f"~{self.label}")
+
+    def between(self, low, high):
+        """low <= x <= high"""
+        return (self >= low) & (self <= high)
+
+
+def col(name):
+    """Input or derived column"""
+    return Expr(lambda ctx: ctx[name], name)
+
+
+def param(name):
+    """Tunable threshold, looked up at evaluation time"""
+    return Expr(lambda ctx: ctx['params'][name], f"param:{name}")
+
+
+def const(value):
+    return Expr(lambda ctx: value, repr(value))
+
+
+def known(*names):
+    """All of the columns are present (not NaN)"""
+    return Expr(
+        lambda ctx: np.logical_and.reduce([~np.isnan(ctx[name]) for name in names]),
+        f"known{names}",
+    )
+
+
+def truthy(*names):
+    """All of the columns are present and non-zero (Python truthiness of a number)"""
+    return Expr(
+        lambda ctx: np.logical_and.reduce([~np.isnan(ctx[name]) & (ctx[name] != 0) for name in names]),
+        f"truthy{names}",
+    )
+
+
+class Rule:
+    """Fill ``slot`` with ``message`` (and/or set the relay) where ``when`` holds.
+
+    ``message`` may use ``str.format`` fields naming columns, e.g.
+    ``"Overload! ({power:.2f}W)"``; it is formatted only for the readings that
+    fired. ``alert_type`` is the Telegram alert type of the slot.
+    """
+    __slots__ = ('slot', 'message', 'when', 'relay', 'alert_type', '_fields')
+
+    def __init__(self, slot, message, when, relay=None, alert_type=None):
+        self.slot = slot
+        self.message = message
+        self.when = when
+        self.relay = relay
+        self.alert_type = alert_type
+        self._fields = _format_fields(message) if message else ()
+
+    def render(self, ctx, mask):
+        if not self._fields:
+            return self.message
+        rows = np.flatnonzero(mask)
+        columns = {name: ctx[name][rows].tolist() for name in self._fields}
+        return [
+            self.message.format(**{name: columns[name][i] for name in self._fields})
+            for i in range(len(rows))
+        ]
+
+
+def _format_fields(message):
+    return tuple(field for _, field, _, _ in string.Formatter().parse(message) if field)
+
+
+class RuleSet:
+    """Ordered rules plus derived columns computed once per evaluation"""
+
+    def __init__(self, slots, rules, derived=(), params=None):
+        self.slots = tuple(slots)
+        self.rules = list(rules)
+        self.derived = list(derived)
+        self.params = dict(params or {})
+        self.alert_types = {}
+        for rule in self.rules:
+            if rule.slot and rule.alert_type:
+                self.alert_types.setdefault(rule.slot, rule.alert_type)
+        self.has_relay = any(rule.relay is not None for rule in self.rules)
+
+    def evaluate(self, columns, params=None, initial_relay=None):
+        """Evaluate every rule over float64 column arrays of equal length.
+
+        Returns (alerts, relay): alerts maps each slot to an object array
+        (message or None per reading). relay is the relay state after each
+        reading -- readings where no relay rule fired keep the previous state,
+        starting from ``initial_relay`` -- or None if the set has no relay rules.
+        """
+        n = len(next(iter(columns.values())))
+        ctx = {name: np.asarray(values, dtype=np.float64) for name, values in columns.items()}
+        ctx['params'] = {**self.params, **(params or {})}
+        alerts = {slot: np.full(n, None, dtype=object) for slot in self.slots}
+        assigned = np.full(n, -1, dtype=np.int8)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for name, expr in self.derived:
+                ctx[name] = np.broadcast_to(expr.evaluate(ctx), (n,))
+            for rule in self.rules:
+                mask = np.broadcast_to(np.asarray(rule.when.evaluate(ctx), dtype=bool), (n,))
+                if not mask.any():
+                    continue
+                if rule.slot:
+                    alerts[rule.slot][mask] = rule.render(ctx, mask)
+                if rule.relay is not None:
+                    assigned[mask] = rule.relay
+
+        if not self.has_relay:
+            return alerts, None
+        # Forward-fill: the last relay decision stays until another rule fires
+        positions = np.where(assigned >= 0, np.arange(n), -1)
+        np.maximum.accumulate(positions, out=positions)
+        start = 1 if initial_relay is None else initial_relay
+        relay = np.where(positions >= 0, assigned[np.maximum(positions, 0)], start).astype(int)
+        return alerts, relay
+
+    def evaluate_one(self, values, params=None, initial_relay=None):
+        """Evaluate a single reading given as {column: number or None}"""
+        columns = {name: [_float(value)] for name, value in values.items()}
+        alerts, relay = self.evaluate(columns, params, initial_relay)
+        return {slot: messages[0] for slot, messages in alerts.items()}, (None if relay is None else int(relay[0]))
+
+
+def _float(value):
+    try:
+        return float(value) if value not in (None, '') else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+# ----- ServerFolder/app.py: alerts 1-8 and the non-essential load relay -----
+# Inputs: battery_percentage, light_intensity, solar_voltage, solar_current, voltage,
+# current (raw readings), current_battery (0 when missing), light_slope (W/m² per second)
+# and battery_slope (% per second) fitted over recent readings, predicted_energy
+# (kWh expected from solar).
+
+# (irradiance low, irradiance high, expected kW min, expected kW max)
+APP_IRRADIANCE_BANDS = [
+    (900, 1200, 0.31, 0.37),
+    (600, 900, 0.22, 0.30),
+    (350, 600, 0.14, 0.22),
+    (150, 350, 0.05, 0.14),
+    (-np.inf, 100, 0.0, 0.05),
+]
+
+_app_valid = known('light_intensity', 'solar_voltage', 'solar_current')
+_irradiance = col('irradiance')
+_solar_kw = col('solar_kw')
+_low_efficiency = _app_valid & Expr(
+    lambda ctx: np.logical_or.reduce([
+        (ctx['irradiance'] >= low) & (ctx['irradiance'] < high)
+        & ~((ctx['solar_kw'] >= p_min) & (ctx['solar_kw'] <= p_max))
+        for low, high, p_min, p_max in APP_IRRADIANCE_BANDS
+    ]),
+    'outside irradiance band',
+)
+_deficit = param('averageenergyconsume') > col('predicted_energy')
+_surplus = param('averageenergyconsume') < col('predicted_energy')
+_battery = col('battery_percentage')
+
+APP_RULES = RuleSet(
+    slots=('alert1', 'alert2', 'alert3', 'alert4', 'alert5', 'alert6', 'alert7', 'alert8'),
+    derived=[
+        ('irradiance', col('light_intensity') / 120),  # lux -> W/m²
+        ('solar_kw', col('solar_voltage') * col('solar_current') / 1000),
+    ],
+    params={
+        'threshold_slope': -1.0,
+        'threshold_battery_slope': -0.05,
+        'inverter_rating': 500,
+        'averageenergyconsume': 2.5,
+    },
+    rules=[
+        # 1 overcharge / discharge
+        Rule('alert1', "Overcharge!", _app_valid & (col('current_battery') == 100), relay=1, alert_type='battery'),
+        Rule('alert1', "Discharge!", _app_valid & (col('current_battery') < 10), relay=0, alert_type='battery'),
+        # 2 sun is sufficient but the panel does not produce what it should
+        Rule('alert2', "solar panel low efficiency!", _low_efficiency, relay=0, alert_type='panel alert'),
+        # 3 overload
+        Rule('alert3', "Overload!",
+             _app_valid & (col('voltage') * col('current') / 1000 > param('inverter_rating')),
+             relay=0, alert_type='load alert'),
+        # 4 sudden drop in sunlight
+        Rule('alert4', "Sudden drop in sun light!",
+             _app_valid & known('light_slope') & (col('light_slope') < param('threshold_slope')),
+             relay=0, alert_type='light intensity alert'),
+        # 5 solar generates power but the battery does not charge
+        Rule('alert5', "Battery not charging!",
+             _app_valid & (_solar_kw != 0) & known('battery_slope')
+             & (col('battery_slope') < param('threshold_battery_slope')),
+             relay=0, alert_type='battery alert'),
+        # 6-8 prediction alerts
+        Rule('alert6', "consumption is higher than expected solar generation!", _deficit,
+             alert_type='prediction alert'),
+        Rule('alert7', "Battery is low. Risk of blackout in future!", _deficit & (_battery < 40),
+             relay=0, alert_type='prediction alert'),
+        # enough solar for your needs: non-essential loads can be switched on
+        Rule(None, None, _surplus & (_battery > 40) & (_battery < 80), relay=1),
+        Rule('alert8', "Battery may overcharge in next upcoming hours!", _surplus & (_battery > 80),
+             relay=1, alert_type='prediction alert'),
+    ],
+)
+
+
+# ----- python_script.py: ThingsBoard alert fields -----
+# Inputs: battery_percentage, light_intensity, solar_voltage, solar_current, solar_power,
+# power, inverter_load, light_slope (irradiance per second) and battery_slope (% per second).
+
+# (irradiance low, irradiance high, expected kW min, expected kW max, message)
+SCRIPT_IRRADIANCE_BANDS = [
+    (900, np.nextafter(1200, np.inf), 0.31, 0.37,  # 1200 inclusive
+     "Sunlight strong but solar panel underperforming (900-1200 W/m²)"),
+    (600, 900, 0.22, 0.30, "Sunlight moderate but solar panel underperforming (600-900 W/m²)"),
+    (350, 600, 0.14, 0.22, "Sunlight low but solar panel underperforming (350-600 W/m²)"),
+    (150, 350, 0.05, 0.14, "Sunlight very low but solar panel underperforming (150-350 W/m²)"),
+]
+
+_script_solar = known('solar_voltage', 'light_intensity', 'solar_power')
+_solar_calc = col('solar_power') / 1000
+_load_known = known('power', 'inverter_load')
+
+SCRIPT_RULES = RuleSet(
+    slots=('battery_alert', 'solar_alert', 'overload_status', 'sunlight_alert', 'charging_alert'),
+    derived=[('irradiance', col('light_intensity') / 120)],
+    params={
+        'sunlight_slope': -0.1,
+        'charging_slope': 0.05,
+        'warning_load': 0.90,  # fraction of inverter_load that triggers the warning
+    },
+    rules=[
+        # 1 battery overcharge / low
+        Rule('battery_alert', "Battery fully charged (100%) - Overcharge risk!", _battery >= 100),
+        Rule('battery_alert', "Battery critically low (<15%) - Discharge risk!", _battery < 15),
+        # 2 solar panel underperformance, one rule per irradiance band
+        *[
+            Rule('solar_alert', message,
+                 _script_solar & (_irradiance >= low) & (_irradiance < high) & ~_solar_calc.between(p_min, p_max))
+            for low, high, p_min, p_max, message in SCRIPT_IRRADIANCE_BANDS
+        ],
+        Rule('solar_alert', "Unexpected power generated in very low sunlight (<150 W/m²)",
+             _script_solar & (_irradiance < 150) & (_solar_calc > 0.05)),
+        # 3 inverter overload
+        Rule('overload_status', "Load Normal ({power:.2f} W)",
+             _load_known & (col('power') <= col('inverter_load') * param('warning_load'))),
+        Rule('overload_status', "High Load Warning. ({power:.2f}W / {inverter_load:g}W)",
+             _load_known & (col('power') > col('inverter_load') * param('warning_load'))
+             & (col('power') <= col('inverter_load'))),
+        Rule('overload_status', "Overload! ({power:.2f}W > {inverter_load:g}W)",
+             _load_known & (col('power') > col('inverter_load'))),
+        # 4 sudden drop in sunlight
+        Rule('sunlight_alert', "Sudden drop in sunlight detected!",
+             known('light_slope') & (col('light_slope') < param('sunlight_slope'))),
+        # 5 solar power generated but battery not charging
+        Rule('charging_alert', "Solar generating power but battery not charging!",
+             truthy('solar_voltage', 'solar_current') & known('battery_slope')
+             & (col('solar_power') > 0) & (col('battery_slope') < param('charging_slope'))),
+    ],
+)
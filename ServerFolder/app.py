@@ -1,65 +1,66 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from datetime import datetime, timedelta
 import requests
-import random
-import math
 import os
 import time
 from flask_cors import CORS  
-import pandas as pd
 import numpy as np
-import csv
+import atexit
+import json
+import zlib
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from device_state import DeviceState, DeviceStateStore, DEFAULT_DEVICE_ID
+from timeseries_store import TimeSeriesStore, parse_cursor
+from resample import FFILL_LIMIT, INTERPOLATE_LIMIT, read_grid
+from rollups import RollupStore
+from forwarder import DeliveryError, OutboundQueue, pooled_session
+from alert_dispatcher import TelegramDispatcher
+from weather_cache import WeatherCache, SQLiteBackend
+from alert_rules import APP_RULES
+from ring_buffer import RingBuffer
+from forecast_service import ForecastService
+from live_stream import LiveBroker
+from snapshot_cache import SnapshotCache
+from binary_protocol import decode_frame
+from telemetry_schema import metric_columns, parse_batch, parse_reading, parse_reading_timestamp
 
 app = Flask(__name__)
 CORS(app) 
 
-# Global variables for ESP32 data
-box_temp = None
-frequency = None
-power_factor = None
-voltage = None
-current = None
-power = None
-energy = None
-solar_voltage = None
-solar_current = None
-solar_power = None
-battery_percentage = None
-light_intensity = None
-battery_voltage = None
-
-# Alert system variables
-prev_light_intensity = 0
-current_light_intensity = 0
-light_slope = 0       
-threshold_slope = -100   # Set appropriate threshold for sudden light drop
-irradiance = 0
-prev_battery_percent = 0
-current_battery_percent = 0
-battery_percent_slope=0
-threshold_battery_slope =-0.05   # Set appropriate threshold for battery charging rate
+# Per-device ESP32 data (replaces the old single-device globals)
+state_store = DeviceStateStore()
+
+# Encoded dashboard responses, rebuilt only after a new reading or weather fetch
+snapshots = SnapshotCache()
+
+# Live push of every ingested reading to open dashboards (/api/stream)
+live_broker = LiveBroker(
+    max_buffer=int(os.environ.get('STREAM_BUFFER', 100)),
+    # Each open stream holds a gunicorn thread: stay below --threads (Procfile) so devices still get one
+    max_subscribers=int(os.environ.get('STREAM_MAX_CLIENTS', 80)),
+)
+
+# Alert system thresholds
+# Sudden light drop: irradiance trend (W/m² per second, fitted over TREND_WINDOW) below this.
+# -1 W/m²/s held for 300 s is a 300 W/m² fall in five minutes, about a third of clear-sky
+# irradiance (~1000 W/m²): a thick cloud moving in. The normal afternoon decline is only
+# ~0.05-0.1 W/m²/s. Tune per site with SUNLIGHT_DROP_SLOPE.
+threshold_slope = float(os.environ.get('SUNLIGHT_DROP_SLOPE', -1.0))
+threshold_battery_slope =-0.05   # % per second: battery trend that counts as not charging
+TREND_WINDOW = 300  # seconds of readings the light/battery slopes are fitted over
 inverter_rating = 500  # Set your inverter rating in watts
-last_alert_time = {}
-ALERT_COOLDOWN = 300  # 5 minutes in seconds
-nonessentialrelaystate=1
+ALERT_COOLDOWN = 300  # 5 minutes in seconds, per device and alert type
+ALERT_DIGEST_WINDOW = 5  # alerts raised within this many seconds share one message
 
 averageenergyconsume=2.5  # in same interval in which total predict energy calculated calculated it like avg power of one day then avg power of this time-?
-predicttotalenergy=0
-alert1=None
-alert2=None
-alert3=None
-alert4=None
-alert5=None
-alert6=None
-alert7=None
-alert8=None
+PREDICTION_HORIZON = '1d'  # forecast compared with averageenergyconsume by the prediction alerts
+MODEL_DIR = os.environ.get('MODEL_DIR', 'models')  # boosters saved by ml_model_training.py
+forecast_service = ForecastService(MODEL_DIR)
 
 # Weather data cache
-weather_cache = None
-weather_last_updated = None
 CACHE_DURATION = 3600  # 1 hour
+WEATHER_REFRESH_AHEAD = 300  # re-fetch in the background this long before expiry
 
 # Bareilly coordinates
 BAREILLY_LAT = 28.3640
@@ -70,181 +71,200 @@ OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
 
 # Your app's API endpoint
 APP_API_URL = "https://energy-vison.vercel.app/api/dashboard-data"
+APP_TIMEOUT = 5
+# Outbound app updates go through a bounded queue drained by a few pooled workers
+app_session = pooled_session(pool_size=4)
+app_forwarder = OutboundQueue(
+    'app-forwarder', lambda items: post_to_app(items),
+    maxsize=int(os.environ.get('APP_QUEUE_SIZE', 500)), workers=2, batch_size=20,
+)
+atexit.register(app_forwarder.stop)
 
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '8352010252:AAFxUDRp1ihGFQk_cu4ifQgQ8Yi4a_UVpDA')
 TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID', '5625474222')
+telegram = TelegramDispatcher(TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID,
+                              cooldown=ALERT_COOLDOWN, digest_window=ALERT_DIGEST_WINDOW)
+atexit.register(telegram.queue.stop)
 
 # CSV Configuration - ADDED FOR 15-SECOND INTERVALS
-CSV_FILE_PATH = 'solar_data.csv'
+CSV_FILE_PATH = 'solar_data.csv'  # legacy file, imported into the store once and kept as export format
+STORAGE_DIR = os.environ.get('STORAGE_DIR', 'solar_data')
 DATA_INTERVAL = 15  # 15 seconds in seconds
 last_data_received = None
 
+ts_store = None  # TimeSeriesStore, opened by init_storage()
+rollup_store = None  # RollupStore (1m/15m/1h/1d tiers), opened by init_storage()
+
+# One Open-Meteo fetch per location per hour, shared by all gunicorn workers
+# (WEB_CONCURRENCY, 1 by default - see live_stream.py) and overlapping deploys
+# through a small SQLite file (set WEATHER_CACHE_DB='' to keep it per process)
+WEATHER_CACHE_DB = os.environ.get('WEATHER_CACHE_DB', os.path.join(STORAGE_DIR, 'weather_cache.sqlite'))
+weather_cache = WeatherCache(
+    lambda key: fetch_open_meteo(key),
+    ttl=CACHE_DURATION,
+    refresh_ahead=WEATHER_REFRESH_AHEAD,
+    backend=SQLiteBackend(WEATHER_CACHE_DB) if WEATHER_CACHE_DB else None,
+    on_error=lambda key, e: send_telegram_alert("Weather API error", "api error"),
+)
+
 # Initialize scheduler - ADDED
 scheduler = BackgroundScheduler()
 scheduler_started = False  # ADDED: Flag to track scheduler status
 
-# CSV FUNCTIONS - ADDED (KEEPING YOUR EXISTING CODE STRUCTURE)
-def init_csv_file():
-    """Initialize CSV file with headers if it doesn't exist"""
+# STORAGE FUNCTIONS - readings go to the time-series store, CSV is the export format
+CSV_HEADERS = [
+    'timestamp', 'box_temp', 'frequency', 'power_factor', 'voltage', 
+    'current', 'power', 'energy', 'solar_voltage', 'solar_current',
+    'solar_power', 'battery_percentage', 'light_intensity', 
+    'battery_voltage', 'temperature', 'humidity', 'cloud_cover',
+    'wind_speed', 'precipitation', 'weather_code', 'alert1', 'alert2',
+    'alert3', 'alert4', 'alert5', 'alert6', 'alert7', 'alert8',
+    'nonessentialrelaystate', 'data_source'
+]
+
+def init_storage():
+    """Open the time-series store and import the legacy CSV file on first run"""
+    global ts_store, rollup_store
     try:
-        if not os.path.exists(CSV_FILE_PATH):
-            headers = [
-                'timestamp', 'box_temp', 'frequency', 'power_factor', 'voltage', 
-                'current', 'power', 'energy', 'solar_voltage', 'solar_current',
-                'solar_power', 'battery_percentage', 'light_intensity', 
-                'battery_voltage', 'temperature', 'humidity', 'cloud_cover',
-                'wind_speed', 'precipitation', 'weather_code', 'alert1', 'alert2',
-                'alert3', 'alert4', 'alert5', 'alert6', 'alert7', 'alert8',
-                'nonessentialrelaystate', 'data_source'
-            ]
-            
-            with open(CSV_FILE_PATH, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(headers)
-            print(f"✅ CSV file initialized: {CSV_FILE_PATH}")
-        else:
-            print(f"✅ CSV file already exists: {CSV_FILE_PATH}")
+        if ts_store is None:
+            ts_store = TimeSeriesStore(STORAGE_DIR)
+            rollup_store = RollupStore(os.path.join(STORAGE_DIR, 'rollups'))
+            forecast_service.open_features(os.path.join(STORAGE_DIR, 'features'))
+            atexit.register(ts_store.flush)
+            atexit.register(rollup_store.flush)
+            atexit.register(forecast_service.features.close)
+        imported = ts_store.import_csv_once(CSV_FILE_PATH)
+        if imported:
+            print(f"✅ Imported {imported} rows from {CSV_FILE_PATH} into {STORAGE_DIR}")
+        print(f"✅ Time-series storage ready: {STORAGE_DIR}")
     except Exception as e:
-        print(f"❌ Error initializing CSV file: {str(e)}")
+        print(f"❌ Error initializing storage: {str(e)}")
+
+WEATHER_COLUMNS = ('temperature', 'humidity', 'cloud_cover', 'wind_speed', 'precipitation', 'weather_code')
+
+def weather_columns(weather_data):
+    """Weather values stored with a reading (NaN when the weather is unavailable)"""
+    current_weather = weather_data.get('current', {}) if 'error' not in weather_data else {}
+    return {name: current_weather.get(name, np.nan) for name in WEATHER_COLUMNS}
 
-def save_to_csv(esp32_data, weather_data, alerts):
-    """Save current data to CSV file"""
+def build_data_row(esp32_data, weather_data, alerts, device_id=None, timestamp=None):
+    """Build one storage row from ESP32 values, weather and alerts"""
+    # ESP32 data (handle missing values)
+    row_data = {
+        'timestamp': timestamp if timestamp is not None else time.time(),
+        'device_id': device_id,
+        'box_temp': esp32_data.get('box_temp', np.nan),
+        'frequency': esp32_data.get('frequency', np.nan),
+        'power_factor': esp32_data.get('power_factor', np.nan),
+        'voltage': esp32_data.get('voltage', np.nan),
+        'current': esp32_data.get('current', np.nan),
+        'power': esp32_data.get('power', np.nan),
+        'energy': esp32_data.get('energy', np.nan),
+        'solar_voltage': esp32_data.get('solar_voltage', np.nan),
+        'solar_current': esp32_data.get('solar_current', np.nan),
+        'solar_power': esp32_data.get('solar_power', np.nan),
+        'battery_percentage': esp32_data.get('battery_percentage', np.nan),
+        'light_intensity': esp32_data.get('light_intensity', np.nan),
+        'battery_voltage': esp32_data.get('battery_voltage', np.nan),
+        'data_source': 'esp32_live'
+    }
+    
+    # Weather data
+    row_data.update(weather_columns(weather_data))
+    
+    # Alerts
+    row_data.update({
+        'alert1': alerts.get('alert1', ''),
+        'alert2': alerts.get('alert2', ''),
+        'alert3': alerts.get('alert3', ''),
+        'alert4': alerts.get('alert4', ''),
+        'alert5': alerts.get('alert5', ''),
+        'alert6': alerts.get('alert6', ''),
+        'alert7': alerts.get('alert7', ''),
+        'alert8': alerts.get('alert8', ''),
+        'nonessentialrelaystate': esp32_data.get('nonessentialrelaystate', 1)
+    })
+    return row_data
+
+def save_readings(rows):
+    """Buffer many rows in the time-series store (flushed by size/time) and update rollups"""
     try:
-        # Prepare data row
-        timestamp = datetime.now().isoformat()
-        
-        # ESP32 data (handle missing values)
-        row_data = {
-            'timestamp': timestamp,
-            'box_temp': esp32_data.get('box_temp', np.nan),
-            'frequency': esp32_data.get('frequency', np.nan),
-            'power_factor': esp32_data.get('power_factor', np.nan),
-            'voltage': esp32_data.get('voltage', np.nan),
-            'current': esp32_data.get('current', np.nan),
-            'power': esp32_data.get('power', np.nan),
-            'energy': esp32_data.get('energy', np.nan),
-            'solar_voltage': esp32_data.get('solar_voltage', np.nan),
-            'solar_current': esp32_data.get('solar_current', np.nan),
-            'solar_power': esp32_data.get('solar_power', np.nan),
-            'battery_percentage': esp32_data.get('battery_percentage', np.nan),
-            'light_intensity': esp32_data.get('light_intensity', np.nan),
-            'battery_voltage': esp32_data.get('battery_voltage', np.nan),
-            'data_source': 'esp32_live'
-        }
-        
-        # Weather data
-        if 'error' not in weather_data:
-            current_weather = weather_data.get('current', {})
-            row_data.update({
-                'temperature': current_weather.get('temperature', np.nan),
-                'humidity': current_weather.get('humidity', np.nan),
-                'cloud_cover': current_weather.get('cloud_cover', np.nan),
-                'wind_speed': current_weather.get('wind_speed', np.nan),
-                'precipitation': current_weather.get('precipitation', np.nan),
-                'weather_code': current_weather.get('weather_code', np.nan),
-            })
-        else:
-            row_data.update({
-                'temperature': np.nan,
-                'humidity': np.nan,
-                'cloud_cover': np.nan,
-                'wind_speed': np.nan,
-                'precipitation': np.nan,
-                'weather_code': np.nan,
-            })
-        
-        # Alerts
-        row_data.update({
-            'alert1': alerts.get('alert1', ''),
-            'alert2': alerts.get('alert2', ''),
-            'alert3': alerts.get('alert3', ''),
-            'alert4': alerts.get('alert4', ''),
-            'alert5': alerts.get('alert5', ''),
-            'alert6': alerts.get('alert6', ''),
-            'alert7': alerts.get('alert7', ''),
-            'alert8': alerts.get('alert8', ''),
-            'nonessentialrelaystate': esp32_data.get('nonessentialrelaystate', 1)
-        })
-        
-        # Write to CSV
-        with open(CSV_FILE_PATH, 'a', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=row_data.keys())
-            writer.writerow(row_data)
-        
-        print(f"✅ Data saved to CSV: {timestamp}")
+        ts_store.append_many(rows)
+        by_device = {}
+        for row in rows:
+            by_device.setdefault(row['device_id'], []).append(row)
+        for device_id, device_rows in by_device.items():
+            rollup_store.add_columns(
+                device_id,
+                [row['timestamp'] for row in device_rows],
+                {metric: [_to_float(row.get(metric)) for row in device_rows] for metric in rollup_store.metrics}
+            )
         return True
-        
     except Exception as e:
-        print(f"❌ Error saving to CSV: {str(e)}")
+        print(f"❌ Error saving readings: {str(e)}")
         return False
 
-def save_missing_data_entry():
-    """Save NaN entry when ESP32 fails to send data"""
+def save_reading(esp32_data, weather_data, alerts, device_id=None):
+    """Save current data to the time-series store"""
+    return save_readings([build_data_row(esp32_data, weather_data, alerts, device_id)])
+
+def save_missing_data_entry(since=None, device_id=None):
+    """Record the period without ESP32 data as a gap interval (no NaN row); logged when the gap opens"""
     try:
-        timestamp = datetime.now().isoformat()
-        
-        # Create row with NaN values
-        row_data = {
-            'timestamp': timestamp,
-            'box_temp': np.nan,
-            'frequency': np.nan,
-            'power_factor': np.nan,
-            'voltage': np.nan,
-            'current': np.nan,
-            'power': np.nan,
-            'energy': np.nan,
-            'solar_voltage': np.nan,
-            'solar_current': np.nan,
-            'solar_power': np.nan,
-            'battery_percentage': np.nan,
-            'light_intensity': np.nan,
-            'battery_voltage': np.nan,
-            'temperature': np.nan,
-            'humidity': np.nan,
-            'cloud_cover': np.nan,
-            'wind_speed': np.nan,
-            'precipitation': np.nan,
-            'weather_code': np.nan,
-            'alert1': '',
-            'alert2': '',
-            'alert3': '',
-            'alert4': '',
-            'alert5': '',
-            'alert6': '',
-            'alert7': '',
-            'alert8': '',
-            'nonessentialrelaystate': 1,
-            'data_source': 'missing_data'
-        }
-        
-        # Write to CSV
-        with open(CSV_FILE_PATH, 'a', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=row_data.keys())
-            writer.writerow(row_data)
-        
-        print(f"⚠️ Missing data entry saved: {timestamp}")
+        timestamp = time.time()
+        start = since if since is not None else timestamp - DATA_INTERVAL
+
+        # Touching intervals extend one open gap, so a long outage stays one record
+        if ts_store.gaps.mark(start, timestamp, device_id):
+            device = f" for {device_id}" if device_id is not None else ""
+            print(f"⚠️ Missing data gap opened{device} at {datetime.fromtimestamp(start).isoformat()}")
         return True
         
     except Exception as e:
         print(f"❌ Error saving missing data entry: {str(e)}")
         return False
 
+def close_missing_data_gap(device_id=None):
+    """Close the open gap of a device that reports again (logged once, with its length)"""
+    gap = ts_store.gaps.close(device_id)
+    if gap is not None:
+        device = f" for {device_id}" if device_id is not None else ""
+        print(f"✅ Missing data gap closed{device}: {datetime.fromtimestamp(gap[0]).isoformat()} - "
+              f"{datetime.fromtimestamp(gap[1]).isoformat()} ({int(gap[1] - gap[0])}s)")
+
 def check_missing_data():
-    """Check if we haven't received data and save NaN entry every 15 seconds"""
+    """Record a gap for every device that has not reported for 15 seconds (checked every 15 seconds)"""
     global last_data_received
+    now = time.time()
     
-    if last_data_received is None:
-        # First run, initialize
-        last_data_received = datetime.now()
+    device_ids = state_store.device_ids()
+    if not device_ids:
+        # No device has reported since start-up: nothing arrived at all (device None)
+        if last_data_received is None:
+            last_data_received = datetime.now()
+            return
+        time_since_last_data = (datetime.now() - last_data_received).total_seconds()
+        if time_since_last_data >= DATA_INTERVAL:
+            save_missing_data_entry(since=last_data_received.timestamp())
+            last_data_received = datetime.now()
         return
+    close_missing_data_gap()
     
-    time_since_last_data = (datetime.now() - last_data_received).total_seconds()
-    
-    if time_since_last_data >= 15:  # Check every 15 seconds
-        print(f"⚠️ No data received for {time_since_last_data} seconds. Saving NaN entry.")
-        save_missing_data_entry()
-        # Update last received to prevent multiple entries
-        last_data_received = datetime.now()
+    for device_id in device_ids:
+        state = state_store.get(device_id)
+        last_seen = state.last_updated if state is not None else None
+        if last_seen is None:
+            continue
+        if now - last_seen < DATA_INTERVAL:
+            close_missing_data_gap(device_id)
+            continue
+        # Marked from the last reading on every check, so one outage grows one interval
+        save_missing_data_entry(since=last_seen, device_id=device_id)
+
+def flush_storage_if_due():
+    ts_store.flush_if_due()
+    rollup_store.flush_if_due()
+    forecast_service.features.flush_if_due()
 
 def start_background_scheduler():
     """Start the background scheduler for data monitoring"""
@@ -265,85 +285,53 @@ def start_background_scheduler():
             replace_existing=True
         )
         
+        # Flush buffered readings to disk at least every few seconds
+        scheduler.add_job(
+            func=flush_storage_if_due,
+            trigger=IntervalTrigger(seconds=ts_store.flush_interval),
+            id='storage_flush',
+            name='Flush buffered readings to time-series storage',
+            replace_existing=True
+        )
+
+        # Refresh weather shortly before it expires so requests never wait on Open-Meteo
+        scheduler.add_job(
+            func=weather_cache.refresh_ahead,
+            trigger=IntervalTrigger(seconds=60),
+            id='weather_refresh',
+            name='Refresh cached weather ahead of expiry',
+            replace_existing=True
+        )
+        
         scheduler.start()
         scheduler_started = True  # ADDED: Set flag to True
         print("✅ Background scheduler started for 15-second data monitoring")
     except Exception as e:
         print(f"❌ Error starting background scheduler: {str(e)}")
 
-def send_to_app(data):
-    """Send data to your app's API endpoint - prints only what's being sent"""
-    max_retries = 2
-    retry_delay = 1
-    
-    # PRINT ONLY WHAT'S BEING SENT TO THE APP
-    print("\n" + "📤" * 50)
-    print("🚀 DATA BEING SENT TO APP:")
-    print("📤" * 50)
-    
-    # Print the exact JSON that's being sent
-    import json
-    print(json.dumps(data, indent=2))
-    
-    print("📤" * 50)
-    print(f"🔗 Sending to: {APP_API_URL}")
-    print("📤" * 50 + "\n")
-    
-    # Rest of your existing connection code...
-    for attempt in range(max_retries):
+def post_to_app(items):
+    """Deliver a batch of queued dashboard payloads over the pooled session.
+
+    Stops at the first failure; only that payload and the ones after it are retried.
+    """
+    for index, (device_id, data) in enumerate(items):
         try:
-            print(f"📤 Attempt {attempt + 1}/{max_retries} to send data to app")
-            headers = {
-                'Content-Type': 'application/json',
-                'User-Agent': 'SolarMonitor/1.0'
-            }
-            
-            # Try with and without SSL verification
-            verify_ssl = attempt == 0
-            
-            response = requests.post(
-                APP_API_URL, 
-                json=data, 
-                headers=headers, 
-                timeout=5,
-                verify=verify_ssl
-            )
-            
-            print(f"✅ App response status: {response.status_code}")
+            response = app_session.post(APP_API_URL, json=data, timeout=APP_TIMEOUT)
             response.raise_for_status()
-            
-            print(f"✅ Successfully sent to app")
-            return True
-            
-        except requests.exceptions.SSLError:
-           
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            else:
-                
-                return False
-                
-        except requests.exceptions.Timeout:
-           
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            else:
-                
-                return False
-                
-        except requests.exceptions.ConnectionError as e:
-            print(f"❌ Connection error: {str(e)}")
-            return False
-            
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Request error: {str(e)}")
-            return False
-            
         except Exception as e:
-            print(f"❌ Unexpected error: {str(e)}")
-            return False
-    
-    return False
+            if index:
+                print(f"⚠️ Sent {index} of {len(items)} update(s) to app before a failure")
+            raise DeliveryError([key for key, _ in items[index:]], e)
+    print(f"✅ Sent {len(items)} update(s) to app (queue depth {app_forwarder.depth()})")
+
+def send_to_app(data):
+    """Queue a dashboard payload for the app; returns at once.
+
+    Only the newest pending payload of each device is delivered, so a slow app
+    never builds a backlog of stale readings.
+    """
+    device_id = (data.get('esp32_data') or {}).get('device_id') or DEFAULT_DEVICE_ID
+    return app_forwarder.submit(device_id, data)
 
 @app.route('/')
 def home():
@@ -351,6 +339,8 @@ def home():
         "message": "Solar Monitoring System API",
         "endpoints": {
             "POST /esp32-data": "Receive data from ESP32",
+            "POST /esp32-data/batch": "Receive many buffered ESP32 readings (JSON array, NDJSON or compact lines)",
+            "POST /esp32-data/bin": "Receive readings as a compact binary frame (binary_protocol.py)",
             "GET /weather": "Get weather data",
             "GET /hourly-forecast": "Get hourly weather forecast",
             "GET /combined-data": "Get combined ESP32 and weather data",
@@ -358,8 +348,13 @@ def home():
             "GET /test-params": "Check current parameter values",
             "POST /alert": "Send alert to Telegram",
             "POST /send-to-app": "Send data to your app",
-            "GET /api/csv-data": "Get CSV data for model",  # ADDED
-            "GET /api/csv-stats": "Get CSV statistics"      # ADDED
+            "GET /api/csv-data": "Get stored data (start, end, columns, device, limit, cursor)",  # ADDED
+            "GET /api/csv-stats": "Get CSV statistics",     # ADDED
+            "GET /api/csv-export": "Download stored data as CSV",
+            "GET /api/history": "Downsampled history (1m/15m/1h/1d rollups picked by range)",
+            "GET /api/forecast": "+1h / +1d Energy forecast for a device",
+            "GET /api/stream": "Server-Sent Events: dashboard snapshot, then changed fields per reading (device)",
+            "GET /api/metrics": "Outbound queue, Telegram and weather cache counters"
         },
         "telegram_config": {
             "bot_configured": TELEGRAM_BOT_TOKEN is not None,
@@ -370,25 +365,36 @@ def home():
             "status": "configured"
         },
         "csv_config": {  # ADDED
-            "csv_file": CSV_FILE_PATH,
+            "storage_dir": STORAGE_DIR,
             "data_interval": "15 seconds",
             "status": "active"
         },
         "status": "active"
     })
 
+def requested_device_state(args=None):
+    """State for ?device=<id>, else the device that reported last"""
+    device_id = (request.args if args is None else args).get('device')
+    if device_id:
+        state = state_store.get(device_id)
+    else:
+        state = state_store.latest()
+    return state if state is not None else DeviceState(device_id or DEFAULT_DEVICE_ID)
+
 @app.route('/test-params', methods=['GET'])
 def test_params():
+    state = requested_device_state()
     return jsonify({
-        "box_temp": box_temp,
-        "power": power,
-        "solar_power": solar_power,
-        "battery_percentage": battery_percentage,
-        "voltage": voltage,
-        "current": current,
-        "light_intensity": light_intensity,
-        "energy": energy,
-        "frequency": frequency
+        "device_id": state.device_id,
+        "box_temp": state.box_temp,
+        "power": state.power,
+        "solar_power": state.solar_power,
+        "battery_percentage": state.battery_percentage,
+        "voltage": state.voltage,
+        "current": state.current,
+        "light_intensity": state.light_intensity,
+        "energy": state.energy,
+        "frequency": state.frequency
     })
 
 @app.route('/check-config', methods=['GET'])
@@ -398,86 +404,89 @@ def check_config():
         "telegram_chat_id_configured": TELEGRAM_CHAT_ID is not None
     })
 
+def weather_key(lat=BAREILLY_LAT, lon=BAREILLY_LON):
+    return f"{lat:.4f},{lon:.4f}"
+
 def get_weather_data(force_refresh=False):
-    global weather_cache, weather_last_updated
-    
-    if not force_refresh and weather_cache and weather_last_updated:
-        cache_age = (datetime.now() - weather_last_updated).total_seconds()
-        if cache_age < CACHE_DURATION:
-            print(f"🌤️ Using cached weather data (age: {int(cache_age)}s)")
-            return weather_cache
-    
+    """Weather for the site from the shared cache (fetches at most once per hour)"""
     try:
-        print("🌤️ Fetching fresh weather data from Open-Meteo...")
-        params = {
-            'latitude': BAREILLY_LAT,
-            'longitude': BAREILLY_LON,
-            'current': 'temperature_2m,relative_humidity_2m,apparent_temperature,precipitation,rain,weather_code,cloud_cover,wind_speed_10m,wind_direction_10m',
-            'hourly': 'temperature_2m,relative_humidity_2m,precipitation,rain,weather_code,cloud_cover,wind_speed_10m',
-            'timezone': 'auto',
-            'forecast_days': 2
-        }
-        
-        response = requests.get(OPEN_METEO_URL, params=params, timeout=15)
-        response.raise_for_status()
-        data = response.json()
-        
-        current = data.get('current', {})
-        hourly = data.get('hourly', {})
-        
-        current_weather = {
-            'temperature': current.get('temperature_2m'),
-            'feels_like': current.get('apparent_temperature'),
-            'humidity': current.get('relative_humidity_2m'),
-            'cloud_cover': current.get('cloud_cover'),
-            'wind_speed': current.get('wind_speed_10m'),
-            'precipitation': current.get('precipitation'),
-            'weather_code': current.get('weather_code'),
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        # Process hourly forecast data for the next few hours
-        hourly_forecast = []
-        if hourly and 'time' in hourly:
-            current_time = datetime.now()
-            for i in range(len(hourly['time'])):
-                hour_time = datetime.fromisoformat(hourly['time'][i].replace('Z', '+00:00'))
-                
-                # Only include future hours (next 12 hours)
-                if hour_time > current_time and (hour_time - current_time) <= timedelta(hours=12):
-                    hourly_data = {
-                        'time': hourly['time'][i],
-                        'temperature': hourly['temperature_2m'][i] if i < len(hourly['temperature_2m']) else None,
-                        'humidity': hourly['relative_humidity_2m'][i] if i < len(hourly['relative_humidity_2m']) else None,
-                        'precipitation': hourly['precipitation'][i] if i < len(hourly['precipitation']) else None,
-                        'rain': hourly['rain'][i] if i < len(hourly['rain']) else None,
-                        'weather_code': hourly['weather_code'][i] if i < len(hourly['weather_code']) else None,
-                        'cloud_cover': hourly['cloud_cover'][i] if i < len(hourly['cloud_cover']) else None,
-                        'wind_speed': hourly['wind_speed_10m'][i] if i < len(hourly['wind_speed_10m']) else None
-                    }
-                    hourly_forecast.append(hourly_data)
-        
-        weather_data = {
-            'current': current_weather,
-            'hourly_forecast': hourly_forecast,
-            'location': {'lat': BAREILLY_LAT, 'lon': BAREILLY_LON, 'name': 'Bareilly, India'},
-            'last_updated': datetime.now().isoformat(),
-            'source': 'open-meteo'
-        }
-        
-        weather_cache = weather_data
-        weather_last_updated = datetime.now()
-        
-        print(f"✅ Weather data: {current_weather['temperature']}°C, {current_weather['humidity']}%")
-        
-        return weather_data
-        
+        return weather_cache.get(weather_key(), force_refresh=force_refresh)
     except Exception as e:
         error_msg = f"Weater API error: {str(e)}"
-        send_telegram_alert("Weather API error","api error")
         print(f"❌ {error_msg}")
         return {'error': error_msg}
 
+def open_meteo_params(key):
+    """(lat, lon, query parameters) of the Open-Meteo request for a "lat,lon" cache key"""
+    lat, lon = (float(part) for part in key.split(','))
+    params = {
+        'latitude': lat,
+        'longitude': lon,
+        'current': 'temperature_2m,relative_humidity_2m,apparent_temperature,precipitation,rain,weather_code,cloud_cover,wind_speed_10m,wind_direction_10m',
+        'hourly': 'temperature_2m,relative_humidity_2m,precipitation,rain,weather_code,cloud_cover,wind_speed_10m',
+        'timezone': 'auto',
+        'forecast_days': 2
+    }
+    return lat, lon, params
+
+def fetch_open_meteo(key):
+    """Fetch and shape current + 12h hourly weather for a "lat,lon" cache key"""
+    lat, lon, params = open_meteo_params(key)
+    print("🌤️ Fetching fresh weather data from Open-Meteo...")
+
+    response = requests.get(OPEN_METEO_URL, params=params, timeout=15)
+    response.raise_for_status()
+    return shape_open_meteo(response.json(), lat, lon)
+
+def shape_open_meteo(data, lat, lon):
+    """Current conditions + next 12 hours from an Open-Meteo forecast response"""
+    current = data.get('current', {})
+    hourly = data.get('hourly', {})
+
+    current_weather = {
+        'temperature': current.get('temperature_2m'),
+        'feels_like': current.get('apparent_temperature'),
+        'humidity': current.get('relative_humidity_2m'),
+        'cloud_cover': current.get('cloud_cover'),
+        'wind_speed': current.get('wind_speed_10m'),
+        'precipitation': current.get('precipitation'),
+        'weather_code': current.get('weather_code'),
+        'timestamp': datetime.now().isoformat()
+    }
+
+    # Process hourly forecast data for the next few hours
+    hourly_forecast = []
+    if hourly and 'time' in hourly:
+        current_time = datetime.now()
+        for i in range(len(hourly['time'])):
+            hour_time = datetime.fromisoformat(hourly['time'][i].replace('Z', '+00:00'))
+
+            # Only include future hours (next 12 hours)
+            if hour_time > current_time and (hour_time - current_time) <= timedelta(hours=12):
+                hourly_data = {
+                    'time': hourly['time'][i],
+                    'temperature': hourly['temperature_2m'][i] if i < len(hourly['temperature_2m']) else None,
+                    'humidity': hourly['relative_humidity_2m'][i] if i < len(hourly['relative_humidity_2m']) else None,
+                    'precipitation': hourly['precipitation'][i] if i < len(hourly['precipitation']) else None,
+                    'rain': hourly['rain'][i] if i < len(hourly['rain']) else None,
+                    'weather_code': hourly['weather_code'][i] if i < len(hourly['weather_code']) else None,
+                    'cloud_cover': hourly['cloud_cover'][i] if i < len(hourly['cloud_cover']) else None,
+                    'wind_speed': hourly['wind_speed_10m'][i] if i < len(hourly['wind_speed_10m']) else None
+                }
+                hourly_forecast.append(hourly_data)
+
+    weather_data = {
+        'current': current_weather,
+        'hourly_forecast': hourly_forecast,
+        'location': {'lat': lat, 'lon': lon, 'name': 'Bareilly, India'},
+        'last_updated': datetime.now().isoformat(),
+        'source': 'open-meteo'
+    }
+
+    print(f"✅ Weather data: {current_weather['temperature']}°C, {current_weather['humidity']}%")
+    
+    return weather_data
+
 @app.route('/weather', methods=['GET'])
 def weather():
     try:
@@ -507,42 +516,36 @@ def hourly_forecast():
 @app.route('/combined-data', methods=['GET'])
 def combined_data():
     try:
-        esp32_data = {
-            "box_temp": box_temp,
-            "power": power,
-            "solar_power": solar_power,
-            "battery_percentage": battery_percentage,
-            "voltage": voltage,
-            "current": current,
-            "esp32_last_updated": datetime.now().isoformat() if any([box_temp, power, solar_power]) else None
-        }
-        
+        state = requested_device_state()
         weather_data = get_weather_data()
-        
-        # Prepare combined data for your app
-        combined_data = {
-            "esp32_data": esp32_data,
-            "alerts": {
-                "alert1": alert1,
-                "alert2": alert2,
-                "alert3": alert3,
-                "alert4": alert4,
-                "alert5": alert5,
-                "alert6": alert6,
-                "alert7": alert7,
-                "alert8": alert8
-            },
-            "weather_data": weather_data if 'error' not in weather_data else {"error": weather_data['error']},
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        # Send combined data to your app (non-blocking)
-        import threading
-        thread = threading.Thread(target=send_to_app, args=(combined_data,))
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({"esp32_data": esp32_data, "weather_data": weather_data})
+
+        def build():
+            esp32_data = {
+                "device_id": state.device_id,
+                "box_temp": state.box_temp,
+                "power": state.power,
+                "solar_power": state.solar_power,
+                "battery_percentage": state.battery_percentage,
+                "voltage": state.voltage,
+                "current": state.current,
+                "esp32_last_updated": datetime.fromtimestamp(state.last_updated).isoformat() if state.last_updated else None
+            }
+            
+            # Prepare combined data for your app
+            combined_data = {
+                "esp32_data": esp32_data,
+                "alerts": state.alerts_dict(),
+                "weather_data": weather_data if 'error' not in weather_data else {"error": weather_data['error']},
+                "timestamp": datetime.now().isoformat()
+            }
+            
+            # Send combined data to your app (non-blocking) - once per new snapshot
+            send_to_app(combined_data)
+            
+            return {"esp32_data": esp32_data, "weather_data": weather_data}
+
+        snapshot = snapshots.get(('combined', state.device_id), snapshot_version(state, weather_data), build)
+        return snapshot.response(request)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -561,43 +564,13 @@ def test_open_meteo():
         return jsonify({"success": False, "error": str(e)})
 
 # Telegram alert functions
-def send_telegram_alert(message, alert_type="general"):
-    """Send alert message to Telegram bot"""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        print("⚠️ Telegram credentials not configured")
-        return {"error": "Telegram credentials not configured"}
-    
-    # Check if we should send this alert (cooldown period)
-    current_time = datetime.now().timestamp()
-    last_sent = last_alert_time.get(alert_type, 0)
-    
-    if current_time - last_sent < ALERT_COOLDOWN:
-        
-        return {"status": "skipped", "reason": "cooldown"}
-    
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    
-   
-    formatted_message = f"🚨 <b>Solar Monitor Alert</b> 🚨\n\n{message}\n\n<i>Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</i>"
-    
-    payload = {
-        "chat_id": TELEGRAM_CHAT_ID,
-        "text": formatted_message,
-        "parse_mode": "HTML"
-    }
-    
-    try:
-        response = requests.post(url, json=payload, timeout=10)
-        response.raise_for_status()
-        print(f"✅ Alert sent to Telegram: {message}")
-        
-        # Update last sent time for this alert type
-        last_alert_time[alert_type] = current_time
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        error_msg = f"Failed to send Telegram message: {str(e)}"
-        print(f"❌ {error_msg}")
-        return {"error": error_msg}
+def send_telegram_alert(message, alert_type="general", device_id=None):
+    """Queue an alert for Telegram; never blocks the caller.
+
+    The cooldown is applied per (device, alert type) and alerts raised close
+    together are delivered as one digest message.
+    """
+    return telegram.enqueue(message, alert_type, device_id)
 
 @app.route('/alert', methods=['POST'])
 def handle_alert():
@@ -612,8 +585,8 @@ def handle_alert():
         message = data['message']
         alert_type = data.get('type', 'general')
         
-        # Send to Telegram
-        result = send_telegram_alert(message, alert_type)
+        # Send to Telegram right away so the caller gets Telegram's answer
+        result = telegram.send_now(message, alert_type, data.get('device_id'))
         
         if 'error' in result:
             return jsonify({"error": result['error']}), 500
@@ -624,171 +597,136 @@ def handle_alert():
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
 # Alert checking functions.....................................................................................................
-def check_alerts():
-    global alert1, alert2, alert3, alert4, alert5,nonessentialrelaystate
-    try:
-        alert1 = None
-        alert2 = None
-        alert3 = None
-        alert4 = None
-        alert5 = None
-
-        # Skip alert checks if critical data is missing
-        if current_battery_percent is None or light_intensity is None or solar_voltage is None or solar_current is None:
-            return
+def alert_params():
+    """Current thresholds for the alert rules (module globals above)"""
+    return {
+        'threshold_slope': threshold_slope,
+        'threshold_battery_slope': threshold_battery_slope,
+        'inverter_rating': inverter_rating,
+        'averageenergyconsume': averageenergyconsume,
+    }
 
-        # 1 Alert for overcharge or discharge
-        if current_battery_percent == 100:
-            
-            alert1 = "Overcharge!"
-            nonessentialrelaystate=1
-            send_telegram_alert(alert1, "battery")
-        if current_battery_percent < 10:
-            alert1 = "Discharge!"
-            nonessentialrelaystate=0
-            send_telegram_alert(alert1, "battery")
-
-        # 2 Sun is sufficient but panel not produce power enough as it should be:
-        irradiance = light_intensity / 120   # conversion of lux to irradiance
-        solar_power = (solar_voltage * solar_current) / 1000  # both should be global variables
-        
-        # FIXED: Replace range() with proper float comparisons
-        if 900 <= irradiance < 1200:
-            if not (0.31 <= solar_power <= 0.37):
-                alert2 = "solar panel low efficiency!"
-                nonessentialrelaystate=0
-                send_telegram_alert(alert2, "panel alert")
-
-        if 600 <= irradiance < 900:
-            if not (0.22 <= solar_power <= 0.30):
-                alert2 = "solar panel low efficiency!"
-                nonessentialrelaystate=0
-                send_telegram_alert(alert2, "panel alert")
-
-        if 350 <= irradiance < 600:
-            if not (0.14 <= solar_power <= 0.22):
-                alert2 = "solar panel low efficiency!"
-                nonessentialrelaystate=0
-                send_telegram_alert(alert2, "panel alert")
-
-        if 150 <= irradiance < 350:
-            if not (0.05 <= solar_power <= 0.14):
-                alert2 = "solar panel low efficiency!"
-                nonessentialrelaystate=0
-                send_telegram_alert(alert2, "panel alert")
-
-        if irradiance < 100:
-            if not (0.0 <= solar_power <= 0.05):
-                alert2 = "solar panel low efficiency!"
-                nonessentialrelaystate=0
-                send_telegram_alert(alert2, "panel alert")
-
-        # 3 overload conditions:
-        if voltage is not None and current is not None:
-            if (voltage * current / 1000) > inverter_rating:
-                alert3 = "Overload!"
-                nonessentialrelaystate=0
-                send_telegram_alert(alert3, "load alert")
-
-        # 4 sudden drop in sunlight:         
-        if prev_light_intensity is not None:
-            current_light_intensity = irradiance
-            # Assuming timegap is 5 minutes (300 seconds) between readings
-            timegap = 300
-            light_slope = (current_light_intensity - prev_light_intensity) / timegap
-            if light_slope < threshold_slope:
-                alert4 = "Sudden drop in sun light!"
-                nonessentialrelaystate=0
-                send_telegram_alert(alert4, "light intensity alert")
-
-        # 5 Solar generate power But battery not charge:
-        if solar_power != 0 and prev_battery_percent is not None:  # solar produces power 
-            timegap = 300  # 5 minutes in seconds
-            battery_percent_slope = (current_battery_percent - prev_battery_percent) / timegap
-            if battery_percent_slope < threshold_battery_slope:
-                alert5 = "Battery not charging!"
-                nonessentialrelaystate=0
-                send_telegram_alert(alert5, "battery alert")
+def device_trends(state):
+    """Ring buffer of recent irradiance/battery readings of a device (created on first use)"""
+    if state.trends is None:
+        state.trends = RingBuffer(('irradiance', 'battery'), window=TREND_WINDOW)
+    return state.trends
 
+def check_alerts(state, timestamp=None, weather_data=None):
+    """Evaluate alerts 1-8 and the relay for one device; caller holds the device lock"""
+    try:
+        values = {name: getattr(state, name) for name in (
+            'battery_percentage', 'light_intensity', 'solar_voltage', 'solar_current', 'voltage', 'current')}
+        values['current_battery'] = state.current_battery_percent
+
+        # Slopes over the actual reading times, not an assumed gap
+        light, battery = _to_float(state.light_intensity), _to_float(state.battery_percentage)
+        trends = device_trends(state)
+        trends.append(timestamp if timestamp is not None else time.time(), [light / 120, battery])
+        values['light_slope'] = trends.slope('irradiance')
+        values['battery_slope'] = trends.slope('battery')
+        # The models are trained on stored rows: ESP32 metrics, weather and relay state
+        forecast_service.observe(state.device_id, timestamp if timestamp is not None else time.time(),
+                                 {**state.metrics_dict(), **weather_columns(weather_data or {})})
+        values['predicted_energy'] = forecast_service.predict(state.device_id, PREDICTION_HORIZON)
+        alerts, relay = APP_RULES.evaluate_one(values, alert_params(), state.nonessentialrelaystate)
+        for name, message in alerts.items():
+            setattr(state, name, message)
+            if message:
+                send_telegram_alert(message, APP_RULES.alert_types[name], state.device_id)
+        state.nonessentialrelaystate = relay
     except Exception as e:
         print(f"❌ Error in alert system: {str(e)}")
-#........................................................................................................................
-def predictionalerts():
-    global alert6, alert7, alert8, nonessentialrelaystate
-    predicttotalenergy=random.random()*4
+#.........................................................................................................................................
+
+# Batched alert evaluation (used by /esp32-data/batch)..................................................................
+MAX_BATCH_READINGS = 5000
+
+def _to_float(value):
     try:
-        alert6=alert7=alert8=None
-        if averageenergyconsume > predicttotalenergy:
-            # 6. send alert that consumption is higher than expected solar generation
-            alert6 = "consumption is higher than expected solar generation!"
-            send_telegram_alert("consumption is higher than expected solar generation!","prediction alert")
-        
-            if battery_percentage < 40:
-                # 7. send alert that Battery is low. Risk of blackout in future 
-                alert7 = "Battery is low. Risk of blackout in future!"
-                send_telegram_alert("Battery is low. Risk of blackout in future!","prediction alert")
-                # take action to switch off relay of non essential load
-                nonessentialrelaystate=0
-
-        if averageenergyconsume < predicttotalenergy:
-            # show that solar generation is sufficient as per your need
-            if battery_percentage > 40 and battery_percentage < 80:
-                # show that you can turn on non essential loads
-                nonessentialrelaystate=1
-                
-
-            if battery_percentage > 80:
-                # 8. your battery may overcharge in next upcoming hours
-                alert8 = "Battery may overcharge in next upcoming hours!"
-                nonessentialrelaystate=1
-                send_telegram_alert("Battery may overcharge in next upcoming hours!","prediction alert")
-    except Exception as e:
-        print(f"❌ Error in prediction alerts: {str(e)}")
+        return float(value) if value not in (None, '') else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+def evaluate_alerts_batch(state, columns, timestamps, weather_data=None):
+    """Alert rules over consecutive (time-sorted) readings of one device.
+
+    Readings are treated exactly as if they had been posted one by one: the
+    light/battery slopes after each reading come from the device's ring buffer
+    extended with the batch. Returns (alerts, relay, current_battery,
+    current_light) where alerts maps alert1..alert8 to object arrays. The
+    caller holds the device lock.
+    """
+    battery = columns['battery_percentage']
+    light = columns['light_intensity']
+
+    current_battery = np.where(np.isnan(battery) | (battery == 0), 0.0, battery)
+    current_light = np.where(np.isnan(light) | (light == 0), 0.0, light)
+    trends = device_trends(state).extend(timestamps, np.column_stack((light / 120, battery)))
+    inputs = dict(columns)
+    inputs['current_battery'] = current_battery
+    inputs['light_slope'] = trends['irradiance'][3]
+    inputs['battery_slope'] = trends['battery'][3]
+    # Forecast after each reading, with one observe / predict per forecast step
+    exogenous = {**weather_columns(weather_data or {}), 'nonessentialrelaystate': state.nonessentialrelaystate}
+    inputs['predicted_energy'] = forecast_service.observe_batch(
+        state.device_id, timestamps, columns, PREDICTION_HORIZON, exogenous)
+
+    alerts, relay = APP_RULES.evaluate(inputs, alert_params(), state.nonessentialrelaystate)
+    return alerts, relay, current_battery, current_light
 #.........................................................................................................................................
 
+def snapshot_version(state, weather_data):
+    """Changes with every reading of the device and every weather fetch"""
+    return state.last_updated, weather_data.get('last_updated') or weather_data.get('error')
+
+def dashboard_snapshot(state, weather_data):
+    """Encoded dashboard data of a device (rebuilt only after a new reading / weather fetch)"""
+    def build():
+        esp32_data = state.esp32_dict()
+        esp32_data["device_id"] = state.device_id
+        return {
+            "esp32_data": esp32_data,
+            "alerts": state.alerts_dict(),
+            "weather_data": weather_data if 'error' not in weather_data else {"error": weather_data['error']},
+            "timestamp": datetime.fromtimestamp(state.last_updated or time.time()).isoformat()
+        }
+
+    return snapshots.get(('dashboard', state.device_id), snapshot_version(state, weather_data), build)
+
 @app.route('/api/dashboard-data', methods=['GET', 'POST'])
 def dashboard_data():
-    """Serve dashboard data directly from this Flask app"""
+    """Serve dashboard data directly from this Flask app.
+
+    Encoded once per reading / weather update and served with an ETag:
+    If-None-Match polls get 304 until the device reports again.
+    """
     try:
         # Get the latest data
-        esp32_data = {
-            "box_temp": box_temp,
-            "power": power,
-            "solar_power": solar_power,
-            "battery_percentage": battery_percentage,
-            "voltage": voltage,
-            "current": current,
-            "solar_voltage": solar_voltage,
-            "solar_current": solar_current,
-            "light_intensity": light_intensity,
-            "energy": energy,
-            "frequency": frequency,
-            "nonessentialrelaystate": nonessentialrelaystate
-        }
-        
+        state = requested_device_state()
         weather_data = get_weather_data(force_refresh=False)
-        
-        combined_data = {
-            "esp32_data": esp32_data,
-            "alerts": {
-                "alert1": alert1,
-                "alert2": alert2,
-                "alert3": alert3,
-                "alert4": alert4,
-                "alert5": alert5,
-                "alert6": alert6,
-                "alert7": alert7,
-                "alert8": alert8
-            },
-            "weather_data": weather_data if 'error' not in weather_data else {"error": weather_data['error']},
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        return jsonify(combined_data)
+        return dashboard_snapshot(state, weather_data).response(request)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/stream', methods=['GET'])
+def stream():
+    """Push dashboard data as Server-Sent Events instead of polling /api/dashboard-data.
+
+    The first event ('snapshot') holds the same data as /api/dashboard-data;
+    each later 'delta' event holds only the fields that changed (null for
+    removed ones). ?device=<id> limits the stream to one device.
+    """
+    subscriber = live_broker.subscribe(request.args.get('device'))
+    if subscriber is None:
+        return jsonify({"error": "Too many live clients, poll /api/dashboard-data instead"}), 503
+    return Response(
+        live_broker.stream(subscriber),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -797,72 +735,402 @@ def health_check():
         "status": "healthy", 
         "telegram": telegram_status,
         "app": "configured",
-        "csv": "active"  # ADDED
+        "csv": "active",  # ADDED
+        "app_queue_depth": app_forwarder.depth()
     }), 200
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Queue depths, delivery counters and latencies of the background senders"""
+    return jsonify({
+        "app_forwarder": app_forwarder.stats(),
+        "telegram": telegram.stats(),
+        "weather_cache": weather_cache.stats(),
+        "live_stream": live_broker.stats(),
+        "snapshots": snapshots.stats()
+    })
+
 # NEW CSV ENDPOINTS FOR MODEL ACCESS - ADDED
+def columns_to_records(data):
+    """Column arrays from the store -> list of JSON-friendly row dicts"""
+    names = list(data)
+    values = [[datetime.fromtimestamp(ts).isoformat() for ts in data['timestamp'].tolist()]]
+    for name in names[1:]:
+        column = data[name]
+        if column.dtype.kind == 'f':
+            values.append([None if v != v else v for v in column.tolist()])
+        else:
+            values.append(column.tolist())
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+MAX_QUERY_LIMIT = 50000
+DEFAULT_QUERY_LIMIT = 1000  # rows per /api/csv-data page when no limit is given
+
+def parse_history_query(args=None):
+    """Read start/end/columns/limit/cursor/device query parameters (ValueError if invalid)"""
+    args = request.args if args is None else args
+    start = parse_reading_timestamp(args.get('start'))
+    end = parse_reading_timestamp(args.get('end'))
+    columns = None
+    if args.get('columns'):
+        columns = [name.strip() for name in args['columns'].split(',') if name.strip()]
+        unknown = [name for name in columns if name != 'timestamp' and name not in ts_store.kinds]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    limit = int(args['limit']) if args.get('limit') else DEFAULT_QUERY_LIMIT
+    if not 0 < limit <= MAX_QUERY_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_QUERY_LIMIT}")
+    cursor = args.get('cursor') or None
+    if cursor is not None:
+        parse_cursor(cursor)  # ValueError for a malformed cursor
+    return {
+        'start': start,
+        'end': end,
+        'columns': columns,
+        'limit': limit,
+        'cursor': cursor,
+        'device_id': args.get('device'),
+    }
+
+def gzip_stream(chunks):
+    """Compress a stream of text chunks incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def ndjson_stream(query):
+    for data in ts_store.iter_chunks(query['start'], query['end'], query['device_id'], query['columns']):
+        yield ''.join(json.dumps(row) + '\n' for row in columns_to_records(data))
+
+def history_stream(query, fmt, filename, args, accept_encoding):
+    """(chunks, mimetype, headers) of an NDJSON/CSV download read chunk by chunk"""
+    if fmt == 'csv':
+        if query['columns']:
+            headers = ['timestamp'] + [name for name in query['columns'] if name != 'timestamp']
+        else:
+            headers = CSV_HEADERS
+        chunks = ts_store.iter_csv(headers, query['start'], query['end'], query['device_id'])
+        mimetype = 'text/csv'
+    else:
+        chunks = ndjson_stream(query)
+        mimetype = 'application/x-ndjson'
+
+    response_headers = {'Content-Disposition': f'attachment; filename={filename}.{fmt}'}
+    use_gzip = (args.get('gzip', 'true').lower() != 'false'
+                and 'gzip' in (accept_encoding or ''))
+    if use_gzip:
+        response_headers['Content-Encoding'] = 'gzip'
+        chunks = gzip_stream(chunks)
+    return chunks, mimetype, response_headers
+
+def history_stream_response(query, fmt, filename):
+    """Chunked NDJSON/CSV response read from disk chunk by chunk (constant memory)"""
+    chunks, mimetype, headers = history_stream(query, fmt, filename, request.args,
+                                               request.headers.get('Accept-Encoding', ''))
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+def resampled_data(query, args):
+    """Regular grid of float columns for [start, end] (default: last 24 hours).
+
+    Built on read from the stored readings: how=last|mean per step, then
+    interpolation up to interpolate_limit steps and Energy forward fill up to
+    ffill_limit steps; longer gaps stay null. Recorded gap intervals in the
+    window are returned alongside. Raises ValueError for invalid parameters.
+    """
+    step = float(args['step'])
+    end = query['end'] or time.time()
+    start = query['start'] if query['start'] is not None else end - 86400
+    if step <= 0 or end < start:
+        raise ValueError("step must be positive and start before end")
+    if (end - start) / step > MAX_QUERY_LIMIT:
+        raise ValueError(f"At most {MAX_QUERY_LIMIT} steps per request - use a larger step")
+    columns = query['columns'] or [name for name, kind in ts_store.columns if kind == 'f']
+    columns = [name for name in columns if name != 'timestamp']
+    if any(ts_store.kinds[name] != 'f' for name in columns):
+        raise ValueError("Only numeric columns can be resampled")
+    grid = read_grid(
+        ts_store, start, end, step, columns, query['device_id'],
+        how=args.get('how', 'last'),
+        interpolate_limit=int(args.get('interpolate_limit', INTERPOLATE_LIMIT)),
+        ffill_limit=int(args.get('ffill_limit', FFILL_LIMIT)),
+    )
+    gaps = ts_store.gaps.read(start, end, query['device_id'])
+    return {
+        "step": step,
+        "data": columns_to_records(grid),
+        "total_records": len(grid['timestamp']),
+        "gaps": [
+            {"start": datetime.fromtimestamp(s).isoformat(), "end": datetime.fromtimestamp(e).isoformat()}
+            for s, e in zip(gaps['start'].tolist(), gaps['end'].tolist())
+        ],
+        "last_updated": datetime.now().isoformat()
+    }
+
+def csv_data_page(query):
+    """One page of stored rows (next_cursor continues it)"""
+    records, next_cursor = ts_store.query(
+        query['start'], query['end'], query['device_id'], query['limit'], query['cursor']
+    )
+    rows = columns_to_records(ts_store.decode(records, query['columns']))
+    return {
+        "data": rows,
+        "total_records": len(rows),
+        "next_cursor": next_cursor,
+        "last_updated": datetime.now().isoformat()
+    }
+
+def resampled_response(query):
+    try:
+        return jsonify(resampled_data(query, request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
 @app.route('/api/csv-data', methods=['GET'])
 def get_csv_data():
-    """Endpoint for model to fetch CSV data"""
+    """Endpoint for model to fetch CSV data.
+
+    Optional query parameters: start / end (ISO or epoch seconds), columns
+    (comma separated), device, limit (default DEFAULT_QUERY_LIMIT rows per
+    page) and cursor (from next_cursor, null on the last page).
+    format=ndjson or format=csv streams the whole window instead of paging
+    (gzip-compressed when the client accepts it, unless gzip=false).
+    step (seconds) returns the window on a regular grid instead, with short
+    gaps filled (see resampled_data).
+    """
     try:
-        if not os.path.exists(CSV_FILE_PATH):
-            return jsonify({"error": "CSV file not found"}), 404
-        
-        # Read the CSV file
-        df = pd.read_csv(CSV_FILE_PATH)
-        
-        # Convert to JSON
-        data = df.to_dict('records')
-        
-        return jsonify({
-            "data": data,
-            "total_records": len(data),
-            "last_updated": datetime.now().isoformat()
-        })
+        try:
+            query = parse_history_query()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if request.args.get('step'):
+            return resampled_response(query)
+
+        fmt = request.args.get('format', 'json').lower()
+        if fmt in ('ndjson', 'csv'):
+            return history_stream_response(query, fmt, 'solar_data')
+        if fmt != 'json':
+            return jsonify({"error": "format must be json, ndjson or csv"}), 400
+
+        return jsonify(csv_data_page(query))
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/csv-stats', methods=['GET'])
 def get_csv_stats():
-    """Get statistics about the CSV data"""
+    """Get statistics about the CSV data (maintained on every write, no data scan)"""
     try:
-        if not os.path.exists(CSV_FILE_PATH):
-            return jsonify({"error": "CSV file not found"}), 404
-        
-        df = pd.read_csv(CSV_FILE_PATH)
+        stats = ts_store.stats()
+        gaps = ts_store.gaps.summary(device_id=request.args.get('device') or None)
         
-        stats = {
-            "total_records": len(df),
-            "data_sources": df['data_source'].value_counts().to_dict(),
-            "missing_data_count": len(df[df['data_source'] == 'missing_data']),
+        result = {
+            "total_records": stats.total_records,
+            "data_sources": stats.data_sources,
+            # NaN rows written by older versions + 15 s checks covered by gap intervals
+            "missing_data_count": stats.data_sources.get('missing_data', 0) + int(gaps['missing_seconds'] // DATA_INTERVAL),
+            "gaps": gaps,
             "date_range": {
-                "start": df['timestamp'].min(),
-                "end": df['timestamp'].max()
+                "start": datetime.fromtimestamp(stats.min_ts).isoformat() if stats.min_ts is not None else None,
+                "end": datetime.fromtimestamp(stats.max_ts).isoformat() if stats.max_ts is not None else None
             },
-            "columns": list(df.columns)
+            "null_counts": stats.null_counts,
+            "columns": CSV_HEADERS
         }
+        if request.args.get('daily', 'false').lower() == 'true':
+            result["daily"] = stats.daily
         
-        return jsonify(stats)
+        return jsonify(result)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/forecast', methods=['GET'])
+def forecast():
+    """+1h / +1d Energy forecast of a device (?device=, default: latest reporting device)"""
+    device_id = request.args.get('device')
+    if not device_id:
+        latest = state_store.latest()
+        device_id = latest.device_id if latest else DEFAULT_DEVICE_ID
+    result = forecast_service.forecast(device_id)
+    if result is None:
+        return jsonify({"error": f"No readings from device {device_id} yet"}), 404
+    return jsonify({"device_id": device_id, **result})
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """Downsampled history for charts.
+
+    Picks the finest rollup tier (1m, 15m, 1h, 1d) that keeps the range under
+    max_points points (default 1000), e.g. 30 days -> hourly, ~720 points.
+    Without device, each point merges all devices of its bucket; device (one
+    id or a comma separated list) returns one series per device, the points
+    of all series counting towards max_points. Points are in time order.
+    Query parameters: start / end (default: last 24 hours), device, columns
+    (metric names), max_points, tier (force a tier).
+    """
+    try:
+        end = parse_reading_timestamp(request.args.get('end'))
+        end = time.time() if end is None else end
+        start = parse_reading_timestamp(request.args.get('start'))
+        start = end - 86400 if start is None else start
+        max_points = request.args.get('max_points', 1000, type=int)
+        if end <= start or max_points <= 0:
+            return jsonify({"error": "end must be after start and max_points positive"}), 400
+        devices = [name.strip() for name in request.args.get('device', '').split(',') if name.strip()] or None
+        tier = request.args.get('tier') or rollup_store.choose_tier(start, end, max_points, len(devices or [None]))
+        if tier not in rollup_store.tier_seconds:
+            return jsonify({"error": f"tier must be one of {', '.join(rollup_store.tier_seconds)}"}), 400
+        metrics = None
+        if request.args.get('columns'):
+            metrics = [name.strip() for name in request.args['columns'].split(',') if name.strip()]
+            unknown = [name for name in metrics if name not in rollup_store.metrics]
+            if unknown:
+                return jsonify({"error": f"Unknown columns: {', '.join(unknown)}"}), 400
+
+        data = rollup_store.query(tier, start, end, devices, metrics)
+        points = columns_to_records(data)
+        return jsonify({
+            "tier": tier,
+            "bucket_seconds": rollup_store.tier_seconds[tier],
+            "start": datetime.fromtimestamp(start).isoformat(),
+            "end": datetime.fromtimestamp(end).isoformat(),
+            "points": points,
+            "total_points": len(points)
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/csv-export', methods=['GET'])
+def export_csv():
+    """Download stored readings in the old solar_data.csv format (streamed)"""
+    try:
+        try:
+            query = parse_history_query()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        query['columns'] = None
+        return history_stream_response(query, 'csv', 'solar_data')
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # Initialize the system when the app starts - FIXED FOR FLASK 3.0
 @app.before_request
 def initialize_system():
     if not hasattr(app, 'initialized'):
-        init_csv_file()
+        init_storage()
         start_background_scheduler()
         app.initialized = True
         print("✅ Solar Monitoring System Initialized")
 
+def ingest_reading(data, weather_data):
+    """Apply one JSON reading to its device: state, alerts, storage, app and live push.
+
+    Returns the response body for the device. Shared by the Flask view and
+    the asyncio server (async_app.py), which fetch weather_data their own way.
+    """
+    # Typed values of every known alias (0 is a reading, not a missing value)
+    reading, invalid_fields = parse_reading(data)
+    if invalid_fields:
+        print(f"⚠️ Ignoring invalid values for {', '.join(invalid_fields)}")
+    device_id = reading.device_key(DEFAULT_DEVICE_ID)
+    
+    # Update this device's state; other devices are never blocked
+    with state_store.locked(device_id) as state:
+        state.box_temp = reading.box_temp
+        state.frequency = reading.frequency
+        state.power_factor = reading.power_factor
+        state.voltage = reading.voltage
+        state.current = reading.current
+        state.power = reading.power
+        state.energy = reading.energy
+        state.solar_voltage = reading.solar_voltage
+        state.solar_current = reading.solar_current
+        state.solar_power = reading.solar_power
+        state.battery_percentage = reading.battery_percentage
+        state.light_intensity = reading.light_intensity
+        state.battery_voltage = reading.battery_voltage
+        
+        print(f"✅ [{device_id}] Box Temp: {state.box_temp}°C, Power: {state.power}W, Solar: {state.solar_power}W, Battery: {state.battery_percentage}%")
+        
+        # Update alert system variables
+        state.prev_battery_percent = state.current_battery_percent
+        state.current_battery_percent = state.battery_percentage if state.battery_percentage else 0
+        
+        state.prev_light_intensity = state.current_light_intensity
+        state.current_light_intensity = state.light_intensity if state.light_intensity else 0
+
+        check_alerts(state, reading.timestamp, weather_data)
+        state_store.touch(state)
+        
+        # PREPARE DATA FOR CSV - ADDED
+        esp32_data_for_csv = state.metrics_dict()
+        esp32_data = state.esp32_dict()
+        alerts_data = state.alerts_dict()
+        nonessentialrelaystate = state.nonessentialrelaystate
+    
+    # SAVE READING - buffered in memory, flushed to disk by size/time
+    save_reading(esp32_data_for_csv, weather_data, alerts_data, device_id)
+    
+    # Prepare combined data for your app
+    esp32_data["device_id"] = device_id
+    combined_data = {
+        "esp32_data": esp32_data,
+        "alerts": alerts_data,
+        "weather_data": weather_data if 'error' not in weather_data else {"error": weather_data['error']},
+        "timestamp": datetime.now().isoformat()
+    }
+    
+    # Send combined data to your app (non-blocking) and to open dashboards
+    send_to_app(combined_data)
+    live_broker.publish(device_id, combined_data)
+    
+    # FIXED: Handle case where weather data contains error
+    if 'error' in weather_data:
+        # Return basic success response without weather data
+        response_data = {
+            "message": "Data received successfully (weather data unavailable)", 
+            "status": "ok",
+            "weather_available": False,
+            "weather_error": weather_data['error']
+        }
+    else:
+        # Return response with weather data
+        response_data = {
+            "message": "Data received successfully",
+            "device_id": device_id,
+            "nonessentialrelaystate":nonessentialrelaystate,
+            **alerts_data,
+            
+            "status": "ok",
+            "weather_available": True,
+            "weather": {
+                "temperature": weather_data['current'].get('temperature'),
+                "humidity": weather_data['current'].get('humidity'),
+                "cloud_cover": weather_data['current'].get('cloud_cover'),
+                "wind_speed": weather_data['current'].get('wind_speed'),
+                "precipitation": weather_data['current'].get('precipitation'),
+                "weather_code": weather_data['current'].get('weather_code'),
+                "feels_like": weather_data['current'].get('feels_like'),
+                "timestamp": weather_data['current'].get('timestamp')
+            },
+            "location": {
+                "lat": BAREILLY_LAT,
+                "lon": BAREILLY_LON,
+                "name": "Bareilly, India"
+            }
+        }
+    if invalid_fields:
+        response_data["invalid_fields"] = invalid_fields
+    
+    return response_data
+
 @app.route('/esp32-data', methods=['POST'])
 def receive_esp32_data():
-    global box_temp, frequency, power_factor, voltage, current, power, energy
-    global solar_voltage, solar_current, solar_power, battery_percentage
-    global light_intensity, battery_voltage, prev_light_intensity, current_light_intensity
-    global prev_battery_percent, current_battery_percent, nonessentialrelaystate, last_data_received
+    global last_data_received
 
     print("📨 Received POST request to /esp32-data")
     
@@ -877,162 +1145,198 @@ def receive_esp32_data():
         
         print(f"✅ JSON data received: {data}")
         
-        # Update ESP32 data variables
-        box_temp = data.get('box_temp') or data.get('BoxTemperature')
-        frequency = data.get('frequency') or data.get('Frequency')
-        power_factor = data.get('power_factor') or data.get('PowerFactor')
-        voltage = data.get('voltage') or data.get('Voltage')
-        current = data.get('current') or data.get('Current')
-        power = data.get('power') or data.get('Power')
-        energy = data.get('energy') or data.get('Energy')
-        solar_voltage = data.get('solar_voltage') or data.get('SolarVoltage')
-        solar_current = data.get('solar_current') or data.get('solarCurrent')
-        solar_power = data.get('solar_power') or data.get('solarPower')
-        battery_percentage = data.get('battery_percentage') or data.get('batteryPercentage')
-        light_intensity = data.get('light_intensity') or data.get('lightIntensity')
-        battery_voltage = data.get('battery_voltage') or data.get('batteryVoltage')
-        
-        print(f"✅ Box Temp: {box_temp}°C, Power: {power}W, Solar: {solar_power}W, Battery: {battery_percentage}%")
-        
-        # Update alert system variables
-        prev_battery_percent = current_battery_percent
-        current_battery_percent = battery_percentage if battery_percentage else 0
-        
-        prev_light_intensity = current_light_intensity
-        current_light_intensity = light_intensity if light_intensity else 0
-
-        check_alerts()
-        predictionalerts()
-        
-        # PREPARE DATA FOR CSV - ADDED
-        esp32_data_for_csv = {
-            'box_temp': box_temp,
-            'frequency': frequency,
-            'power_factor': power_factor,
-            'voltage': voltage,
-            'current': current,
-            'power': power,
-            'energy': energy,
-            'solar_voltage': solar_voltage,
-            'solar_current': solar_current,
-            'solar_power': solar_power,
-            'battery_percentage': battery_percentage,
-            'light_intensity': light_intensity,
-            'battery_voltage': battery_voltage,
-            'nonessentialrelaystate': nonessentialrelaystate
-        }
-        
         # Get current weather data
         weather_data = get_weather_data(force_refresh=False)
         
-        # Prepare alerts data for CSV - ADDED
-        alerts_data = {
-            'alert1': alert1,
-            'alert2': alert2,
-            'alert3': alert3,
-            'alert4': alert4,
-            'alert5': alert5,
-            'alert6': alert6,
-            'alert7': alert7,
-            'alert8': alert8
-        }
-        
-        # SAVE TO CSV - ADDED (non-blocking)
-        import threading
-        csv_thread = threading.Thread(target=save_to_csv, args=(esp32_data_for_csv, weather_data, alerts_data))
-        csv_thread.daemon = True
-        csv_thread.start()
-        
-        # Get current weather data
-        weather_data = get_weather_data(force_refresh=False)
-        
-        # Prepare combined data for your app
-        combined_data = {
-            "esp32_data": {
-                "box_temp": box_temp,
-                "power": power,
-                "solar_power": solar_power,
-                "battery_percentage": battery_percentage,
-                "voltage": voltage,
-                "current": current,
-                "solar_voltage": solar_voltage,
-                "solar_current": solar_current,
-                "light_intensity": light_intensity,
-                "energy": energy,
-                "frequency": frequency,
-                "nonessentialrelaystate": nonessentialrelaystate
-            },
-            "alerts": {
-                "alert1": alert1,
-                "alert2": alert2,
-                "alert3": alert3,
-                "alert4": alert4,
-                "alert5": alert5,
-                "alert6": alert6,
-                "alert7": alert7,
-                "alert8": alert8
-            },
-            "weather_data": weather_data if 'error' not in weather_data else {"error": weather_data['error']},
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        # Send combined data to your app (non-blocking)
-        import threading
-        thread = threading.Thread(target=send_to_app, args=(combined_data,))
-        thread.daemon = True
-        thread.start()
-        
-        # FIXED: Handle case where weather data contains error
-        if 'error' in weather_data:
-            # Return basic success response without weather data
-            response_data = {
-                "message": "Data received successfully (weather data unavailable)", 
-                "status": "ok",
-                "weather_available": False,
-                "weather_error": weather_data['error']
-            }
-        else:
-            # Return response with weather data
-            response_data = {
-                "message": "Data received successfully",
-                "nonessentialrelaystate":nonessentialrelaystate,
-                "alert1":alert1,
-                "alert2":alert2,
-                "alert3":alert3,
-                "alert4":alert4,
-                "alert5":alert5,
-                "alert6":alert6,
-                "alert7":alert7,
-                "alert8":alert8,
-                
-                "status": "ok",
-                "weather_available": True,
-                "weather": {
-                    "temperature": weather_data['current'].get('temperature'),
-                    "humidity": weather_data['current'].get('humidity'),
-                    "cloud_cover": weather_data['current'].get('cloud_cover'),
-                    "wind_speed": weather_data['current'].get('wind_speed'),
-                    "precipitation": weather_data['current'].get('precipitation'),
-                    "weather_code": weather_data['current'].get('weather_code'),
-                    "feels_like": weather_data['current'].get('feels_like'),
-                    "timestamp": weather_data['current'].get('timestamp')
-                },
-                "location": {
-                    "lat": BAREILLY_LAT,
-                    "lon": BAREILLY_LON,
-                    "name": "Bareilly, India"
-                }
-            }
-        
-        return jsonify(response_data)
+        return jsonify(ingest_reading(data, weather_data))
         
     except Exception as e:
         print(f"❌ Error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def ingest_batch(device_ids, timestamps, columns, weather_data):
+    """Apply many time-stamped readings (one or more devices) in one pass.
+
+    device_ids and timestamps hold one entry per reading and columns one
+    float64 array per metric (NaN: missing). Returns the response body.
+    Shared by the JSON batch route and the binary frame route.
+    """
+    groups = {}
+    for index, device_id in enumerate(device_ids):
+        groups.setdefault(device_id, []).append(index)
+
+    decisions = [None] * len(device_ids)
+    data_rows = [None] * len(device_ids)
+    fired = {}
+    app_payloads = []
+
+    for device_id, indices in groups.items():
+        # Readings of one device are processed in time order
+        indices.sort(key=lambda i: timestamps[i])
+        group = {field: values[indices] for field, values in columns.items()}
+
+        with state_store.locked(device_id) as state:
+            alerts, relay, current_battery, current_light = evaluate_alerts_batch(
+                state, group, np.array([timestamps[i] for i in indices]), weather_data
+            )
+
+            for position, index in enumerate(indices):
+                row_alerts = {name: values[position] for name, values in alerts.items()}
+                esp32_values = {
+                    field: (None if np.isnan(values[position]) else float(values[position]))
+                    for field, values in group.items()
+                }
+                esp32_values['nonessentialrelaystate'] = int(relay[position])
+                decisions[index] = {
+                    "device_id": device_id,
+                    "nonessentialrelaystate": int(relay[position]),
+                    **row_alerts
+                }
+                data_rows[index] = build_data_row(
+                    esp32_values, weather_data, row_alerts, device_id, timestamps[index]
+                )
+                for name, message in row_alerts.items():
+                    if message:
+                        fired[(device_id, name, message)] = True
+
+            # Device state ends up as if the last reading had been posted alone
+            last = esp32_values
+            for field in group:
+                setattr(state, field, last[field])
+            state.prev_battery_percent = float(current_battery[-2]) if len(indices) > 1 else state.current_battery_percent
+            state.current_battery_percent = float(current_battery[-1])
+            state.prev_light_intensity = float(current_light[-2]) if len(indices) > 1 else state.current_light_intensity
+            state.current_light_intensity = float(current_light[-1])
+            for name, message in row_alerts.items():
+                setattr(state, name, message)
+            state.nonessentialrelaystate = int(relay[-1])
+            state_store.touch(state)
+
+            esp32_data = state.esp32_dict()
+            esp32_data["device_id"] = device_id
+            app_payloads.append({
+                "esp32_data": esp32_data,
+                "alerts": state.alerts_dict(),
+                "weather_data": weather_data if 'error' not in weather_data else {"error": weather_data['error']},
+                "timestamp": datetime.now().isoformat()
+            })
+
+    # One Telegram message per distinct alert in the batch (cooldown still applies)
+    for device_id, name, message in fired:
+        send_telegram_alert(message, APP_RULES.alert_types[name], device_id)
+
+    # One storage append and one app update per device for the whole batch
+    save_readings(data_rows)
+    for payload in app_payloads:
+        send_to_app(payload)
+        live_broker.publish(payload['esp32_data']['device_id'], payload)
+
+    return {
+        "message": "Batch received successfully",
+        "status": "ok",
+        "received": len(device_ids),
+        "devices": {device_id: len(indices) for device_id, indices in groups.items()},
+        "decisions": decisions,
+        "weather_available": 'error' not in weather_data
+    }
+
+def parse_batch_body():
+    """Return (device_id or None, readings) from a JSON or line-delimited batch body.
+
+    Accepted forms:
+      * JSON array of readings, or {"device_id": ..., "readings": [...]}
+      * NDJSON: one JSON reading per line
+      * compact lines: a header line of field names, then comma separated values
+    """
+    content_type = (request.content_type or '').split(';')[0].strip()
+    if content_type == 'application/json':
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            return body.get('device_id'), body.get('readings') or []
+        if isinstance(body, list):
+            return None, body
+        raise ValueError("Expected a JSON array or an object with 'readings'")
+
+    lines = [line.strip() for line in request.get_data(as_text=True).splitlines() if line.strip()]
+    if not lines:
+        return None, []
+    if lines[0].startswith('{'):
+        return None, [json.loads(line) for line in lines]
+
+    header = [name.strip() for name in lines[0].split(',')]
+    readings = []
+    for line in lines[1:]:
+        values = line.split(',')
+        readings.append({name: value for name, value in zip(header, values) if value != ''})
+    return None, readings
+
+@app.route('/esp32-data/batch', methods=['POST'])
+def receive_esp32_batch():
+    """Ingest many buffered readings (one or more devices) in a single request"""
+    global last_data_received
+
+    try:
+        batch_device_id, readings = parse_batch_body()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid batch: {str(e)}"}), 400
+
+    if not readings:
+        return jsonify({"error": "No readings received"}), 400
+    if len(readings) > MAX_BATCH_READINGS:
+        return jsonify({"error": f"Batch too large (max {MAX_BATCH_READINGS} readings)"}), 413
+    if not all(isinstance(reading, dict) for reading in readings):
+        return jsonify({"error": "Every reading must be an object"}), 400
+
+    print(f"📨 Received batch of {len(readings)} readings")
+    last_data_received = datetime.now()
+
+    try:
+        columns = parse_batch(readings)
+        if batch_device_id is None:
+            device_ids = [device_id or device_ip or token or DEFAULT_DEVICE_ID for device_id, device_ip, token
+                          in zip(columns['device_id'], columns['device_ip'], columns['thingsboard_token'])]
+        else:
+            device_ids = [str(batch_device_id)] * len(readings)
+        timestamps = np.where(np.isnan(columns['timestamp']), time.time(), columns['timestamp'])
+
+        weather_data = get_weather_data(force_refresh=False)
+        return jsonify(ingest_batch(device_ids, timestamps, metric_columns(columns), weather_data))
+
+    except Exception as e:
+        print(f"❌ Batch error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/esp32-data/bin', methods=['POST'])
+def receive_esp32_binary():
+    """Ingest a batch sent as a compact binary frame (see binary_protocol.py)"""
+    global last_data_received
+
+    try:
+        device_id, timestamps, columns = decode_frame(request.get_data())
+    except ValueError as e:
+        return jsonify({"error": f"Invalid frame: {str(e)}"}), 400
+
+    if not len(timestamps):
+        return jsonify({"error": "No readings received"}), 400
+    if len(timestamps) > MAX_BATCH_READINGS:
+        return jsonify({"error": f"Batch too large (max {MAX_BATCH_READINGS} readings)"}), 413
+
+    print(f"📨 Received binary frame of {len(timestamps)} readings")
+    last_data_received = datetime.now()
+
+    try:
+        device_id = device_id or request.args.get('device') or DEFAULT_DEVICE_ID
+        timestamps = np.where(np.isnan(timestamps), time.time(), timestamps)
+        weather_data = get_weather_data(force_refresh=False)
+        return jsonify(ingest_batch([device_id] * len(timestamps), timestamps, columns, weather_data))
+
+    except Exception as e:
+        print(f"❌ Binary frame error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     # Initialize on startup
-    init_csv_file()
+    init_storage()
     start_background_scheduler()
     
     port = int(os.environ.get('PORT', 5000))
@@ -1042,5 +1346,5 @@ else:
     application = app
     
     # Initialize when imported
-    init_csv_file()
+    init_storage()
     start_background_scheduler()
@@ -0,0 +1,339 @@
+"""asyncio entry point for the device and dashboard routes of app.py.
+
+Serves /esp32-data (and binary frames on /esp32-data/bin), /api/dashboard-data,
+/weather, /alert and /api/csv-data on one event loop with aiohttp, so a
+process holds many concurrent device connections without a thread per
+request:
+
+* Open-Meteo and Telegram are called with a shared aiohttp client session;
+  a weather miss is fetched once per key while other requests await it
+* storage work (ingest, paging, resampling, downloads) runs on a small,
+  bounded thread pool, so disk reads and flushes never block the loop
+* everything else - device state, alert rules, the weather cache, snapshots,
+  the app / Telegram background queues and the live stream broker - is the
+  same code and the same objects the Flask app uses
+
+Run it with ``python async_app.py`` or under gunicorn with
+``gunicorn async_app:make_app --worker-class aiohttp.GunicornWebWorker``.
+Importing app.py opens the storage and starts the background scheduler,
+exactly as under the Flask server. aiohttp is only needed for this entry
+point; the Flask app does not use it.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import aiohttp
+    from aiohttp import web
+except ImportError:  # optional: only needed to run the asyncio server
+    aiohttp = None
+    web = None
+
+import app as core
+from binary_protocol import decode_frame
+from snapshot_cache import encode_json
+
+IO_WORKERS = int(os.environ.get('ASYNC_IO_WORKERS', 8))  # threads for storage reads / writes
+HTTP_CONNECTIONS = int(os.environ.get('ASYNC_HTTP_CONNECTIONS', 100))  # outbound connection limit
+OPEN_METEO_TIMEOUT = 15
+
+io_pool = ThreadPoolExecutor(IO_WORKERS, thread_name_prefix='async-io')
+http_session = None  # aiohttp.ClientSession, opened on startup
+weather_locks = {}  # cache key -> asyncio.Lock, one Open-Meteo fetch per key at a time
+revalidations = {}  # cache key -> task re-fetching an expired value in the background
+
+
+async def run_io(func, *args):
+    """Run blocking storage work on the I/O pool"""
+    return await asyncio.get_running_loop().run_in_executor(io_pool, func, *args)
+
+
+def json_response(data, status=200):
+    return web.Response(body=encode_json(data), status=status, content_type='application/json')
+
+
+async def read_json(request):
+    """Request body as JSON, None when it is empty or invalid"""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+# ===================== WEATHER =====================
+async def fetch_open_meteo_async(key):
+    """Async twin of app.fetch_open_meteo"""
+    lat, lon, params = core.open_meteo_params(key)
+    print("🌤️ Fetching fresh weather data from Open-Meteo...")
+    async with http_session.get(core.OPEN_METEO_URL, params=params,
+                                timeout=aiohttp.ClientTimeout(total=OPEN_METEO_TIMEOUT)) as response:
+        response.raise_for_status()
+        data = await response.json()
+    return core.shape_open_meteo(data, lat, lon)
+
+
+async def get_weather_async(force_refresh=False):
+    """Weather for the site from app.weather_cache, fetched without blocking the loop.
+
+    As WeatherCache.get: an expired value is served at once and re-fetched in
+    a background task, and nothing is fetched while the key is backing off.
+    """
+    cache = core.weather_cache
+    key = core.weather_key()
+    if not force_refresh:
+        value = cache.cached(key)
+        if value is not None:
+            return value
+        value = cache.stale_value(key)
+        if value is not None:
+            if key not in revalidations:
+                revalidations[key] = asyncio.ensure_future(revalidate_weather(key))
+            return value
+    try:
+        return await load_weather(key, force_refresh)
+    except Exception as e:
+        error_msg = f"Weater API error: {str(e)}"
+        print(f"❌ {error_msg}")
+        return {'error': error_msg}
+
+
+async def revalidate_weather(key):
+    try:
+        await load_weather(key, False)
+    except Exception as e:
+        print(f"⚠️ Weather revalidation failed for {key}: {e}")
+    finally:
+        revalidations.pop(key, None)
+
+
+async def load_weather(key, force_refresh):
+    """One Open-Meteo fetch per key at a time; stale value (or the error) while backing off"""
+    cache = core.weather_cache
+    started = time.time()
+    lock = weather_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        # Whoever held the lock before may have fetched it already
+        if force_refresh:
+            entry = await run_io(cache.peek, key)
+            if entry is not None and entry.fetched_at >= started:
+                return entry.value
+        else:
+            value = await run_io(cache.cached, key, True)
+            if value is not None:
+                return value
+        error = cache.backoff_error(key)
+        if error is None:
+            try:
+                return await run_io(cache.put, key, await fetch_open_meteo_async(key))
+            except Exception as e:
+                cache.failed(key, e)
+                error = e
+        stale = await run_io(cache.stale, key, error)
+        if stale is not None:
+            return stale
+        raise error
+
+
+async def weather(request):
+    try:
+        force_refresh = request.query.get('force_refresh', 'false').lower() == 'true'
+        return json_response(await get_weather_async(force_refresh=force_refresh))
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+# ===================== DEVICES AND DASHBOARD =====================
+async def receive_esp32_data(request):
+    print("📨 Received POST request to /esp32-data")
+    core.last_data_received = datetime.now()
+
+    try:
+        data = await read_json(request)
+        if not data:
+            core.send_telegram_alert("No JSON data recieved", "data error")
+            return json_response({"error": "No JSON data received"}, 400)
+
+        print(f"✅ JSON data received: {data}")
+        weather_data = await get_weather_async()
+        return json_response(await run_io(core.ingest_reading, data, weather_data))
+
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def receive_esp32_binary(request):
+    """Readings in a compact binary frame (see binary_protocol.py)"""
+    try:
+        device_id, timestamps, columns = decode_frame(await request.read())
+    except ValueError as e:
+        return json_response({"error": f"Invalid frame: {str(e)}"}, 400)
+
+    if not len(timestamps):
+        return json_response({"error": "No readings received"}, 400)
+    if len(timestamps) > core.MAX_BATCH_READINGS:
+        return json_response({"error": f"Batch too large (max {core.MAX_BATCH_READINGS} readings)"}, 413)
+
+    print(f"📨 Received binary frame of {len(timestamps)} readings")
+    core.last_data_received = datetime.now()
+
+    try:
+        device_id = device_id or request.query.get('device') or core.DEFAULT_DEVICE_ID
+        timestamps = np.where(np.isnan(timestamps), time.time(), timestamps)
+        weather_data = await get_weather_async()
+        return json_response(await run_io(core.ingest_batch, [device_id] * len(timestamps),
+                                          timestamps, columns, weather_data))
+
+    except Exception as e:
+        print(f"❌ Binary frame error: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def dashboard_data(request):
+    """Same ETag-cached snapshot as the Flask /api/dashboard-data"""
+    try:
+        state = core.requested_device_state(request.query)
+        weather_data = await get_weather_async()
+        snapshot = core.dashboard_snapshot(state, weather_data)
+        status, body, headers = snapshot.negotiate(request.headers.get('If-None-Match', ''),
+                                                   request.headers.get('Accept-Encoding'))
+        if status == 304:
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, headers=headers, content_type=snapshot.mimetype)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def handle_alert(request):
+    """Forward an alert to Telegram and answer with Telegram's response"""
+    try:
+        data = await read_json(request)
+        if not data or 'message' not in data:
+            return json_response({"error": "No message provided"}, 400)
+
+        telegram = core.telegram
+        key, prepared = telegram.prepare_now(data['message'], data.get('type', 'general'), data.get('device_id'))
+        if key is None:
+            result = prepared
+        else:
+            url, body = telegram.request_for(prepared)
+            try:
+                async with http_session.post(url, json=body,
+                                             timeout=aiohttp.ClientTimeout(total=telegram.timeout)) as response:
+                    response.raise_for_status()
+                    result = await response.json()
+            except Exception as e:
+                result = telegram.failed_now(key, e)
+
+        if 'error' in result:
+            return json_response({"error": result['error']}, 500)
+        return json_response({"status": "Message sent to Telegram", "telegram_response": result})
+
+    except Exception as e:
+        return json_response({"error": f"Internal server error: {str(e)}"}, 500)
+
+
+# ===================== STORED DATA =====================
+async def stream_download(request, query, fmt, filename):
+    """Chunked NDJSON/CSV download; each chunk is read (and compressed) on the I/O pool"""
+    chunks, mimetype, headers = core.history_stream(query, fmt, filename, request.query,
+                                                    request.headers.get('Accept-Encoding', ''))
+    response = web.StreamResponse(headers=headers)
+    response.content_type = mimetype
+    await response.prepare(request)
+    chunks = iter(chunks)
+    while True:
+        chunk = await run_io(next, chunks, None)
+        if chunk is None:
+            break
+        await response.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    await response.write_eof()
+    return response
+
+
+async def get_csv_data(request):
+    """Same parameters and answers as the Flask /api/csv-data"""
+    args = request.query
+    try:
+        try:
+            query = core.parse_history_query(args)
+        except ValueError as e:
+            return json_response({"error": str(e)}, 400)
+
+        if args.get('step'):
+            try:
+                return json_response(await run_io(core.resampled_data, query, args))
+            except ValueError as e:
+                return json_response({"error": str(e)}, 400)
+
+        fmt = args.get('format', 'json').lower()
+        if fmt in ('ndjson', 'csv'):
+            return await stream_download(request, query, fmt, 'solar_data')
+        if fmt != 'json':
+            return json_response({"error": "format must be json, ndjson or csv"}, 400)
+
+        return json_response(await run_io(core.csv_data_page, query))
+
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+# ===================== APPLICATION =====================
+async def preflight(request, handler):
+    """Answer CORS preflight requests (the Flask app uses flask_cors)"""
+    if request.method != 'OPTIONS':
+        return await handler(request)
+    return web.Response(headers={
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': request.headers.get('Access-Control-Request-Headers', '*'),
+    })
+
+
+async def allow_origin(request, response):
+    response.headers['Access-Control-Allow-Origin'] = '*'
+
+
+async def open_http(application):
+    global http_session
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=HTTP_CONNECTIONS),
+        headers={'User-Agent': 'SolarMonitor/1.0'},
+    )
+
+
+async def close_http(application):
+    await http_session.close()
+    io_pool.shutdown(wait=False)
+
+
+def create_app():
+    """aiohttp application serving the app.py routes listed above"""
+    if web is None:
+        raise RuntimeError("aiohttp is not installed - pip install aiohttp to run the asyncio server")
+    application = web.Application(middlewares=[web.middleware(preflight)])
+    application.router.add_post('/esp32-data', receive_esp32_data)
+    application.router.add_post('/esp32-data/bin', receive_esp32_binary)
+    application.router.add_get('/api/dashboard-data', dashboard_data)
+    application.router.add_post('/api/dashboard-data', dashboard_data)
+    application.router.add_get('/weather', weather)
+    application.router.add_post('/alert', handle_alert)
+    application.router.add_get('/api/csv-data', get_csv_data)
+    application.on_response_prepare.append(allow_origin)
+    application.on_startup.append(open_http)
+    application.on_cleanup.append(close_http)
+    return application
+
+
+async def make_app():
+    """Factory for ``gunicorn async_app:make_app --worker-class aiohttp.GunicornWebWorker``"""
+    return create_app()
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 5000))
+    web.run_app(create_app(), host='0.0.0.0', port=port)
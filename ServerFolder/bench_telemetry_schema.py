@@ -0,0 +1,113 @@
+"""Benchmark of telemetry_schema against the old per-field or-chain lookups.
+
+The servers used to resolve every field with ``data.get(a) or data.get(b)``
+and ``float()``, which also turned a reading of 0 into a missing value. This
+script re-implements that path, shows where the two disagree and times one
+reading and a 1000-reading batch with both::
+
+    python bench_telemetry_schema.py
+"""
+import timeit
+
+import numpy as np
+
+from telemetry_schema import _columns_of, _parse_keys, parse_batch, parse_reading, parse_reading_timestamp
+
+# What ESP32 code.ino posts (Wi-Fi credentials included) and what the servers used to do with it
+DOCUMENT = {
+    'InverterLoad': 212.5, 'Frequency': 50.0, 'PowerFactor': 0.92, 'Voltage': 229.8,
+    'Current': 0.0, 'Power': 0, 'Energy': 1.234, 'solarVoltage': 6.1, 'solarCurrent': 0.05,
+    'solarPower': 0.3, 'batteryPercentage': 0, 'batteryVoltage': 3.71, 'lightIntensity': 0.0,
+    'latitude': '28.3640', 'longitude': '79.4151', 'THINGSBOARD_TOKEN': 'tok', 'Server': 'http://x',
+    'Ssid': 'wifi', 'Password': 'secret', 'RoomEsp': 'Connected', 'deviceIP': '192.168.1.20',
+}
+LEGACY_ALIASES = {
+    'box_temp': ('box_temp', 'BoxTemperature'), 'frequency': ('frequency', 'Frequency'),
+    'power_factor': ('power_factor', 'PowerFactor'), 'voltage': ('voltage', 'Voltage'),
+    'current': ('current', 'Current'), 'power': ('power', 'Power'), 'energy': ('energy', 'Energy'),
+    'solar_voltage': ('solar_voltage', 'SolarVoltage'), 'solar_current': ('solar_current', 'solarCurrent'),
+    'solar_power': ('solar_power', 'solarPower'),
+    'battery_percentage': ('battery_percentage', 'batteryPercentage'),
+    'light_intensity': ('light_intensity', 'lightIntensity'),
+    'battery_voltage': ('battery_voltage', 'batteryVoltage'),
+}
+
+
+def legacy_float(value):
+    try:
+        return float(value) if value not in (None, '') else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def legacy(data):
+    return {field: legacy_float(data.get(keys[0]) or data.get(keys[1])) for field, keys in LEGACY_ALIASES.items()}
+
+
+def legacy_request(data):
+    # metrics, device key and timestamp, as /esp32-data used to resolve them
+    device_id = 'esp32-default'
+    for key in ('device_id', 'deviceId', 'deviceIP', 'THINGSBOARD_TOKEN'):
+        if data.get(key):
+            device_id = str(data.get(key))
+            break
+    return legacy(data), device_id, parse_reading_timestamp(data.get('timestamp', data.get('ts')))
+
+
+def schema_request(data):
+    reading, _ = parse_reading(data)
+    return reading, reading.device_key('esp32-default'), reading.timestamp
+
+
+def legacy_columns(readings):
+    columns = {}
+    for field, keys in LEGACY_ALIASES.items():
+        columns[field] = np.array([legacy_float(data.get(keys[0]) or data.get(keys[1])) for data in readings])
+    return columns
+
+
+def compare(statements, number, scope, rounds=15):
+    """Best time per run of each statement, interleaved so machine noise hits all alike"""
+    scope = globals() | scope
+    best = dict.fromkeys(statements, float('inf'))
+    for _ in range(rounds):
+        for statement in statements:
+            best[statement] = min(best[statement], timeit.timeit(statement, number=number, globals=scope) / number)
+    return best
+
+
+def main():
+    document = DOCUMENT
+    canonical = {'power': 0, 'battery_percentage': 0, 'light_intensity': 0.0, 'solar_power': 12.5}
+    reading, _ = parse_reading(canonical)
+    print("Zero handling, {'power': 0, 'battery_percentage': 0, 'light_intensity': 0.0}:")
+    print(f"  or-chains: {[legacy(canonical)[name] for name in ('power', 'battery_percentage', 'light_intensity')]}")
+    print(f"  schema   : {[getattr(reading, name) for name in ('power', 'battery_percentage', 'light_intensity')]}")
+    print(f"solarVoltage from ESP32 code.ino - or-chains: {legacy(document)['solar_voltage']}, "
+          f"schema: {parse_reading(document)[0].solar_voltage}")
+
+    n = 5000
+    single = compare(['legacy_request(document)', '_parse_keys(document)', 'parse_reading(document)',
+                      'schema_request(document)'], n, locals())
+    print(f"\nOne reading ({len(document)} keys), best of 15 x {n}:")
+    for label, statement in (('or-chains + float() + device key', 'legacy_request(document)'),
+                             ('schema, general path', '_parse_keys(document)'),
+                             ('schema, compiled key set', 'parse_reading(document)'),
+                             ('schema + device key', 'schema_request(document)')):
+        print(f"  {label:35s}: {single[statement] * 1e6:6.2f} µs")
+
+    batch = [dict(document, Power=i % 7, Energy=i / 10) for i in range(1000)]
+    assert all(np.array_equal(legacy_columns(batch)[name], parse_batch(batch)[name], equal_nan=True)
+               for name in ('power', 'energy', 'voltage', 'box_temp'))
+    m = 20
+    columns = compare(['legacy_columns(batch)', '_columns_of([parse_reading(r)[0] for r in batch])',
+                       'parse_batch(batch)'], m, locals())
+    print(f"\nBatch of {len(batch)} readings -> float64 columns, best of 15 x {m}:")
+    for label, statement in (('readings_to_columns (or-chains)', 'legacy_columns(batch)'),
+                             ('parse_batch, reading by reading', '_columns_of([parse_reading(r)[0] for r in batch])'),
+                             ('parse_batch, column by column', 'parse_batch(batch)')):
+        print(f"  {label:35s}: {columns[statement] * 1e3:6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Compact binary reading frames for constrained devices (POST /esp32-data/bin).
+
+A frame is a small header followed by fixed-size records, all little-endian:
+
+    header   magic 'SM' | version u8 | flags u8 (0) | count u16 | id length u8 | device id (utf-8)
+    record   timestamp u32 (epoch seconds, 0: use the server clock)
+             13 x i32 metrics in milli-units (value * 1000), -2**31: missing
+
+Timestamps are whole epoch seconds up to 2**32 - 1 (year 2106); millisecond
+timestamps do not fit. Metrics must lie within +-2147483.647 (the i32 range
+in milli-units, -2**31 being reserved for missing) and are rounded to 0.001.
+``encode_frame`` raises ValueError for anything outside these limits rather
+than sending a wrong value.
+
+Version 1 records are 56 bytes, against ~600 bytes for the JSON document
+the firmware posts per reading (which also repeats the Wi-Fi credentials,
+server and token). The record layout of every version is a NumPy
+structured dtype, so a whole batch is unpacked with one ``np.frombuffer``
+and converted column by column - no per-reading parsing. New fields get a
+new version; old versions stay decodable.
+
+A C struct matching version 1 (``__attribute__((packed))``)::
+
+    struct Reading { uint32_t ts; int32_t box_temp, frequency, power_factor,
+        voltage, current, power, energy, solar_voltage, solar_current,
+        solar_power, battery_percentage, light_intensity, battery_voltage; };
+"""
+import struct
+
+import numpy as np
+
+MAGIC = b'SM'
+VERSION = 1
+HEADER = struct.Struct('<2sBBHB')
+SCALE = 1000  # metrics travel as integer milli-units
+MISSING = np.iinfo(np.int32).min
+MAX_TIMESTAMP = np.iinfo(np.uint32).max
+MAX_METRIC = np.iinfo(np.int32).max  # in milli-units; -MAX_METRIC is the smallest value
+CONTENT_TYPE = 'application/vnd.solar-monitor.frame'
+
+# Field order of each protocol version (never change a published version)
+VERSION_FIELDS = {
+    1: ('box_temp', 'frequency', 'power_factor', 'voltage', 'current', 'power',
+        'energy', 'solar_voltage', 'solar_current', 'solar_power',
+        'battery_percentage', 'light_intensity', 'battery_voltage'),
+}
+RECORD_DTYPES = {
+    version: np.dtype([('ts', '<u4')] + [(name, '<i4') for name in fields])
+    for version, fields in VERSION_FIELDS.items()
+}
+
+
+def decode_frame(body):
+    """(device_id or None, timestamps, columns) of a frame - float64 arrays, NaN for missing.
+
+    Raises ValueError for anything that is not a complete frame of a known version.
+    """
+    if len(body) < HEADER.size:
+        raise ValueError("frame shorter than its header")
+    magic, version, flags, count, id_length = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise ValueError("not a reading frame (bad magic)")
+    dtype = RECORD_DTYPES.get(version)
+    if dtype is None:
+        raise ValueError(f"unsupported frame version {version}")
+    offset = HEADER.size + id_length
+    expected = offset + count * dtype.itemsize
+    if len(body) != expected:
+        raise ValueError(f"frame of {count} readings must be {expected} bytes, got {len(body)}")
+    device_id = bytes(body[HEADER.size:offset]).decode('utf-8') or None
+
+    records = np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+    timestamps = records['ts'].astype(np.float64)
+    timestamps[records['ts'] == 0] = np.nan
+    columns = {}
+    for name in VERSION_FIELDS[version]:
+        raw = records[name]
+        values = raw / SCALE
+        values[raw == MISSING] = np.nan
+        columns[name] = values
+    return device_id, timestamps, columns
+
+
+def encode_frame(readings, device_id=None, version=VERSION):
+    """Frame bytes for a list of readings ({field: number or None, 'timestamp': epoch seconds})"""
+    fields = VERSION_FIELDS[version]
+    identifier = (device_id or '').encode('utf-8')
+    if len(identifier) > 255 or len(readings) > 0xFFFF:
+        raise ValueError("device id longer than 255 bytes or more than 65535 readings")
+    records = np.zeros(len(readings), dtype=RECORD_DTYPES[version])
+    timestamps = np.array([reading.get('timestamp') or 0 for reading in readings], dtype=np.float64)
+    bad = ~((timestamps >= 0) & (timestamps <= MAX_TIMESTAMP))
+    if bad.any():
+        raise ValueError(f"timestamp {float(timestamps[bad][0])} is not epoch seconds in 0..{MAX_TIMESTAMP}")
+    records['ts'] = timestamps.astype(np.uint32)
+    for name in fields:
+        values = np.array([reading.get(name) for reading in readings], dtype=np.float64)
+        scaled = np.round(values * SCALE)
+        bad = ~np.isnan(values) & ~(np.abs(scaled) <= MAX_METRIC)
+        if bad.any():
+            raise ValueError(f"{name} value {float(values[bad][0])} outside +-{MAX_METRIC / SCALE}")
+        records[name] = np.where(np.isnan(values), MISSING, scaled).astype(np.int32)
+    return HEADER.pack(MAGIC, version, 0, len(readings), len(identifier)) + identifier + records.tobytes()
@@ -0,0 +1,141 @@
+"""Per-device telemetry state for the Solar Monitoring System.
+
+Every ESP32 / gateway that posts to the server gets its own DeviceState record,
+so one process can track many microgrids without the readings of one device
+overwriting another's. Records live in a plain dict (O(1) lookup) and updates
+are serialized through a small set of striped locks instead of one global lock.
+"""
+import threading
+import time
+import zlib
+
+DEFAULT_DEVICE_ID = 'default'
+
+# Metrics reported by the ESP32 (same names as the CSV columns)
+METRIC_FIELDS = (
+    'box_temp', 'frequency', 'power_factor', 'voltage', 'current', 'power',
+    'energy', 'solar_voltage', 'solar_current', 'solar_power',
+    'battery_percentage', 'light_intensity', 'battery_voltage',
+)
+
+ALERT_FIELDS = (
+    'alert1', 'alert2', 'alert3', 'alert4',
+    'alert5', 'alert6', 'alert7', 'alert8',
+)
+
+
+class DeviceState:
+    """Latest reading, alert state and relay decision of one device"""
+    __slots__ = (
+        ('device_id', 'last_updated')
+        + METRIC_FIELDS
+        + ALERT_FIELDS
+        + ('prev_light_intensity', 'current_light_intensity',
+           'prev_battery_percent', 'current_battery_percent',
+           'nonessentialrelaystate', 'trends')
+    )
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.last_updated = None
+        for name in METRIC_FIELDS + ALERT_FIELDS:
+            setattr(self, name, None)
+        self.prev_light_intensity = 0
+        self.current_light_intensity = 0
+        self.prev_battery_percent = 0
+        self.current_battery_percent = 0
+        self.nonessentialrelaystate = 1
+        self.trends = None  # RingBuffer of recent readings, created by the alert code
+
+    def esp32_dict(self):
+        """ESP32 block in the shape used by the dashboard endpoints"""
+        return {
+            "box_temp": self.box_temp,
+            "power": self.power,
+            "solar_power": self.solar_power,
+            "battery_percentage": self.battery_percentage,
+            "voltage": self.voltage,
+            "current": self.current,
+            "solar_voltage": self.solar_voltage,
+            "solar_current": self.solar_current,
+            "light_intensity": self.light_intensity,
+            "energy": self.energy,
+            "frequency": self.frequency,
+            "nonessentialrelaystate": self.nonessentialrelaystate
+        }
+
+    def metrics_dict(self):
+        """All raw metrics plus the relay state (row used for storage)"""
+        row = {name: getattr(self, name) for name in METRIC_FIELDS}
+        row['nonessentialrelaystate'] = self.nonessentialrelaystate
+        return row
+
+    def alerts_dict(self):
+        return {name: getattr(self, name) for name in ALERT_FIELDS}
+
+
+class DeviceStateStore:
+    """Dict of DeviceState records guarded by striped locks.
+
+    Use ``with store.locked(device_id) as state:`` to read-modify-write one
+    device; devices that hash to different stripes never wait on each other.
+    """
+
+    def __init__(self, stripes=64):
+        self._states = {}
+        self._locks = [threading.RLock() for _ in range(stripes)]
+        self._latest_device = None
+
+    def lock_for(self, device_id):
+        return self._locks[zlib.crc32(device_id.encode('utf-8')) % len(self._locks)]
+
+    def get(self, device_id):
+        """Return the state of a device or None if it has never reported"""
+        return self._states.get(device_id)
+
+    def get_or_create(self, device_id):
+        state = self._states.get(device_id)
+        if state is None:
+            with self.lock_for(device_id):
+                state = self._states.get(device_id)
+                if state is None:
+                    state = DeviceState(device_id)
+                    self._states[device_id] = state
+        return state
+
+    def locked(self, device_id):
+        return _LockedState(self, device_id)
+
+    def touch(self, state):
+        """Mark a device as the most recently updated one"""
+        state.last_updated = time.time()
+        self._latest_device = state.device_id
+
+    def latest(self):
+        """State of the device that reported most recently (or None)"""
+        if self._latest_device is None:
+            return None
+        return self._states.get(self._latest_device)
+
+    def device_ids(self):
+        return list(self._states)
+
+    def __len__(self):
+        return len(self._states)
+
+
+class _LockedState:
+    __slots__ = ('_store', '_device_id', '_lock')
+
+    def __init__(self, store, device_id):
+        self._store = store
+        self._device_id = device_id
+        self._lock = store.lock_for(device_id)
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self._store.get_or_create(self._device_id)
+
+    def __exit__(self, exc_type, exc, tb):
+        self._lock.release()
+        return False
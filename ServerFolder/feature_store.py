@@ -0,0 +1,367 @@
+"""Lag / rolling Energy features maintained incrementally per device.
+
+Readings are folded onto the model's step grid (last Energy value seen in a
+step wins). When a step completes its value is pushed into per-device sliding
+windows, so the features of the next step are ready without looking at the
+history again:
+
+* lags come from a fixed-length history deque
+* rolling mean/std use Welford's update with removal (exact recompute every
+  few hundred steps so rounding cannot drift)
+* rolling min/max use monotonic deques
+
+The features are the same as ``add_lag_features`` in ml_model_training.py
+(``shift(1).rolling(w, min_periods=max(2, w // 2))``), and Energy gaps are
+forward-filled for ``FFILL_LIMIT`` steps like ``infer_and_resample`` does.
+
+Completed steps (Energy plus the features the step was predicted from) are
+appended to a TimeSeriesStore under ``<root>/step_<seconds>``, so training can
+read a ready-made feature matrix and a restarted server picks up where it
+stopped. ``lag_feature_matrix`` builds the same columns for a whole series at
+once, for history that was never seen online.
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from timeseries_store import TimeSeriesStore
+
+TARGET = 'Energy'
+LAGS = (1, 2, 3, 4, 6, 12, 24, 48, 96)
+ROLL_WINDOWS = (4, 12, 24, 48)
+DEFAULT_STEP_SECONDS = 900  # training falls back to 15 minutes when it cannot infer the interval
+FFILL_LIMIT = 2  # steps an Energy gap is forward-filled, as in infer_and_resample
+
+HISTORY = max(LAGS) + 1
+
+
+def feature_names():
+    """Lag / rolling feature names produced by add_lag_features"""
+    names = [f'{TARGET}_lag_{lag}' for lag in LAGS]
+    for w in ROLL_WINDOWS:
+        names += [f'{TARGET}_roll_{stat}_{w}' for stat in ('mean', 'std', 'min', 'max')]
+    return names
+
+
+def feature_columns():
+    """TimeSeriesStore schema of the persisted feature rows"""
+    return [('device_id', 's'), ('energy', 'f')] + [(name, 'f') for name in feature_names()]
+
+
+def _min_periods(w):
+    return max(2, w // 2)
+
+
+class _Window:
+    """Last ``size`` values with Welford mean/variance and monotonic min/max deques"""
+    __slots__ = ('size', 'values', 'count', 'mean', 'm2', 'mins', 'maxs', 'index', 'since_exact')
+
+    def __init__(self, size):
+        self.size = size
+        self.values = deque(maxlen=size)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.mins = deque()  # (index, value), values increasing
+        self.maxs = deque()  # (index, value), values decreasing
+        self.index = 0
+        self.since_exact = 0
+
+    def push(self, value):
+        if len(self.values) == self.size:
+            self._remove(self.values[0])
+        self.values.append(value)
+        self.index += 1
+        if value == value:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+            while self.mins and self.mins[-1][1] >= value:
+                self.mins.pop()
+            self.mins.append((self.index, value))
+            while self.maxs and self.maxs[-1][1] <= value:
+                self.maxs.pop()
+            self.maxs.append((self.index, value))
+        oldest = self.index - self.size
+        while self.mins and self.mins[0][0] <= oldest:
+            self.mins.popleft()
+        while self.maxs and self.maxs[0][0] <= oldest:
+            self.maxs.popleft()
+
+        self.since_exact += 1
+        if self.since_exact >= 16 * self.size:
+            self._recompute()
+
+    def _remove(self, value):
+        if value != value:
+            return
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        self.count -= 1
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    def _recompute(self):
+        present = [v for v in self.values if v == v]
+        self.count = len(present)
+        self.mean = math.fsum(present) / self.count if present else 0.0
+        self.m2 = math.fsum((v - self.mean) ** 2 for v in present)
+        self.since_exact = 0
+
+    def stats(self):
+        """mean, std (ddof=1), min, max - NaN below the add_lag_features min_periods"""
+        if self.count < _min_periods(self.size):
+            return math.nan, math.nan, math.nan, math.nan
+        return self.mean, math.sqrt(self.m2 / (self.count - 1)), self.mins[0][1], self.maxs[0][1]
+
+
+class OnlineFeatures:
+    """Lag / rolling features of the next step of one series, updated per completed step"""
+
+    def __init__(self):
+        self.history = deque(maxlen=max(LAGS))
+        self.windows = [_Window(w) for w in ROLL_WINDOWS]
+        self.last_valid = math.nan
+        self.nan_run = 0
+
+    def push(self, value, fill=True):
+        """Add the value of a completed step; returns it after forward-filling"""
+        if value != value:
+            self.nan_run += 1
+            if fill and self.nan_run <= FFILL_LIMIT:
+                value = self.last_valid
+        else:
+            self.nan_run = 0
+            self.last_valid = value
+        self.history.append(value)
+        for window in self.windows:
+            window.push(value)
+        return value
+
+    def features(self):
+        history = self.history
+        features = {
+            f'{TARGET}_lag_{lag}': history[-lag] if len(history) >= lag else math.nan
+            for lag in LAGS
+        }
+        for window in self.windows:
+            mean, std, low, high = window.stats()
+            features[f'{TARGET}_roll_mean_{window.size}'] = mean
+            features[f'{TARGET}_roll_std_{window.size}'] = std
+            features[f'{TARGET}_roll_min_{window.size}'] = low
+            features[f'{TARGET}_roll_max_{window.size}'] = high
+        return features
+
+
+class _DeviceFeatures:
+    """Open step of one device and the features it will be predicted from"""
+    __slots__ = ('step', 'value', 'features', 'online', 'last_known', 'written_step')
+
+    def __init__(self):
+        self.step = None
+        self.value = math.nan
+        self.features = None
+        self.online = OnlineFeatures()
+        self.last_known = math.nan
+        self.written_step = None
+
+
+class FeatureStore:
+    """Per-device online features on a fixed step grid, optionally persisted"""
+
+    def __init__(self, step_seconds=DEFAULT_STEP_SECONDS):
+        self.step_seconds = step_seconds
+        self.store = None
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def open(self, root):
+        """Persist completed steps under root and warm up from what is already there"""
+        self.store = TimeSeriesStore(os.path.join(root, f'step_{int(self.step_seconds)}'),
+                                     columns=feature_columns())
+        self._warm_up()
+        return self
+
+    def _warm_up(self):
+        since = time.time() - (HISTORY + 1) * self.step_seconds
+        data = self.store.read(since, columns=['device_id', 'energy'])
+        if not len(data['timestamp']):
+            return
+        devices = np.asarray([device or '' for device in data['device_id']], dtype=object)
+        steps = np.floor(data['timestamp'] / self.step_seconds).astype(np.int64)
+        with self._lock:
+            for device_id in np.unique(devices):
+                if not device_id:
+                    continue
+                rows = np.flatnonzero(devices == device_id)
+                # Several workers may have written the same step; the last row wins
+                device_steps, last = np.unique(steps[rows][::-1], return_index=True)
+                energies = data['energy'][rows][::-1][last]
+                device = _DeviceFeatures()
+                previous = None
+                for step, energy in zip(device_steps, energies):
+                    if previous is not None:
+                        for _ in range(min(step - previous - 1, HISTORY)):
+                            device.online.push(math.nan, fill=False)
+                    device.online.push(float(energy), fill=False)
+                    previous = step
+                    if energy == energy:
+                        device.last_known = float(energy)
+                device.written_step = int(device_steps[-1])
+                self._devices[device_id] = device
+        print(f"✅ Feature store warmed up for {len(self._devices)} device(s)")
+
+    def observe(self, device_id, timestamp, energy):
+        """Fold one Energy reading into its step; completes earlier steps as needed"""
+        step = int(timestamp // self.step_seconds)
+        rows = []
+        with self._lock:
+            device = self._devices.get(device_id)
+            if device is None:
+                device = self._devices[device_id] = _DeviceFeatures()
+            if device.step is None:
+                if device.written_step is not None and step <= device.written_step:
+                    return False
+                self._skip_to(device, device.written_step, step, device_id, rows)
+                self._open_step(device, step, energy)
+            elif step == device.step:
+                if energy == energy:
+                    device.value = energy
+            elif step > device.step:
+                rows.append(self._complete(device, device_id))
+                self._skip_to(device, device.step, step, device_id, rows)
+                self._open_step(device, step, energy)
+            else:
+                return False  # late reading for a step that is already history
+            if energy == energy:
+                device.last_known = energy
+        if rows and self.store is not None:
+            self.store.append_many(rows)
+        return True
+
+    def _open_step(self, device, step, energy):
+        device.step = step
+        device.value = energy
+        device.features = device.online.features()
+
+    def _complete(self, device, device_id, value=None):
+        """Push the open step into the windows and return its persisted row"""
+        features = device.features
+        filled = device.online.push(device.value if value is None else value)
+        device.written_step = device.step
+        return {'timestamp': device.step * self.step_seconds, 'device_id': device_id,
+                'energy': filled, **features}
+
+    def _skip_to(self, device, last_step, step, device_id, rows):
+        """Complete the empty steps between last_step and step (at most HISTORY of them)"""
+        if last_step is None:
+            return
+        missing = step - last_step - 1
+        if missing > HISTORY:
+            # Longer than any window: every feature is NaN again
+            device.online = OnlineFeatures()
+            return
+        for gap in range(last_step + 1, step):
+            device.step = gap
+            device.features = device.online.features()
+            rows.append(self._complete(device, device_id, math.nan))
+
+    def current(self, device_id):
+        """(open step, features it is predicted from, last known Energy) or None"""
+        with self._lock:
+            device = self._devices.get(device_id)
+            if device is None or device.step is None:
+                return None
+            return device.step, device.features, device.last_known
+
+    def devices(self):
+        return list(self._devices)
+
+    def flush(self):
+        if self.store is not None:
+            self.store.flush()
+
+    def close(self):
+        """Write the open steps too (shutdown), so a restart resumes from them"""
+        if self.store is None:
+            return
+        with self._lock:
+            rows = []
+            for device_id, device in self._devices.items():
+                if device.step is None:
+                    continue
+                rows.append({'timestamp': device.step * self.step_seconds, 'device_id': device_id,
+                             'energy': device.value, **device.features})
+        self.store.append_many(rows)
+        self.store.flush()
+
+    def flush_if_due(self):
+        if self.store is not None:
+            self.store.flush_if_due()
+
+    def read_matrix(self, start=None, end=None, device_id=None):
+        """Persisted feature rows as column arrays (one row per device and step)"""
+        return read_feature_matrix(self.store, start, end, device_id)
+
+
+def read_feature_matrix(store, start=None, end=None, device_id=None):
+    """Rows of a feature TimeSeriesStore sorted by time, duplicate steps dropped.
+
+    Returns a dict with 'timestamp', 'device_id', TARGET and the feature columns.
+    """
+    data = store.read(start, end, device_id=device_id)
+    devices = np.asarray([device or '' for device in data['device_id']], dtype=object)
+    # Keep the last row written for each (device, step)
+    order = np.lexsort((np.arange(len(devices))[::-1], data['timestamp'], devices.astype(str)))
+    keys_ts, keys_dev = data['timestamp'][order], devices[order]
+    first = np.concatenate(([True], (keys_ts[1:] != keys_ts[:-1]) | (keys_dev[1:] != keys_dev[:-1])))
+    keep = order[first]
+    keep = keep[np.argsort(data['timestamp'][keep], kind='stable')]
+    result = {'timestamp': data['timestamp'][keep], 'device_id': devices[keep], TARGET: data['energy'][keep]}
+    for name in feature_names():
+        result[name] = data[name][keep]
+    return result
+
+
+def lag_feature_matrix(values, chunk_rows=65536):
+    """add_lag_features for a whole series at once (vectorized, bounded memory).
+
+    ``values`` is the Energy series on the step grid; returns a dict of
+    feature name -> float64 array of the same length.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    features = {}
+    for lag in LAGS:
+        column = np.full(n, np.nan)
+        column[lag:] = values[:n - lag] if lag < n else []
+        features[f'{TARGET}_lag_{lag}'] = column
+    shifted = np.concatenate(([np.nan], values[:-1])) if n else values
+    for w in ROLL_WINDOWS:
+        windows = sliding_window_view(np.concatenate((np.full(w - 1, np.nan), shifted)), w)
+        columns = {stat: np.full(n, np.nan) for stat in ('mean', 'std', 'min', 'max')}
+        for start in range(0, n, chunk_rows):
+            block = windows[start:start + chunk_rows]
+            valid = ~np.isnan(block)
+            count = valid.sum(axis=1)
+            enough = count >= _min_periods(w)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.where(valid, block, 0.0).sum(axis=1) / count
+                deviation = np.where(valid, block - mean[:, None], 0.0)
+                std = np.sqrt((deviation * deviation).sum(axis=1) / (count - 1))
+            part = slice(start, start + len(block))
+            columns['mean'][part] = np.where(enough, mean, np.nan)
+            columns['std'][part] = np.where(enough, std, np.nan)
+            columns['min'][part] = np.where(enough, np.fmin.reduce(block, axis=1), np.nan)
+            columns['max'][part] = np.where(enough, np.fmax.reduce(block, axis=1), np.nan)
+        for stat, column in columns.items():
+            features[f'{TARGET}_roll_{stat}_{w}'] = column
+    return features
@@ -0,0 +1,232 @@
+"""In-process energy forecasts from the LightGBM models of ml_model_training.py.
+
+The +1h / +1d boosters of the current model registry version
+(``<model_dir>/registry/CURRENT``) are loaded once: a device uses its own
+models when that version has them and the whole-history ("default") models
+otherwise. Models saved flat in ``model_dir`` by older training runs are
+still picked up as the default. Lag / rolling features come ready-made
+from the per-device FeatureStore (on the step grid the models were trained
+on); only the time features and the latest exogenous readings are added when
+a prediction is asked for. Model predictions are cached per (device, step),
+so all readings that land in the same step reuse one model call.
+
+Without lightgbm or without saved models the service falls back to a
+persistence forecast (the last observed Energy value), so callers always get
+a number once a device has reported Energy.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from feature_store import DEFAULT_STEP_SECONDS, TARGET, FeatureStore
+
+try:
+    import lightgbm as lgb
+except ImportError:  # optional: only needed to serve the trained models
+    lgb = None
+
+HORIZONS = ('1h', '1d')
+MODEL_FILES = {'1h': 'lgbm_energy_plus1h.txt', '1d': 'lgbm_energy_plus1d.txt'}
+META_FILE = 'forecast_meta.json'
+DEFAULT_MODEL = 'default'  # registry entry trained on the whole history
+
+
+def time_features(timestamp):
+    d = datetime.fromtimestamp(timestamp)
+    return {'hour': d.hour, 'dayofweek': d.weekday(), 'month': d.month, 'is_weekend': int(d.weekday() >= 5)}
+
+
+class ForecastService:
+    """Per-device online features + cached +1h / +1d predictions"""
+
+    def __init__(self, model_dir='models', step_seconds=None):
+        self.model_dir = model_dir
+        self.models = {}  # (model name, horizon) -> booster; model name is a device id or DEFAULT_MODEL
+        self.model_features = {}
+        self.step_seconds = step_seconds or DEFAULT_STEP_SECONDS
+        self.source = 'persistence'
+        self.version = None
+        self._readings = {}  # device_id -> latest raw reading (exogenous features)
+        self._cache = {}  # (device_id, horizon) -> (step, value)
+        self._lock = threading.Lock()
+        self.load()
+        self.features = FeatureStore(self.step_seconds)
+
+    def _model_files(self):
+        """{model name: directory} and step size of the current registry version (or the flat layout)"""
+        registry = os.path.join(self.model_dir, 'registry')
+        current = os.path.join(registry, 'CURRENT')
+        if os.path.exists(current):
+            with open(current) as f:
+                version = f.read().strip()
+            with open(os.path.join(registry, version, 'manifest.json')) as f:
+                manifest = json.load(f)
+            self.version = version
+            directories = {name: os.path.join(registry, version, entry['dir'])
+                           for name, entry in manifest['models'].items()}
+            return directories, manifest.get('step_seconds')
+        step_seconds = None
+        meta_path = os.path.join(self.model_dir, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                step_seconds = json.load(f).get('step_seconds')
+        return {DEFAULT_MODEL: self.model_dir}, step_seconds
+
+    def load(self):
+        """Load boosters and step size saved by ml_model_training.py (once, at startup)"""
+        directories, step_seconds = self._model_files()
+        self.step_seconds = step_seconds or self.step_seconds
+        if lgb is None:
+            print("⚠️ lightgbm not installed - forecasts use persistence")
+            return
+        for name, directory in directories.items():
+            for horizon in HORIZONS:
+                path = os.path.join(directory, MODEL_FILES[horizon])
+                if os.path.exists(path):
+                    booster = lgb.Booster(model_file=path)
+                    self.models[(name, horizon)] = booster
+                    self.model_features[(name, horizon)] = booster.feature_name()
+        if self.models:
+            self.source = 'lightgbm'
+            names = sorted({name for name, _ in self.models})
+            version = f" version {self.version}" if self.version else ""
+            print(f"✅ Forecast models loaded{version}: {len(self.models)} for {', '.join(names)} (step {self.step_seconds}s)")
+        else:
+            print(f"⚠️ No forecast models in {self.model_dir} - forecasts use persistence")
+        with self._lock:
+            self._cache.clear()
+
+    def _model_key(self, device_id, horizon):
+        """Device's own model if trained, else the default one (None: persistence)"""
+        if (device_id, horizon) in self.models:
+            return device_id, horizon
+        if (DEFAULT_MODEL, horizon) in self.models:
+            return DEFAULT_MODEL, horizon
+        return None
+
+    def open_features(self, root):
+        """Persist the per-device features under root (alongside the time-series storage)"""
+        self.features.open(root)
+
+    def observe(self, device_id, timestamp, reading):
+        """Record one reading ({metric: value}, Energy under 'energy' or 'Energy'); False if it came too late"""
+        energy = reading.get('energy', reading.get(TARGET))
+        try:
+            energy = float(energy) if energy not in (None, '') else np.nan
+        except (TypeError, ValueError):
+            energy = np.nan
+        if not self.features.observe(device_id, timestamp, energy):
+            return False
+        with self._lock:
+            self._readings[device_id] = reading
+        return True
+
+    def observe_batch(self, device_id, timestamps, columns, horizon, extra=None):
+        """observe + predict after each of many time-sorted readings; returns the predictions.
+
+        Gives the same values as calling observe / predict reading by reading,
+        but with a few calls per forecast step instead of per reading: a model
+        prediction only changes when a new step opens, and within a step later
+        readings only move the step's Energy and the last known value.
+        ``columns`` holds one float array per metric, ``extra`` values shared
+        by every reading (weather, relay state).
+        """
+        n = len(timestamps)
+        predicted = np.full(n, np.nan)
+        if not n:
+            return predicted
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        energy = np.asarray(columns.get('energy', columns.get(TARGET, np.full(n, np.nan))), dtype=np.float64)
+        persistence = self._model_key(device_id, horizon) is None
+        extra = extra or {}
+
+        def reading(i):
+            return {**{name: float(values[i]) for name, values in columns.items()}, **extra}
+
+        steps = (timestamps // self.step_seconds).astype(np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(steps)) + 1))
+        for a, b in zip(starts, np.append(starts[1:], n)):
+            accepted = self.observe(device_id, timestamps[a], reading(a))
+            predicted[a:b] = self.predict(device_id, horizon)
+            if b - a == 1:
+                continue
+            if persistence and accepted:
+                # Persistence forecast = last known Energy after each reading of the step
+                segment = energy[a:b]
+                last = np.maximum.accumulate(np.where(np.isnan(segment), -1, np.arange(b - a)))
+                predicted[a:b] = np.where(last >= 0, segment[np.maximum(last, 0)], predicted[a])
+            # The last reading with Energy sets the step value; the last reading the exogenous features
+            known = np.flatnonzero(~np.isnan(energy[a + 1:b]))
+            if len(known) and a + 1 + known[-1] != b - 1:
+                self.observe(device_id, timestamps[a + 1 + known[-1]], reading(a + 1 + known[-1]))
+            self.observe(device_id, timestamps[b - 1], reading(b - 1))
+        return predicted
+
+    def _feature_row(self, step, features, reading, names):
+        features = dict(features, **time_features(step * self.step_seconds))
+        lowered = {str(key).lower(): value for key, value in reading.items()}
+        row = np.empty((1, len(names)))
+        for i, name in enumerate(names):
+            value = features.get(name, lowered.get(name.lower()))
+            try:
+                row[0, i] = float(value) if value is not None else np.nan
+            except (TypeError, ValueError):
+                row[0, i] = np.nan
+        return row
+
+    def predict(self, device_id, horizon):
+        """Forecast of Energy ``horizon`` ahead (NaN if the device never reported Energy)"""
+        current = self.features.current(device_id)
+        if current is None:
+            return np.nan
+        step, features, last_known = current
+        key = self._model_key(device_id, horizon)
+        if key is None:
+            return last_known
+        with self._lock:
+            cached = self._cache.get((device_id, horizon))
+            if cached is not None and cached[0] == step:
+                return cached[1]
+            row = self._feature_row(step, features, self._readings.get(device_id, {}),
+                                    self.model_features[key])
+            value = float(self.models[key].predict(row)[0])
+            self._cache[(device_id, horizon)] = (step, value)
+            return value
+
+    def forecast(self, device_id):
+        """All horizons for a device, in the shape served by /api/forecast"""
+        current = self.features.current(device_id)
+        if current is None:
+            return None
+        seconds = {'1h': 3600, '1d': 86400}
+        as_of = current[0] * self.step_seconds
+        return {
+            'as_of': datetime.fromtimestamp(as_of).isoformat(),
+            'step_seconds': self.step_seconds,
+            'source': self.source,
+            'version': self.version,
+            'forecasts': {
+                horizon: {
+                    'energy': _json_number(self.predict(device_id, horizon)),
+                    'target_time': datetime.fromtimestamp(as_of + seconds[horizon]).isoformat(),
+                    'model': self._model_name(device_id, horizon),
+                }
+                for horizon in HORIZONS
+            },
+        }
+
+    def _model_name(self, device_id, horizon):
+        key = self._model_key(device_id, horizon)
+        if key is None:
+            return 'persistence'
+        return 'lightgbm (device)' if key[0] == device_id else 'lightgbm (default)'
+
+    def devices(self):
+        return self.features.devices()
+
+
+def _json_number(value):
+    return None if value is None or value != value else value
@@ -0,0 +1,237 @@
+"""Bounded background queue for outbound HTTP calls.
+
+Request handlers call ``submit(key, payload)`` and return immediately. A small
+pool of worker threads drains the queue in batches and hands them to a
+``send_batch(items)`` callback. Payloads waiting under the same key are
+coalesced (only the newest is sent), the oldest entry is dropped when the queue
+is full, and failed batches are retried with exponential backoff plus jitter.
+A callback that delivered part of a batch raises ``DeliveryError`` with the
+keys that failed, so only those are retried.
+A batch waiting for its retry is parked, not slept on, so the workers keep
+sending everything else in the meantime.
+With ``linger`` set, a worker waits that long after the first item arrives so
+that items submitted close together are handed over as one batch.
+"""
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def pooled_session(pool_size=10, user_agent='SolarMonitor/1.0'):
+    """requests.Session with keep-alive connections shared by the worker threads"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'User-Agent': user_agent})
+    return session
+
+
+class DeliveryError(Exception):
+    """Raised by send_batch when only some items failed; ``failed`` holds their keys"""
+
+    def __init__(self, failed, error):
+        super().__init__(str(error))
+        self.failed = set(failed)
+        self.error = error
+
+
+class OutboundQueue:
+    """Coalescing, bounded work queue with a worker pool and delivery metrics"""
+
+    def __init__(self, name, send_batch, maxsize=1000, workers=2, batch_size=20,
+                 max_retries=3, backoff_base=0.5, backoff_max=30.0, linger=0.0, on_give_up=None):
+        self.name = name
+        self.send_batch = send_batch
+        self.maxsize = maxsize
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.linger = linger
+        self.on_give_up = on_give_up
+
+        self._pending = OrderedDict()  # key -> (payload, enqueued_at, attempts)
+        self._delayed = []  # heap of (retry_at, seq, key, payload, enqueued_at, attempts)
+        self._retrying = {}  # key -> seq of its parked retry (dropped when newer data arrives)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self._stopping = False
+        self._counters = {
+            'submitted': 0, 'sent': 0, 'coalesced': 0, 'dropped': 0,
+            'failed': 0, 'retries': 0, 'batches': 0,
+        }
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._latency_last = None
+
+    # ----- producer side -----
+    def submit(self, key, payload):
+        """Queue a payload; never blocks. Returns False if an older entry had to be dropped"""
+        self._ensure_workers()
+        dropped = False
+        with self._cond:
+            self._counters['submitted'] += 1
+            if self._retrying.pop(key, None) is not None:
+                self._counters['coalesced'] += 1  # the parked retry of this key is now stale
+            if key in self._pending:
+                # Newer data for the same key replaces the queued one
+                _, enqueued_at, attempts = self._pending.pop(key)
+                self._pending[key] = (payload, enqueued_at, attempts)
+                self._counters['coalesced'] += 1
+            else:
+                if len(self._pending) >= self.maxsize:
+                    self._pending.popitem(last=False)
+                    self._counters['dropped'] += 1
+                    dropped = True
+                self._pending[key] = (payload, time.time(), 0)
+            self._cond.notify()
+        return not dropped
+
+    def depth(self):
+        return len(self._pending) + len(self._retrying)
+
+    def stats(self):
+        with self._cond:
+            delivered = self._counters['sent']
+            return {
+                'name': self.name,
+                'depth': len(self._pending) + len(self._retrying),
+                'retrying': len(self._retrying),
+                'capacity': self.maxsize,
+                'workers': self.workers,
+                **self._counters,
+                'latency_ms': {
+                    'last': round(self._latency_last * 1000, 1) if self._latency_last is not None else None,
+                    'avg': round(self._latency_total / delivered * 1000, 1) if delivered else None,
+                    'max': round(self._latency_max * 1000, 1),
+                },
+            }
+
+    # ----- worker side -----
+    def _ensure_workers(self):
+        # Threads do not survive a fork, so (re)start them in each worker process
+        if self._pid == os.getpid() and not self._stopping:
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._threads = []
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'{self.name}-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _take_batch(self):
+        with self._cond:
+            while True:
+                self._promote_due()
+                if self._pending or self._stopping:
+                    break
+                self._cond.wait(self._delayed[0][0] - time.time() if self._delayed else None)
+            if self.linger and self._pending:
+                oldest = next(iter(self._pending.values()))[1]
+                while len(self._pending) < self.batch_size and not self._stopping:
+                    remaining = oldest + self.linger - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                key, (payload, enqueued_at, attempts) = self._pending.popitem(last=False)
+                batch.append((key, payload, enqueued_at, attempts))
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            try:
+                self.send_batch([(key, payload) for key, payload, _, _ in batch])
+            except DeliveryError as e:
+                # Items delivered before the failure must not be sent again
+                self._record_sent([item for item in batch if item[0] not in e.failed])
+                self._retry_later([item for item in batch if item[0] in e.failed], e.error)
+                continue
+            except Exception as e:
+                self._retry_later(batch, e)
+                continue
+            self._record_sent(batch)
+
+    def _record_sent(self, batch):
+        if not batch:
+            return
+        now = time.time()
+        with self._cond:
+            self._counters['batches'] += 1
+            for _, _, enqueued_at, _ in batch:
+                latency = now - enqueued_at
+                self._counters['sent'] += 1
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+                self._latency_last = latency
+
+    def _retry_later(self, batch, error):
+        if not batch:
+            return
+        attempts = max(item[3] for item in batch) + 1
+        if attempts > self.max_retries:
+            with self._cond:
+                self._counters['failed'] += len(batch)
+            print(f"❌ {self.name}: giving up on {len(batch)} item(s) after {attempts} attempts: {error}")
+            if self.on_give_up:
+                self.on_give_up([(key, payload) for key, payload, _, _ in batch])
+            return
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        delay = random.uniform(delay / 2, delay)  # jitter so workers do not retry in lockstep
+        print(f"⚠️ {self.name}: send failed ({error}), retry {attempts}/{self.max_retries} in {delay:.1f}s")
+        retry_at = time.time() + delay
+        with self._cond:
+            self._counters['retries'] += len(batch)
+            for key, payload, enqueued_at, _ in batch:
+                seq = next(self._seq)
+                self._retrying[key] = seq
+                heapq.heappush(self._delayed, (retry_at, seq, key, payload, enqueued_at, attempts))
+            self._cond.notify_all()
+
+    def _promote_due(self):
+        """Move parked retries whose backoff has elapsed to the front of the queue (call under the lock)"""
+        now = time.time()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, seq, key, payload, enqueued_at, attempts = heapq.heappop(self._delayed)
+            if self._retrying.get(key) != seq:
+                continue  # superseded by a newer submit (already counted as coalesced)
+            del self._retrying[key]
+            if key in self._pending:
+                # A newer payload arrived while we were waiting; the old one is stale
+                self._counters['coalesced'] += 1
+                continue
+            if len(self._pending) >= self.maxsize:
+                self._counters['dropped'] += 1
+                continue
+            self._pending[key] = (payload, enqueued_at, attempts)
+            self._pending.move_to_end(key, last=False)
+
+    def stop(self, timeout=5.0):
+        """Let workers drain what is queued, then stop them"""
+        deadline = time.time() + timeout
+        while (self._pending or self._retrying) and time.time() < deadline:
+            time.sleep(0.05)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.time()))
@@ -0,0 +1,192 @@
+"""Server-Sent Events fan-out of live dashboard data.
+
+Ingest calls ``publish(device_id, snapshot)`` with the same dict the polling
+endpoints return. The broker diffs it against the device's previous
+snapshot and encodes the changed fields once as an SSE ``delta`` event; that
+one bytes object is queued for every client subscribed to the device (or to
+all devices), so the cost per reading does not grow with the number of open
+dashboards. A client first gets a ``snapshot`` event (encoded once per
+reading, only when someone needs it) and deltas afterwards.
+
+Every client has a bounded buffer. A client that falls more than
+``max_buffer`` events behind has its backlog dropped and is resynced with a
+fresh snapshot, so a slow dashboard never holds memory or delays the others.
+
+The broker lives in one process: the Procfile / render.yaml run gunicorn
+with one gthread worker (``WEB_CONCURRENCY``, default 1) and many threads
+(``GUNICORN_THREADS``, default 100) so every client sees every reading. Each
+open stream holds one thread for as long as the page is open - under the
+default sync worker a single dashboard would take the only worker and starve
+the devices - so ``max_subscribers`` must stay below the thread count.
+
+The price is that the API runs in a single process: the SQLite weather
+lease and the store's file locks only matter across deploys and the
+training scripts, and request handling shares one GIL. A deployment that
+needs more workers can raise ``WEB_CONCURRENCY``; each worker then streams
+only the readings it ingested itself.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+ALL_DEVICES = '*'
+_MISSING = object()
+
+
+def diff(old, new):
+    """Changed top-level fields; nested dicts are diffed one level down. Removed keys map to None"""
+    changes = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = {k: v for k, v in value.items() if previous.get(k, _MISSING) != v}
+            nested.update({k: None for k in previous if k not in value})
+            if nested:
+                changes[key] = nested
+        elif previous != value or key not in old:
+            changes[key] = value
+    changes.update({key: None for key in old if key not in new})
+    return changes
+
+
+def sse_event(event, data, event_id=None):
+    """One SSE frame as bytes"""
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{head}event: {event}\ndata: {json.dumps(data, separators=(",", ":"), default=str)}\n\n'.encode('utf-8')
+
+
+class Subscriber:
+    """Bounded queue of encoded events for one client"""
+
+    def __init__(self, device_id, max_buffer):
+        self.device_id = device_id
+        self.max_buffer = max_buffer
+        self.events = deque()
+        self.resync = True  # start with a snapshot
+        self.dropped = 0
+        self.cond = threading.Condition()
+
+    def put(self, event):
+        with self.cond:
+            if len(self.events) >= self.max_buffer:
+                # Too far behind: drop the backlog and send a snapshot instead
+                self.dropped += len(self.events)
+                self.events.clear()
+                self.resync = True
+            else:
+                self.events.append(event)
+            self.cond.notify()
+
+    def take(self, timeout):
+        """(resync needed, queued events) - waits up to timeout for something to send"""
+        with self.cond:
+            if not self.events and not self.resync:
+                self.cond.wait(timeout)
+            events, self.events = list(self.events), deque()
+            resync, self.resync = self.resync, False
+            return resync, events
+
+
+class LiveBroker:
+    """Latest snapshot per device and the clients subscribed to it"""
+
+    def __init__(self, max_buffer=100, max_subscribers=1000, heartbeat=15.0, retry_ms=3000):
+        self.max_buffer = max_buffer
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self.retry_ms = retry_ms
+        self._latest = {}  # device_id -> (seq, snapshot dict, encoded snapshot or None)
+        self._subscribers = {}  # device_id or ALL_DEVICES -> set of Subscriber
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._counters = {'published': 0, 'deltas': 0, 'unchanged': 0, 'encoded_bytes': 0, 'resyncs': 0}
+
+    def publish(self, device_id, snapshot):
+        """New data of a device: one delta encoding, queued for all its subscribers"""
+        device_id = str(device_id)
+        with self._lock:
+            self._counters['published'] += 1
+            previous = self._latest.get(device_id)
+            changes = diff(previous[1], snapshot) if previous else snapshot
+            # The reading time always moves; it alone is not worth an event
+            if previous and set(changes) <= {'timestamp'}:
+                self._counters['unchanged'] += 1
+                self._latest[device_id] = (previous[0], snapshot, None)
+                return None
+            self._seq += 1
+            seq = self._seq
+            self._latest[device_id] = (seq, snapshot, None)
+            targets = list(self._subscribers.get(device_id, ())) + list(self._subscribers.get(ALL_DEVICES, ()))
+            if not targets:
+                return None
+            event = sse_event('delta', {'device_id': device_id, 'seq': seq, 'changes': changes}, seq)
+            self._counters['deltas'] += 1
+            self._counters['encoded_bytes'] += len(event)
+        for subscriber in targets:
+            subscriber.put(event)
+        return event
+
+    def _snapshot_events(self, device_id):
+        """Encoded snapshots of one device (or all), cached until the next reading"""
+        with self._lock:
+            devices = list(self._latest) if device_id == ALL_DEVICES else [device_id]
+            events = []
+            for device in devices:
+                latest = self._latest.get(device)
+                if latest is None:
+                    continue
+                seq, snapshot, encoded = latest
+                if encoded is None:
+                    encoded = sse_event('snapshot', {'device_id': device, 'seq': seq, 'data': snapshot}, seq)
+                    self._latest[device] = (seq, snapshot, encoded)
+                    self._counters['encoded_bytes'] += len(encoded)
+                events.append(encoded)
+            self._counters['resyncs'] += 1
+            return events
+
+    def subscribe(self, device_id=None):
+        """New client of one device (None: every device); None when the server is full"""
+        key = str(device_id) if device_id else ALL_DEVICES
+        subscriber = Subscriber(key, self.max_buffer)
+        with self._lock:
+            if sum(len(s) for s in self._subscribers.values()) >= self.max_subscribers:
+                return None
+            self._subscribers.setdefault(key, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.device_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[subscriber.device_id]
+
+    def stream(self, subscriber):
+        """Generator of SSE bytes for one client (unsubscribes when the client goes away)"""
+        try:
+            yield f'retry: {self.retry_ms}\n\n'.encode('utf-8')
+            last_sent = time.time()
+            while True:
+                resync, events = subscriber.take(self.heartbeat)
+                if resync:
+                    # A snapshot supersedes anything queued before it
+                    events = self._snapshot_events(subscriber.device_id)
+                if events:
+                    yield b''.join(events)
+                    last_sent = time.time()
+                elif time.time() - last_sent >= self.heartbeat:
+                    yield b': ping\n\n'
+                    last_sent = time.time()
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                'devices': len(self._latest),
+                'subscribers': sum(len(s) for s in self._subscribers.values()),
+                'dropped': sum(s.dropped for subs in self._subscribers.values() for s in subs),
+            }
@@ -0,0 +1,134 @@
+"""Regular step grids materialized on read, with vectorized limited gap filling.
+
+The store keeps only the readings that arrived (gaps are interval records,
+see ``GapLog``), so a regular grid is built when a window is asked for:
+readings are folded onto ``step``-second buckets (aligned to the epoch like
+the feature store), then short gaps are filled in NumPy with the same rules
+pandas applies in training - ``interpolate(limit=n, limit_direction='both')``
+for measurements and ``ffill(limit=n)`` for Energy.
+"""
+import numpy as np
+
+INTERPOLATE_LIMIT = 4  # steps interpolated from either side of a gap
+FFILL_LIMIT = 2        # steps Energy is carried forward
+FFILL_COLUMNS = ('energy', 'Energy')
+AGGREGATIONS = ('last', 'mean')
+
+
+def _neighbours(valid):
+    """Index of the previous (-1: none) and next (n: none) valid row, per column"""
+    n = len(valid)
+    index = np.arange(n).reshape(-1, *([1] * (valid.ndim - 1)))
+    previous = np.maximum.accumulate(np.where(valid, index, -1), axis=0)
+    following = np.minimum.accumulate(np.where(valid, index, n)[::-1], axis=0)[::-1]
+    return index, previous, following
+
+
+def interpolate_limited(values, limit=INTERPOLATE_LIMIT):
+    """Linear interpolation of NaN runs, at most ``limit`` steps from either side.
+
+    Matches pandas ``interpolate(limit=limit, limit_direction='both')``:
+    leading / trailing NaNs take the nearest value, the middle of gaps longer
+    than ``2 * limit`` stays NaN. Works column-wise on 1-D or 2-D arrays.
+    """
+    values = np.asarray(values)
+    valid = ~np.isnan(values)
+    if valid.all() or not len(values):
+        return values.copy()
+    n = len(values)
+    index, previous, following = _neighbours(valid)
+    fill = ~valid & (((previous >= 0) & (index - previous <= limit)) |
+                     ((following < n) & (following - index <= limit)))
+    data = values.astype(np.float64)
+    left = np.take_along_axis(data, np.clip(previous, 0, n - 1), axis=0)
+    right = np.take_along_axis(data, np.clip(following, 0, n - 1), axis=0)
+    span = np.where(following > previous, following - previous, 1)
+    with np.errstate(invalid='ignore'):
+        inner = left + (right - left) * (index - previous) / span
+    filled = np.where(previous < 0, right, np.where(following >= n, left, inner))
+    result = values.copy()
+    result[fill] = filled[fill]
+    return result
+
+
+def ffill_limited(values, limit=FFILL_LIMIT):
+    """Carry the last value forward over at most ``limit`` NaNs (pandas ``ffill(limit=limit)``)"""
+    values = np.asarray(values)
+    valid = ~np.isnan(values)
+    if valid.all() or not len(values):
+        return values.copy()
+    index, previous, _ = _neighbours(valid)
+    fill = ~valid & (previous >= 0) & (index - previous <= limit)
+    result = values.copy()
+    result[fill] = np.take_along_axis(values, np.clip(previous, 0, None), axis=0)[fill]
+    return result
+
+
+class GridAccumulator:
+    """Fold time-ordered reading chunks onto the buckets of one window"""
+
+    def __init__(self, start, end, step, columns, how='last'):
+        if how not in AGGREGATIONS:
+            raise ValueError(f"how must be one of {', '.join(AGGREGATIONS)}")
+        self.step = float(step)
+        self.first = int(np.floor(start / self.step))
+        self.count = max(0, int(np.floor(end / self.step)) - self.first + 1)
+        self.columns = list(columns)
+        self.how = how
+        shape = (self.count, len(self.columns))
+        self.values = np.full(shape, np.nan)
+        self.sums = np.zeros(shape) if how == 'mean' else None
+        self.counts = np.zeros(shape, dtype=np.int64) if how == 'mean' else None
+
+    def add(self, timestamps, data):
+        """One chunk: timestamps (epoch seconds) + {column: float array}"""
+        buckets = np.floor(np.asarray(timestamps, dtype=np.float64) / self.step).astype(np.int64) - self.first
+        inside = (buckets >= 0) & (buckets < self.count)
+        if not inside.any():
+            return
+        buckets = buckets[inside]
+        for j, name in enumerate(self.columns):
+            column = np.asarray(data[name], dtype=np.float64)[inside]
+            present = ~np.isnan(column)
+            if not present.any():
+                continue
+            where, column = buckets[present], column[present]
+            if self.how == 'mean':
+                self.sums[:, j] += np.bincount(where, weights=column, minlength=self.count)
+                self.counts[:, j] += np.bincount(where, minlength=self.count)
+            else:
+                # Chunks arrive in time order: the last reading of a bucket wins
+                where, last = np.unique(where[::-1], return_index=True)
+                self.values[where, j] = column[::-1][last]
+
+    def grid(self, interpolate_limit=INTERPOLATE_LIMIT, ffill_limit=FFILL_LIMIT):
+        """{'timestamp': bucket starts, column: filled values} (NaN where gaps stay open)"""
+        values = self.values
+        if self.how == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = np.where(self.counts > 0, self.sums / self.counts, np.nan)
+        result = {'timestamp': (self.first + np.arange(self.count)) * self.step}
+        for j, name in enumerate(self.columns):
+            if name in FFILL_COLUMNS:
+                result[name] = ffill_limited(values[:, j], ffill_limit)
+            else:
+                result[name] = interpolate_limited(values[:, j], interpolate_limit)
+        return result
+
+
+def read_grid(store, start, end, step, columns, device_id=None, how='last',
+              interpolate_limit=INTERPOLATE_LIMIT, ffill_limit=FFILL_LIMIT):
+    """Regular grid of float ``columns`` for [start, end] read from a TimeSeriesStore.
+
+    Only the requested window is read (chunk by chunk); readings up to the
+    fill limits before / after it are included so gaps at its edges are
+    filled as they would be inside a longer window.
+    """
+    margin = step * (max(interpolate_limit, ffill_limit) + 1)
+    first = (np.floor(start / step) * step) - margin
+    accumulator = GridAccumulator(first, end + margin, step, columns, how)
+    for data in store.iter_chunks(first, end + margin, device_id, columns):
+        accumulator.add(data['timestamp'], data)
+    grid = accumulator.grid(interpolate_limit, ffill_limit)
+    keep = (grid['timestamp'] >= np.floor(start / step) * step) & (grid['timestamp'] <= end)
+    return {name: values[keep] for name, values in grid.items()}
@@ -0,0 +1,192 @@
+"""Fixed-size, time-windowed ring buffer of readings with running trend statistics.
+
+Each buffer keeps the last ``window`` seconds (at most ``capacity`` readings)
+of one device and maintains, per field, the sums needed for an ordinary
+least-squares line through (timestamp, value): n, Σt, Σt², Σx, Σx², Σtx.
+Appending or evicting a reading adds/subtracts its terms, so the rolling
+mean, variance and slope cost O(1) per reading no matter how often a device
+reports or how long the window is. Timestamps are taken relative to the
+oldest reading in the buffer to keep the sums well conditioned, and the sums
+are rebuilt from the stored readings every ``capacity`` appends so float
+rounding cannot accumulate.
+
+Missing values (NaN) are kept in the buffer but left out of that field's sums.
+"""
+import numpy as np
+
+# Rows of the running sums
+_N, _ST, _STT, _SX, _SXX, _STX = range(6)
+
+
+def _terms(dt, values):
+    """Per-reading contributions to the six running sums; dt (m,), values (m, k) -> (m, 6, k)"""
+    present = ~np.isnan(values)
+    x = np.where(present, values, 0.0)
+    t = np.where(present, dt[:, None], 0.0)
+    return np.stack([present.astype(np.float64), t, t * t, x, x * x, t * x], axis=1)
+
+
+def _stats(sums):
+    """(..., 6, k) sums -> count, mean, variance, slope arrays of shape (..., k)"""
+    n = sums[..., _N, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums[..., _SX, :] / n
+        variance = np.maximum(sums[..., _SXX, :] / n - mean * mean, 0.0)
+        denominator = n * sums[..., _STT, :] - sums[..., _ST, :] ** 2
+        slope = (n * sums[..., _STX, :] - sums[..., _ST, :] * sums[..., _SX, :]) / denominator
+    # A line needs two readings at different times
+    slope = np.where((n >= 2) & (denominator > 1e-9 * np.maximum(n * sums[..., _STT, :], 1.0)), slope, np.nan)
+    mean = np.where(n > 0, mean, np.nan)
+    variance = np.where(n > 0, variance, np.nan)
+    return n, mean, variance, slope
+
+
+class RingBuffer:
+    """Recent timestamped readings of one device plus rolling mean/variance/slope"""
+
+    def __init__(self, fields=('value',), window=300.0, capacity=256):
+        self.fields = tuple(fields)
+        self.window = float(window)
+        self.capacity = int(capacity)
+        self._index = {name: i for i, name in enumerate(self.fields)}
+        self._ts = np.zeros(self.capacity)
+        self._values = np.full((self.capacity, len(self.fields)), np.nan)
+        self._start = 0  # position of the oldest reading
+        self._size = 0
+        self._t0 = 0.0
+        self._sums = np.zeros((6, len(self.fields)))
+        self._appends = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def last_timestamp(self):
+        return self._ts[(self._start + self._size - 1) % self.capacity] if self._size else None
+
+    def ordered(self):
+        """(timestamps, values) of the buffered readings, oldest first"""
+        positions = (self._start + np.arange(self._size)) % self.capacity
+        return self._ts[positions], self._values[positions]
+
+    def _row(self, values):
+        if isinstance(values, dict):
+            values = [values.get(name) for name in self.fields]
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+    def append(self, timestamp, values):
+        """Add one reading (sequence in field order or dict). Older-than-last readings are ignored"""
+        timestamp = float(timestamp)
+        if self._size and timestamp < self.last_timestamp:
+            return False
+        row = self._row(values)
+        if not self._size:
+            self._t0 = timestamp
+
+        # Drop readings that fell out of the window (or out of the buffer)
+        while self._size and (self._size == self.capacity or self._ts[self._start] < timestamp - self.window):
+            old = self._start
+            self._sums -= _terms(self._ts[old:old + 1] - self._t0, self._values[old:old + 1])[0]
+            self._start = (self._start + 1) % self.capacity
+            self._size -= 1
+
+        position = (self._start + self._size) % self.capacity
+        self._ts[position] = timestamp
+        self._values[position] = row
+        self._size += 1
+        self._sums += _terms(np.array([timestamp - self._t0]), row[None, :])[0]
+
+        self._appends += 1
+        if self._appends >= self.capacity:
+            self._rebuild()
+        return True
+
+    def _rebuild(self):
+        """Recompute the sums exactly, relative to the oldest buffered reading"""
+        ts, values = self.ordered()
+        self._t0 = ts[0] if len(ts) else 0.0
+        self._sums = _terms(ts - self._t0, values).sum(axis=0) if len(ts) else np.zeros_like(self._sums)
+        self._appends = 0
+
+    def extend(self, timestamps, values):
+        """Append many time-sorted readings at once (vectorized).
+
+        ``values`` is an (m, fields) array. Returns a dict field ->
+        (count, mean, variance, slope) arrays holding the statistics right
+        after each reading, exactly as if they had been appended one by one.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(timestamps), len(self.fields))
+        m = len(timestamps)
+        result_shape = (m, len(self.fields))
+        count = np.zeros(result_shape)
+        mean, variance, slope = (np.full(result_shape, np.nan) for _ in range(3))
+
+        # Readings older than what is already buffered are ignored, as in append()
+        last = self.last_timestamp
+        accepted = np.ones(m, dtype=bool)
+        if m:
+            running_max = np.maximum.accumulate(np.concatenate(([last if last is not None else -np.inf], timestamps)))
+            accepted = timestamps >= running_max[:-1]
+        new_ts, new_values = timestamps[accepted], values[accepted]
+
+        old_ts, old_values = self.ordered()
+        all_ts = np.concatenate((old_ts, new_ts))
+        all_values = np.concatenate((old_values, new_values))
+        if len(all_ts):
+            t0 = all_ts[0]
+            cumulative = np.concatenate((
+                np.zeros((1, 6, len(self.fields))),
+                np.cumsum(_terms(all_ts - t0, all_values), axis=0),
+            ))
+            ends = np.arange(len(old_ts), len(all_ts)) + 1
+            starts = np.searchsorted(all_ts, all_ts[ends - 1] - self.window, side='left')
+            starts = np.maximum(starts, ends - self.capacity)
+            n, mu, var, sl = _stats(cumulative[ends] - cumulative[starts])
+
+            # Rejected readings see the statistics of the reading before them
+            accepted_positions = np.flatnonzero(accepted)
+            count[accepted_positions], mean[accepted_positions] = n, mu
+            variance[accepted_positions], slope[accepted_positions] = var, sl
+            if not accepted.all():
+                before = self.stats_arrays()
+                fill = np.maximum.accumulate(np.where(accepted, np.arange(m), -1))
+                for array, initial in zip((count, mean, variance, slope), before):
+                    array[:] = np.where((fill >= 0)[:, None], array[np.maximum(fill, 0)], initial)
+
+            # Keep what the window still covers after the last reading
+            keep_from = starts[-1] if len(starts) else 0
+            self._load(all_ts[keep_from:], all_values[keep_from:])
+
+        return {name: (count[:, i], mean[:, i], variance[:, i], slope[:, i]) for i, name in enumerate(self.fields)}
+
+    def _load(self, ts, values):
+        ts, values = ts[-self.capacity:], values[-self.capacity:]
+        self._ts[:len(ts)] = ts
+        self._values[:len(ts)] = values
+        self._start = 0
+        self._size = len(ts)
+        self._rebuild()
+
+    def stats_arrays(self):
+        """count, mean, variance, slope arrays (one entry per field)"""
+        return _stats(self._sums)
+
+    def stats(self, field=None):
+        """{'count', 'mean', 'variance', 'slope'} for one field (or a dict of all fields)"""
+        n, mean, variance, slope = self.stats_arrays()
+        result = {
+            name: {'count': int(n[i]), 'mean': float(mean[i]), 'variance': float(variance[i]), 'slope': float(slope[i])}
+            for i, name in enumerate(self.fields)
+        }
+        return result[field] if field is not None else result
+
+    def slope(self, field='value'):
+        """Least-squares slope (units per second) over the window, NaN with fewer than 2 readings"""
+        return float(self.stats_arrays()[3][self._index[field]])
+
+    def mean(self, field='value'):
+        return float(self.stats_arrays()[1][self._index[field]])
+
+    def variance(self, field='value'):
+        return float(self.stats_arrays()[2][self._index[field]])
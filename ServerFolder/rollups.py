@@ -0,0 +1,325 @@
+"""Downsampled rollups (1-min, 15-min, hourly, daily) of the raw readings.
+
+Every ingested reading is folded into the open bucket of each tier. A bucket
+is kept as a *partial aggregate* (count, sum, min, max and last value per
+metric, plus the first energy reading), and partials of the same bucket can
+always be merged. Closed buckets are appended to one TimeSeriesStore per tier.
+Late readings and other gunicorn workers just write extra partials, which are
+merged when the tier is read.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from timeseries_store import TimeSeriesStore
+
+TIERS = (
+    ('1m', 60),
+    ('15m', 900),
+    ('1h', 3600),
+    ('1d', 86400),
+)
+
+ROLLUP_METRICS = (
+    'box_temp', 'frequency', 'voltage', 'current', 'power', 'energy',
+    'solar_voltage', 'solar_current', 'solar_power',
+    'battery_percentage', 'light_intensity', 'battery_voltage',
+)
+
+AGGREGATES = ('count', 'sum', 'min', 'max', 'last')
+MERGE_COLUMNS = ('_count', '_sum', '_last_ts')  # per-metric helpers of merged buckets, not returned
+
+
+def rollup_columns(metrics):
+    columns = [('device_id', 's'), ('first_ts', 'f'), ('last_ts', 'f'), ('energy_first', 'f')]
+    for metric in metrics:
+        columns += [(f'{metric}_{agg}', 'f') for agg in AGGREGATES]
+    return columns
+
+
+class _Partial:
+    """Aggregate of some readings of one device inside one bucket"""
+    __slots__ = ('start', 'count', 'sum', 'min', 'max', 'last', 'first_ts', 'last_ts', 'energy_first')
+
+    def merge(self, other):
+        self.count = self.count + other.count
+        self.sum = self.sum + other.sum
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        if other.last_ts >= self.last_ts:
+            self.last = np.where(np.isnan(other.last), self.last, other.last)
+            self.last_ts = other.last_ts
+        if np.isnan(self.energy_first) or (other.first_ts < self.first_ts and not np.isnan(other.energy_first)):
+            self.energy_first = other.energy_first
+        self.first_ts = min(self.first_ts, other.first_ts)
+
+
+def _partials(timestamps, values, bucket_seconds, energy_index):
+    """Split time-sorted readings into per-bucket partial aggregates (vectorized)"""
+    buckets = np.floor(timestamps / bucket_seconds) * bucket_seconds
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    ends = np.concatenate((starts[1:], [len(timestamps)])) - 1
+
+    valid = ~np.isnan(values)
+    positions = np.arange(len(timestamps))[:, None]
+    count = np.add.reduceat(valid.astype(np.float64), starts, axis=0)
+    total = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+    low = np.fmin.reduceat(values, starts, axis=0)
+    high = np.fmax.reduceat(values, starts, axis=0)
+    last_pos = np.maximum.reduceat(np.where(valid, positions, -1), starts, axis=0)
+    last = np.where(last_pos >= 0, values[np.maximum(last_pos, 0), np.arange(values.shape[1])], np.nan)
+
+    energy_first = np.full(len(starts), np.nan)
+    if energy_index is not None:
+        energy = values[:, energy_index]
+        first_pos = np.minimum.reduceat(np.where(~np.isnan(energy), positions[:, 0], len(energy)), starts)
+        has_energy = first_pos < len(energy)
+        energy_first[has_energy] = energy[first_pos[has_energy]]
+
+    partials = []
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        partial = _Partial()
+        partial.start = float(buckets[start])
+        partial.count, partial.sum = count[i], total[i]
+        partial.min, partial.max, partial.last = low[i], high[i], last[i]
+        partial.first_ts = float(timestamps[start])
+        partial.last_ts = float(timestamps[end])
+        partial.energy_first = float(energy_first[i])
+        partials.append(partial)
+    return partials
+
+
+class RollupStore:
+    """Maintains all rollup tiers from the ingest path and answers range queries"""
+
+    def __init__(self, root, metrics=ROLLUP_METRICS, tiers=TIERS):
+        self.metrics = tuple(metrics)
+        self.tiers = tuple(tiers)
+        self.tier_seconds = dict(self.tiers)
+        self._energy_index = self.metrics.index('energy') if 'energy' in self.metrics else None
+        columns = rollup_columns(self.metrics)
+        self.stores = {
+            name: TimeSeriesStore(os.path.join(root, name), columns=columns)
+            for name, _ in self.tiers
+        }
+        self._open = {}  # (device_id, tier) -> _Partial of the newest bucket
+        self._lock = threading.Lock()
+
+    # ----- ingest -----
+    def add(self, device_id, timestamp, values):
+        """Fold one reading (dict of metric values) into every tier"""
+        row = np.array([[_float(values.get(metric)) for metric in self.metrics]])
+        self.add_many(device_id, np.array([float(timestamp)]), row)
+
+    def add_columns(self, device_id, timestamps, columns):
+        """Fold many readings given as {metric: array} into every tier"""
+        values = np.column_stack([
+            np.asarray(columns.get(metric, np.full(len(timestamps), np.nan)), dtype=np.float64)
+            for metric in self.metrics
+        ])
+        self.add_many(device_id, np.asarray(timestamps, dtype=np.float64), values)
+
+    def add_many(self, device_id, timestamps, values):
+        if not len(timestamps):
+            return
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, values = timestamps[order], values[order]
+        closed = []
+        with self._lock:
+            for tier, seconds in self.tiers:
+                key = (device_id, tier)
+                current = self._open.get(key)
+                for partial in _partials(timestamps, values, seconds, self._energy_index):
+                    if current is not None and partial.start == current.start:
+                        current.merge(partial)
+                    elif current is None or partial.start > current.start:
+                        if current is not None:
+                            closed.append((tier, device_id, current))
+                        current = partial
+                    else:
+                        # Late reading for a bucket that was already written
+                        closed.append((tier, device_id, partial))
+                self._open[key] = current
+        self._write(closed)
+
+    def close_stale(self, grace=5.0):
+        """Write open buckets whose time span has ended (devices that went quiet)"""
+        now = time.time()
+        closed = []
+        with self._lock:
+            for (device_id, tier), partial in list(self._open.items()):
+                if partial.start + self.tier_seconds[tier] + grace <= now:
+                    closed.append((tier, device_id, partial))
+                    del self._open[(device_id, tier)]
+        self._write(closed)
+
+    def flush(self):
+        """Write every open bucket as a partial and flush all tiers (shutdown)"""
+        with self._lock:
+            closed = [(tier, device_id, partial) for (device_id, tier), partial in self._open.items()]
+            self._open = {}
+        self._write(closed)
+        for store in self.stores.values():
+            store.flush()
+
+    def flush_if_due(self):
+        self.close_stale()
+        for store in self.stores.values():
+            store.flush_if_due()
+
+    def _write(self, closed):
+        by_tier = {}
+        for tier, device_id, partial in closed:
+            by_tier.setdefault(tier, []).append(self._to_row(device_id, partial))
+        for tier, rows in by_tier.items():
+            self.stores[tier].append_many(rows)
+
+    def _to_row(self, device_id, partial):
+        row = {
+            'timestamp': partial.start,
+            'device_id': device_id,
+            'first_ts': partial.first_ts,
+            'last_ts': partial.last_ts,
+            'energy_first': partial.energy_first,
+        }
+        for i, metric in enumerate(self.metrics):
+            row[f'{metric}_count'] = partial.count[i]
+            row[f'{metric}_sum'] = partial.sum[i]
+            row[f'{metric}_min'] = partial.min[i]
+            row[f'{metric}_max'] = partial.max[i]
+            row[f'{metric}_last'] = partial.last[i]
+        return row
+
+    # ----- queries -----
+    def choose_tier(self, start, end, max_points, devices=1):
+        """Finest tier whose point count over [start, end] fits in max_points.
+
+        ``devices`` is the number of per-device series in the answer, each
+        holding one point per bucket.
+        """
+        span = max(end - start, 1.0)
+        for tier, seconds in self.tiers:
+            if span / seconds * max(devices, 1) <= max_points:
+                return tier
+        return self.tiers[-1][0]
+
+    def query(self, tier, start, end, device_id=None, metrics=None):
+        """Merged buckets of one tier in [start, end] as a dict of column arrays, in time order.
+
+        ``device_id`` is one device id or a list of them (one series per
+        device); None merges every device into one point per bucket, with
+        ``devices`` giving the number of devices that reported in it. Each
+        metric gives ``<metric>_mean/_min/_max/_last``; energy also gives
+        ``energy_delta`` (last minus first reading of the bucket, summed over
+        the devices when they are merged).
+        """
+        store = self.stores[tier]
+        seconds = self.tier_seconds[tier]
+        aligned_start = np.floor(start / seconds) * seconds
+        device_ids = [device_id] if isinstance(device_id, str) else device_id
+        if device_ids is None:
+            data = [store.read(aligned_start, end)]
+        else:
+            data = [store.read(aligned_start, end, device_id=device) for device in device_ids]
+        rows = {name: [value for part in data for value in part[name]] for name in data[0]}
+        # Include the buckets still being filled in this process
+        with self._lock:
+            open_rows = [
+                self._to_row(key[0], partial) for key, partial in self._open.items()
+                if key[1] == tier and (device_ids is None or key[0] in device_ids)
+                and aligned_start <= partial.start <= end
+            ]
+        for row in open_rows:
+            for name in rows:
+                rows[name].append(row.get(name))
+        metrics = metrics or self.metrics
+        merged = self._merge(rows, metrics)
+        if device_ids is None:
+            return _merge_devices(merged, metrics)
+        return {name: values for name, values in merged.items() if not name.endswith(MERGE_COLUMNS)}
+
+    def _merge(self, rows, metrics):
+        """Merge the partials of each (bucket, device), ordered by bucket then device.
+
+        Also returns the ``MERGE_COLUMNS`` of each metric, which
+        ``_merge_devices`` needs to combine devices.
+        """
+        devices = np.array([device or '' for device in rows['device_id']], dtype=object)
+        bucket = np.asarray(rows['timestamp'], dtype=np.float64)
+        if not len(bucket):
+            return {'timestamp': bucket, 'device_id': devices}
+        order = np.lexsort((devices.astype(str), bucket))
+        bucket, devices = bucket[order], devices[order]
+        column = lambda name: np.asarray(rows[name], dtype=np.float64)[order]
+        starts = np.flatnonzero(np.concatenate((
+            [True], (bucket[1:] != bucket[:-1]) | (devices[1:] != devices[:-1])
+        )))
+
+        last_ts = column('last_ts')
+        first_ts = column('first_ts')
+        # Partial holding the oldest energy reading of each merged bucket
+        oldest = _argext_reduceat(np.where(np.isnan(column('energy_first')), np.inf, first_ts), starts, np.minimum)
+
+        result = {'timestamp': bucket[starts], 'device_id': devices[starts]}
+        for metric in metrics:
+            count = column(f'{metric}_count')
+            # Newest partial that has a value for this metric (others keep NaN as last)
+            seen = np.where(np.nan_to_num(count) > 0, last_ts, -np.inf)
+            newest = _argext_reduceat(seen, starts, np.maximum)
+            total_count = np.add.reduceat(np.nan_to_num(count), starts)
+            total = np.add.reduceat(np.nan_to_num(column(f'{metric}_sum')), starts)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[f'{metric}_mean'] = np.where(total_count > 0, total / total_count, np.nan)
+            result[f'{metric}_min'] = np.fmin.reduceat(column(f'{metric}_min'), starts)
+            result[f'{metric}_max'] = np.fmax.reduceat(column(f'{metric}_max'), starts)
+            result[f'{metric}_last'] = column(f'{metric}_last')[newest]
+            result[f'{metric}_count'] = total_count
+            result[f'{metric}_sum'] = total
+            result[f'{metric}_last_ts'] = seen[newest]
+        if 'energy' in metrics:
+            result['energy_delta'] = result['energy_last'] - column('energy_first')[oldest]
+        return result
+
+
+def _argext_reduceat(values, starts, ufunc):
+    """Index of the max/min element of each reduceat group"""
+    extreme = ufunc.reduceat(values, starts)
+    group = np.repeat(np.arange(len(starts)), np.diff(np.concatenate((starts, [len(values)]))))
+    hits = np.flatnonzero(values == extreme[group])
+    chosen = np.full(len(starts), -1)
+    # Fancy assignment keeps the last matching position per group
+    chosen[group[hits]] = hits
+    return np.where(chosen >= 0, chosen, starts)
+
+
+def _merge_devices(merged, metrics):
+    """One point per bucket from per-device merged buckets (sorted by bucket)"""
+    bucket = merged['timestamp']
+    if not len(bucket):
+        return {'timestamp': bucket, 'devices': np.zeros(0, dtype=np.int64)}
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    result = {'timestamp': bucket[starts], 'devices': np.diff(np.append(starts, len(bucket)))}
+    for metric in metrics:
+        total_count = np.add.reduceat(merged[f'{metric}_count'], starts)
+        total = np.add.reduceat(merged[f'{metric}_sum'], starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[f'{metric}_mean'] = np.where(total_count > 0, total / total_count, np.nan)
+        result[f'{metric}_min'] = np.fmin.reduceat(merged[f'{metric}_min'], starts)
+        result[f'{metric}_max'] = np.fmax.reduceat(merged[f'{metric}_max'], starts)
+        newest = _argext_reduceat(merged[f'{metric}_last_ts'], starts, np.maximum)
+        result[f'{metric}_last'] = merged[f'{metric}_last'][newest]
+    if 'energy' in metrics:
+        # Energy is a per-device meter: the fleet used the sum of what each device counted
+        delta = merged['energy_delta']
+        known = np.add.reduceat((~np.isnan(delta)).astype(np.int64), starts)
+        result['energy_delta'] = np.where(known > 0, np.add.reduceat(np.nan_to_num(delta), starts), np.nan)
+    return result
+
+
+def _float(value):
+    try:
+        return float(value) if value not in (None, '') else np.nan
+    except (TypeError, ValueError):
+        return np.nan
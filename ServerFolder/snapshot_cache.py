@@ -0,0 +1,131 @@
+"""Pre-encoded, ETag-tagged snapshots for poll-heavy endpoints.
+
+A snapshot is built and serialized once per ``version`` (e.g. the time of a
+device's last reading plus the weather fetch it was combined with); polls
+in between get the stored bytes. Compressed variants are made on first use
+and kept with the snapshot, and the ETag is a hash of the body, so clients
+that send ``If-None-Match`` get an empty 304 until something changes - in
+any worker process holding the same data.
+
+orjson and brotli are optional: without them the stdlib json encoder is
+used and responses are only gzip-compressed.
+"""
+import gzip
+import hashlib
+import json
+import threading
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # optional: faster encoding, NaN -> null
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: Content-Encoding br
+    brotli = None
+
+MIN_COMPRESS_BYTES = 512  # smaller bodies are sent as they are
+
+
+def encode_json(data):
+    """Compact JSON bytes (orjson when installed)"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def accepted_encodings(header):
+    """Codings the client accepts (q > 0), from an Accept-Encoding header"""
+    accepted = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class Snapshot:
+    """One encoded body with its ETag and lazily compressed variants"""
+    __slots__ = ('version', 'body', 'etag', 'mimetype', 'variants', '_lock')
+
+    def __init__(self, version, body, mimetype):
+        self.version = version
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self.mimetype = mimetype
+        self.variants = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        variant = self.variants.get(encoding)
+        if variant is None:
+            with self._lock:
+                variant = self.variants.get(encoding)
+                if variant is None:
+                    variant = self.variants[encoding] = _compress(self.body, encoding)
+        return variant
+
+    def negotiate(self, if_none_match, accept_encoding):
+        """(status, body, headers) for a request's If-None-Match / Accept-Encoding headers"""
+        headers = {'ETag': self.etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if if_none_match:
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            if self.etag in tags or '*' in tags:
+                return 304, b'', headers
+        body = self.body
+        if len(body) >= MIN_COMPRESS_BYTES:
+            accepted = accepted_encodings(accept_encoding)
+            encoding = 'br' if brotli is not None and 'br' in accepted else 'gzip' if 'gzip' in accepted else None
+            if encoding:
+                body = self.encoded(encoding)
+                headers['Content-Encoding'] = encoding
+        return 200, body, headers
+
+    def response(self, request):
+        """200 with the (negotiated) body, or 304 when the client's copy is current"""
+        status, body, headers = self.negotiate(request.headers.get('If-None-Match', ''),
+                                               request.headers.get('Accept-Encoding'))
+        if status == 304:
+            return Response(status=304, headers=headers)
+        return Response(body, mimetype=self.mimetype, headers=headers)
+
+
+class SnapshotCache:
+    """Latest snapshot per key, rebuilt only when its version changes"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'builds': 0}
+
+    def get(self, key, version, build, encode=encode_json, mimetype='application/json'):
+        """Snapshot of key at version; build() -> data is called only on a new version"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version:
+            with self._lock:
+                self._counters['hits'] += 1
+            return entry
+        entry = Snapshot(version, encode(build()), mimetype)
+        with self._lock:
+            self._counters['builds'] += 1
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = entry
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, 'entries': len(self._entries)}
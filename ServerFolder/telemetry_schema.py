@@ -0,0 +1,315 @@
+"""Telemetry field schema shared by app.py and python_script.py.
+
+Every firmware variant names the fields its own way (box_temp / BoxTemperature,
+solar_voltage / SolarVoltage / solarVoltage, ...). The alias lists of all of
+them are compiled once into one dict mapping each key to its slot in a typed
+``Reading``, its rank among the field's aliases and its coercion function.
+A JSON document is then parsed in a single pass over the keys it contains:
+unknown keys (Ssid, Password, Server, ...) are skipped, values are coerced
+to float / epoch seconds / text, and when a document carries several
+aliases of one field the first alias in the list wins. Since a firmware
+posts the same keys every time, a parser is also compiled per key set
+(itemgetters + map(float)); batches from one firmware are converted column
+by column in NumPy.
+
+Zero is a reading: a value is missing only when the key is absent or the
+value is null, empty or NaN. Values that cannot be coerced are left
+missing and reported back by key.
+
+``python bench_telemetry_schema.py`` benchmarks the parser against the old
+per-field ``data.get(a) or data.get(b)`` lookups.
+"""
+import math
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from operator import itemgetter
+
+import numpy as np
+
+FLOAT, TIMESTAMP, TEXT = 'float', 'timestamp', 'text'
+
+# (field, type, aliases in order of preference) - metrics first, in storage column order
+FIELDS = (
+    ('box_temp', FLOAT, ('box_temp', 'BoxTemperature')),
+    ('frequency', FLOAT, ('frequency', 'Frequency')),
+    ('power_factor', FLOAT, ('power_factor', 'PowerFactor')),
+    ('voltage', FLOAT, ('voltage', 'Voltage')),
+    ('current', FLOAT, ('current', 'Current')),
+    ('power', FLOAT, ('power', 'Power')),
+    ('energy', FLOAT, ('energy', 'Energy')),
+    ('solar_voltage', FLOAT, ('solar_voltage', 'SolarVoltage', 'solarVoltage')),
+    ('solar_current', FLOAT, ('solar_current', 'solarCurrent', 'SolarCurrent')),
+    ('solar_power', FLOAT, ('solar_power', 'solarPower', 'SolarPower')),
+    ('battery_percentage', FLOAT, ('battery_percentage', 'batteryPercentage', 'BatteryPercentage')),
+    ('light_intensity', FLOAT, ('light_intensity', 'lightIntensity', 'LightIntensity')),
+    ('battery_voltage', FLOAT, ('battery_voltage', 'batteryVoltage', 'BatteryVoltage')),
+    ('inverter_load', FLOAT, ('inverter_load', 'InverterLoad')),
+    ('latitude', FLOAT, ('latitude', 'lat')),
+    ('longitude', FLOAT, ('longitude', 'lon')),
+    ('timestamp', TIMESTAMP, ('timestamp', 'ts')),
+    ('device_id', TEXT, ('device_id', 'deviceId')),
+    ('device_ip', TEXT, ('deviceIP',)),
+    ('thingsboard_token', TEXT, ('THINGSBOARD_TOKEN',)),
+    ('room_esp', TEXT, ('RoomEsp',)),
+)
+FIELD_NAMES = tuple(name for name, _, _ in FIELDS)
+METRIC_FIELDS = FIELD_NAMES[:13]  # what the ESP32 measures (same names as the storage columns)
+
+
+def to_float(value):
+    """Number or numeric string -> float; None when missing. Raises ValueError if not a number"""
+    if value.__class__ is float:
+        if value - value == 0:
+            return value
+        if value != value:
+            return None
+        raise ValueError("infinite value")
+    if value.__class__ is int:
+        return float(value)
+    if value is None or value == '':
+        return None
+    value = float(value)  # bools count as 1 / 0
+    if math.isinf(value):
+        raise ValueError("infinite value")
+    return value if value == value else None
+
+
+def to_text(value):
+    """String, or number as a string; None when missing. Raises ValueError for objects / arrays"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (dict, list)):
+        raise ValueError(f"not a string: {value!r}")
+    return value if value.__class__ is str else str(value)
+
+
+def parse_reading_timestamp(value):
+    """Epoch seconds/milliseconds or ISO string -> epoch seconds (None if absent)"""
+    if value in (None, ''):
+        return None
+    try:
+        ts = float(value)
+        return ts / 1000.0 if ts > 1e12 else ts
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+
+
+COERCE = {FLOAT: to_float, TIMESTAMP: parse_reading_timestamp, TEXT: to_text}
+
+
+def compile_aliases(fields):
+    """{key: (slot, rank, coerce)} for every alias of every field"""
+    compiled = {}
+    for slot, (name, kind, aliases) in enumerate(fields):
+        for rank, alias in enumerate(aliases):
+            if alias in compiled:
+                raise ValueError(f"alias {alias!r} of {name} already belongs to {fields[compiled[alias][0]][0]}")
+            compiled[alias] = (slot, rank, COERCE[kind])
+    return compiled
+
+
+KEYS = compile_aliases(FIELDS)
+_UNSET = len(max((aliases for _, _, aliases in FIELDS), key=len))  # rank above every alias
+
+
+class Reading(namedtuple('Reading', FIELD_NAMES)):
+    """One typed reading: float metrics, epoch-seconds timestamp, text ids (None: missing)"""
+    __slots__ = ()
+
+    def metrics(self):
+        return dict(zip(METRIC_FIELDS, self))
+
+    def device_key(self, default):
+        """Device id, else IP, else ThingsBoard token"""
+        return self.device_id or self.device_ip or self.thingsboard_token or default
+
+
+def parse_reading(data):
+    """(Reading, invalid keys) from one JSON document, in one pass over its keys"""
+    plan = _plan(data)
+    if plan is not None:
+        reading = plan.parse(data)
+        if reading is not None:
+            return reading, []
+    return _parse_keys(data)
+
+
+def _parse_keys(data):
+    """General path: coerce key by key (any value types, several aliases of one field)"""
+    values = [None] * len(FIELDS)
+    ranks = [_UNSET] * len(FIELDS)
+    invalid = []
+    for key, raw in data.items():
+        target = KEYS.get(key)
+        if target is None:
+            continue
+        slot, rank, coerce = target
+        if rank > ranks[slot]:
+            continue  # a preferred alias already gave a value
+        try:
+            value = coerce(raw)
+        except (TypeError, ValueError, OverflowError):
+            invalid.append(key)
+            continue
+        if value is not None:
+            values[slot] = value
+            ranks[slot] = rank
+    return Reading._make(values), invalid
+
+
+class _Plan:
+    """Parser compiled for one set of keys (a firmware sends the same keys every time).
+
+    ``parse`` fetches the values with itemgetters and converts them with
+    map(float); it returns None for a document whose values are not all plain
+    numbers / numeric strings / non-empty text, which then takes the general
+    path (same result, slower).
+    """
+    __slots__ = ('slots', 'parse')
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.parse = _compile_plan(slots)
+
+
+def _compile_plan(slots):
+    by_kind = {FLOAT: [], TEXT: [], TIMESTAMP: []}
+    for key, slot in slots:
+        by_kind[FIELDS[slot][1]].append((key, slot))
+    ordered = by_kind[FLOAT] + by_kind[TEXT] + by_kind[TIMESTAMP]
+    # Position of each slot in floats + texts + [timestamp] + [None]
+    position = {slot: i for i, (_, slot) in enumerate(ordered)}
+    arrange = itemgetter(*[position.get(slot, len(ordered)) for slot in range(len(FIELDS))])
+    # One extra key makes every itemgetter return a tuple
+    floats = itemgetter(*[key for key, _ in by_kind[FLOAT]], ordered[0][0]) if by_kind[FLOAT] else None
+    texts = itemgetter(*[key for key, _ in by_kind[TEXT]], ordered[0][0]) if by_kind[TEXT] else None
+    timestamp = by_kind[TIMESTAMP][0][0] if by_kind[TIMESTAMP] else None
+    isfinite, new = math.isfinite, tuple.__new__
+
+    def parse(data):
+        values = []
+        if floats is not None:
+            try:
+                values = [*map(float, floats(data)[:-1])]  # TypeError / ValueError: not all numbers
+            except (TypeError, ValueError, OverflowError):
+                return None
+            if not isfinite(sum(values)):
+                return None  # NaN / infinity somewhere (or a sum that overflows)
+        if texts is not None:
+            strings = texts(data)[:-1]
+            try:
+                ''.join(strings)  # TypeError: not all strings
+            except TypeError:
+                return None
+            if not all(strings):
+                return None
+            values += strings
+        if timestamp is not None:
+            try:
+                values.append(parse_reading_timestamp(data[timestamp]))
+            except (TypeError, ValueError, OverflowError):
+                return None
+        values.append(None)
+        return new(Reading, arrange(values))
+
+    return parse
+
+
+_plans = OrderedDict()  # key set -> compiled plan (None: general path), least recently used first
+_plans_lock = threading.Lock()
+MAX_PLANS = 256  # distinct key sets remembered; the least recently used one is dropped beyond that
+
+
+def _plan(data):
+    signature = tuple(data)
+    with _plans_lock:
+        plan = _plans.get(signature, False)
+        if plan is not False:
+            _plans.move_to_end(signature)
+            return plan
+    slots = [(key, KEYS[key][0]) for key in signature if key in KEYS]
+    distinct = len({slot for _, slot in slots}) == len(slots)
+    plan = _Plan(slots) if slots and distinct else None
+    with _plans_lock:
+        _plans[signature] = plan
+        while len(_plans) > MAX_PLANS:
+            _plans.popitem(last=False)
+    return plan
+
+
+def parse_batch(readings):
+    """Columns of many JSON readings - float64 arrays (NaN: missing) for numbers and
+    timestamps, lists for text - with the same values parse_reading gives per reading.
+
+    Readings that all carry the same keys (one firmware) are converted column by
+    column in NumPy; mixed batches are parsed reading by reading.
+    """
+    if not readings:
+        return _columns_of([])
+    first = readings[0].keys()
+    if all(map(first.__eq__, map(dict.keys, readings))):
+        plan = _plan(readings[0])
+        if plan is not None:
+            columns = _batch_columns(readings, plan)
+            if columns is not None:
+                return columns
+    return _columns_of([parse_reading(reading)[0] for reading in readings])
+
+
+def _batch_columns(readings, plan):
+    columns = _columns_of([], len(readings))
+    numeric = [(key, slot) for key, slot in plan.slots if FIELDS[slot][1] != TEXT]
+    if numeric:
+        try:
+            # One conversion for all numeric fields; null becomes NaN (missing) as in parse_reading
+            matrix = np.array(list(map(itemgetter(*[key for key, _ in numeric], numeric[0][0]), readings)),
+                              dtype=np.float64)
+        except (TypeError, ValueError, OverflowError):
+            return None
+        if matrix.shape != (len(readings), len(numeric) + 1):
+            return None  # lists among the values
+        if np.isinf(matrix).any():
+            return None  # reported per reading by the general path
+        matrix = matrix[:, :-1].T.copy()
+        for row, (_, slot) in enumerate(numeric):
+            name, kind, _ = FIELDS[slot]
+            column = matrix[row]
+            columns[name] = np.where(column > 1e12, column / 1000.0, column) if kind == TIMESTAMP else column
+    for key, slot in plan.slots:
+        if FIELDS[slot][1] != TEXT:
+            continue
+        values = list(map(itemgetter(key), readings))
+        try:
+            ''.join(values)  # TypeError: not all strings
+        except TypeError:
+            return None
+        if not all(values):
+            return None
+        columns[FIELDS[slot][0]] = values
+    return columns
+
+
+def _columns_of(parsed, count=None):
+    """Columns of parsed Readings (all missing when only a count is given)"""
+    count = len(parsed) if count is None else count
+    matrix = None
+    if parsed:
+        numeric = [slot for slot, (_, kind, _) in enumerate(FIELDS) if kind != TEXT]
+        getter = itemgetter(*numeric)
+        matrix = np.array([getter(reading) for reading in parsed], dtype=np.float64).T.copy()
+    columns = {}
+    row = 0
+    for slot, (name, kind, _) in enumerate(FIELDS):
+        if kind == TEXT:
+            columns[name] = [reading[slot] for reading in parsed] if parsed else [None] * count
+        else:
+            columns[name] = matrix[row] if parsed else np.full(count, np.nan)
+            row += 1
+    return columns
+
+
+def metric_columns(columns):
+    """The ESP32 metrics of parse_batch columns"""
+    return {name: columns[name] for name in METRIC_FIELDS}
+
@@ -0,0 +1,70 @@
+"""The server modules import each other by top-level name (as gunicorn runs them)"""
+import os
+import sys
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+OPEN_METEO = {
+    'current': {'temperature_2m': 31.0, 'relative_humidity_2m': 40, 'cloud_cover': 10, 'wind_speed_10m': 3.5,
+                'precipitation': 0.0, 'weather_code': 1, 'apparent_temperature': 33.0},
+    'hourly': {'time': [], 'temperature_2m': [], 'relative_humidity_2m': [], 'precipitation': [], 'rain': [],
+               'weather_code': [], 'cloud_cover': [], 'wind_speed_10m': []},
+}
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, payload=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise OSError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self._payload
+
+
+class FakeSession:
+    """Records POSTs instead of sending them; ``fail`` holds payload predicates that get a 500"""
+
+    def __init__(self):
+        self.posts = []
+        self.fail = []
+
+    def post(self, url, json=None, timeout=None):
+        if any(predicate(json) for predicate in self.fail):
+            return FakeResponse(500)
+        self.posts.append((url, json))
+        return FakeResponse()
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """ServerFolder/app.py with storage in a temporary directory and no outbound network"""
+    root = tmp_path_factory.mktemp('server')
+    os.environ.update(STORAGE_DIR=str(root / 'solar_data'), MODEL_DIR=str(root / 'models'),
+                      WEATHER_CACHE_DB='', TELEGRAM_BOT_TOKEN='', TELEGRAM_CHAT_ID='')
+    import app
+    app.CSV_FILE_PATH = str(root / 'solar_data.csv')
+    app.fetch_open_meteo = lambda key: app.shape_open_meteo(OPEN_METEO, *app.open_meteo_params(key)[:2])
+    app.app_session = FakeSession()
+    app.app.testing = True
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture(scope='session')
+def script_module():
+    """The root python_script.py app (it imports the server modules as ServerFolder.*)"""
+    sys.path.insert(0, os.path.dirname(SERVER_DIR))
+    import python_script
+    python_script.app.testing = True
+    return python_script
@@ -0,0 +1,80 @@
+import time
+
+from alert_dispatcher import TelegramDispatcher
+from conftest import FakeSession
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def dispatcher(**kwargs):
+    telegram = TelegramDispatcher('token', 'chat', **kwargs)
+    telegram.session = FakeSession()
+    return telegram
+
+
+def texts(telegram):
+    return [body['text'] for _, body in telegram.session.posts]
+
+
+def test_cooldown_per_device_and_type():
+    telegram = dispatcher(cooldown=60, digest_window=0)
+    assert telegram.enqueue("Overload!", "load alert", "esp-a") == {"status": "queued"}
+    assert telegram.enqueue("Overload!", "load alert", "esp-a")['status'] == 'skipped'
+    assert telegram.enqueue("Overload!", "load alert", "esp-b")['status'] == 'queued'
+    assert telegram.enqueue("Discharge!", "battery", "esp-a")['status'] == 'queued'
+    wait_until(lambda: telegram.queue.stats()['sent'] == 3)
+    assert telegram.stats()['suppressed_pending'] == 1
+    telegram.queue.stop()
+
+
+def test_repeats_are_reported_after_the_cooldown():
+    telegram = dispatcher(cooldown=0.2, digest_window=0)
+    telegram.enqueue("Overload!", "load alert", "esp-a")
+    wait_until(lambda: len(telegram.session.posts) == 1)
+    telegram.enqueue("Overload!", "load alert", "esp-a")
+    telegram.enqueue("Overload!", "load alert", "esp-a")
+    time.sleep(0.25)
+    telegram.enqueue("Overload!", "load alert", "esp-a")
+    wait_until(lambda: len(telegram.session.posts) == 2)
+    assert "(repeated 2× during cooldown)" in texts(telegram)[1]
+    telegram.queue.stop()
+
+
+def test_alerts_close_together_share_one_digest():
+    telegram = dispatcher(cooldown=60, digest_window=0.3)
+    for device_id in ('esp-a', 'esp-b', 'esp-c'):
+        telegram.enqueue("Discharge!", "battery", device_id)
+    wait_until(lambda: telegram.queue.stats()['sent'] == 3)
+    assert len(telegram.session.posts) == 1
+    assert "Solar Monitor Alerts (3)" in texts(telegram)[0]
+    assert all(f"[{device_id}] Discharge!" in texts(telegram)[0] for device_id in ('esp-a', 'esp-b', 'esp-c'))
+    telegram.queue.stop()
+
+
+def test_failed_delivery_reopens_the_cooldown():
+    telegram = dispatcher(cooldown=60, digest_window=0)
+    telegram.session.fail.append(lambda body: True)
+    telegram.queue.backoff_base = 0.01
+    telegram.enqueue("Overload!", "load alert", "esp-a")
+    wait_until(lambda: telegram.queue.stats()['failed'] == 1)
+    telegram.session.fail.clear()
+    assert telegram.enqueue("Overload!", "load alert", "esp-a")['status'] == 'queued'
+    telegram.queue.stop()
+
+
+def test_text_is_html_escaped():
+    items = [(('<esp & co>', 'load alert', 'x'), ("Load > 5 <b>kW</b>", 0, time.time()))]
+    text = TelegramDispatcher.format_messages(items)
+    assert "[&lt;esp &amp; co&gt;] Load &gt; 5 &lt;b&gt;kW&lt;/b&gt;" in text
+    assert text.startswith("🚨 <b>Solar Monitor Alert</b>")
+
+
+def test_not_configured():
+    telegram = TelegramDispatcher('', '')
+    assert 'error' in telegram.enqueue("Overload!")
+    assert 'error' in telegram.send_now("Overload!")
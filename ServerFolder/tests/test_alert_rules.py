@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+from alert_rules import APP_RULES
+
+COLUMNS = ('battery_percentage', 'current_battery', 'light_intensity', 'solar_voltage', 'solar_current',
+           'voltage', 'current', 'light_slope', 'battery_slope', 'predicted_energy')
+
+
+def legacy_alerts(reading, params, relay):
+    """check_alerts() + predictionalerts() of the original app.py, on one reading (None: missing)"""
+    alerts = dict.fromkeys(APP_RULES.slots)
+    battery = reading['battery_percentage']
+    current_battery = reading['current_battery']
+    light = reading['light_intensity']
+    solar_voltage, solar_current = reading['solar_voltage'], reading['solar_current']
+
+    if light is not None and solar_voltage is not None and solar_current is not None:
+        if current_battery == 100:
+            alerts['alert1'] = "Overcharge!"
+            relay = 1
+        if current_battery < 10:
+            alerts['alert1'] = "Discharge!"
+            relay = 0
+
+        irradiance = light / 120
+        solar_power = solar_voltage * solar_current / 1000
+        for low, high, p_min, p_max in ((900, 1200, 0.31, 0.37), (600, 900, 0.22, 0.30),
+                                        (350, 600, 0.14, 0.22), (150, 350, 0.05, 0.14)):
+            if low <= irradiance < high and not (p_min <= solar_power <= p_max):
+                alerts['alert2'] = "solar panel low efficiency!"
+                relay = 0
+        if irradiance < 100 and not (0.0 <= solar_power <= 0.05):
+            alerts['alert2'] = "solar panel low efficiency!"
+            relay = 0
+
+        if reading['voltage'] is not None and reading['current'] is not None:
+            if reading['voltage'] * reading['current'] / 1000 > params['inverter_rating']:
+                alerts['alert3'] = "Overload!"
+                relay = 0
+
+        if reading['light_slope'] is not None and reading['light_slope'] < params['threshold_slope']:
+            alerts['alert4'] = "Sudden drop in sun light!"
+            relay = 0
+
+        if solar_power != 0 and reading['battery_slope'] is not None:
+            if reading['battery_slope'] < params['threshold_battery_slope']:
+                alerts['alert5'] = "Battery not charging!"
+                relay = 0
+
+    predicted = reading['predicted_energy']
+    if predicted is not None:
+        if params['averageenergyconsume'] > predicted:
+            alerts['alert6'] = "consumption is higher than expected solar generation!"
+            if battery is not None and battery < 40:
+                alerts['alert7'] = "Battery is low. Risk of blackout in future!"
+                relay = 0
+        if params['averageenergyconsume'] < predicted:
+            if battery is not None and 40 < battery < 80:
+                relay = 1
+            if battery is not None and battery > 80:
+                alerts['alert8'] = "Battery may overcharge in next upcoming hours!"
+                relay = 1
+    return alerts, relay
+
+
+def random_readings(rng, n):
+    candidates = {
+        'battery_percentage': [0, 5, 10, 39, 40, 41, 60, 80, 81, 100],
+        'light_intensity': rng.uniform(0, 150000, 50).round(),
+        'solar_voltage': [0, 5, 12, 18.5, 21],
+        'solar_current': [0, 2.5, 10, 17.6, 20],
+        'voltage': [0, 230, 240],
+        'current': [0, 5, 2200, 2500],
+        'light_slope': [-5, -1.5, -1, -0.5, 0, 2],
+        'battery_slope': [-0.1, -0.05, -0.01, 0, 0.2],
+        'predicted_energy': [0, 1.2, 2.5, 3.9],
+    }
+    readings = []
+    for _ in range(n):
+        reading = {name: None if rng.random() < 0.1 else float(rng.choice(values))
+                   for name, values in candidates.items()}
+        battery = reading['battery_percentage']
+        reading['current_battery'] = 0 if battery is None else battery
+        readings.append(reading)
+    return readings
+
+
+@pytest.mark.parametrize('initial_relay', [0, 1])
+def test_app_rules_match_legacy_if_chains(initial_relay):
+    rng = np.random.default_rng(3)
+    readings = random_readings(rng, 1500)
+    params = APP_RULES.params
+
+    columns = {name: np.array([np.nan if r[name] is None else r[name] for r in readings]) for name in COLUMNS}
+    alerts, relay = APP_RULES.evaluate(columns, initial_relay=initial_relay)
+
+    state = initial_relay
+    for i, reading in enumerate(readings):
+        expected, state = legacy_alerts(reading, params, state)
+        assert {slot: alerts[slot][i] for slot in APP_RULES.slots} == expected, reading
+        assert relay[i] == state, reading
+
+        # A single reading starts from the given relay state
+        assert APP_RULES.evaluate_one(reading, initial_relay=initial_relay) == \
+            legacy_alerts(reading, params, initial_relay)
+
+
+def test_params_override_defaults():
+    reading = {name: np.nan for name in COLUMNS}
+    reading.update(light_intensity=0, solar_voltage=0, solar_current=0, current_battery=50,
+                   voltage=230, current=1000)
+    alerts, _ = APP_RULES.evaluate_one(reading)
+    assert alerts['alert3'] is None
+    alerts, relay = APP_RULES.evaluate_one(reading, params={'inverter_rating': 200}, initial_relay=1)
+    assert alerts['alert3'] == "Overload!" and relay == 0
@@ -0,0 +1,122 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from binary_protocol import encode_frame
+from conftest import OPEN_METEO
+
+pytest.importorskip('aiohttp')
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+
+START = 1737000000.0
+
+
+@pytest.fixture
+def async_app(app_module, monkeypatch):
+    """async_app.py with the weather served from OPEN_METEO and a fresh I/O pool (cleanup shuts it down)"""
+    import async_app
+
+    async def fetch(key):
+        return app_module.shape_open_meteo(OPEN_METEO, *app_module.open_meteo_params(key)[:2])
+    monkeypatch.setattr(async_app, 'fetch_open_meteo_async', fetch)
+    monkeypatch.setattr(async_app, 'io_pool', ThreadPoolExecutor(2))
+    return async_app
+
+
+def run(async_app, scenario):
+    async def main():
+        async with TestClient(TestServer(async_app.create_app())) as client:
+            return await scenario(client)
+    return asyncio.run(main())
+
+
+def test_json_reading_updates_the_shared_state(app_module, async_app):
+    async def scenario(client):
+        response = await client.post('/esp32-data', json={'device_id': 'async-a', 'power': 321})
+        assert response.status == 200
+        assert response.headers['Access-Control-Allow-Origin'] == '*'
+        empty = await client.post('/esp32-data', data=b'', headers={'Content-Type': 'application/json'})
+        assert empty.status == 400
+    run(async_app, scenario)
+    assert app_module.state_store.get('async-a').power == 321.0
+
+
+def test_binary_frame_is_ingested(app_module, async_app):
+    frame = encode_frame([{'timestamp': START + i * 15, 'power': float(i)} for i in range(3)], 'async-bin')
+
+    async def scenario(client):
+        response = await client.post('/esp32-data/bin', data=frame)
+        assert response.status == 200
+        assert (await response.json())['devices'] == {'async-bin': 3}
+        assert (await client.post('/esp32-data/bin', data=b'garbage')).status == 400
+    run(async_app, scenario)
+    assert app_module.state_store.get('async-bin').power == 2.0
+
+
+def test_dashboard_revalidates_with_the_flask_etag(app_module, async_app, client):
+    client.post('/esp32-data', json={'device_id': 'async-etag', 'power': 5})
+    etag = client.get('/api/dashboard-data?device=async-etag').headers['ETag']
+
+    async def scenario(client):
+        cached = await client.get('/api/dashboard-data?device=async-etag', headers={'If-None-Match': etag})
+        assert cached.status == 304
+        fresh = await client.get('/api/dashboard-data?device=async-etag', headers={'Accept-Encoding': 'gzip'})
+        assert fresh.headers['ETag'] == etag
+        assert (await fresh.json())['esp32_data']['device_id'] == 'async-etag'
+    run(async_app, scenario)
+
+
+def test_csv_data_pages_match_the_flask_route(app_module, async_app, client):
+    rows = [{'timestamp': START + i * 15, 'device_id': 'async-hist', 'power': float(i)} for i in range(30)]
+    app_module.ts_store.append_many(rows)
+    app_module.ts_store.flush()
+    query = f'device=async-hist&start={START}&end={START + 600}&limit=10'
+    flask_page = client.get(f'/api/csv-data?{query}').get_json()
+    flask_page.pop('last_updated')
+    flask_csv = client.get(f'/api/csv-data?{query}&format=csv').data
+
+    async def scenario(client):
+        page = await (await client.get(f'/api/csv-data?{query}')).json()
+        page.pop('last_updated')
+        assert page == flask_page
+        download = await client.get(f'/api/csv-data?{query}&format=csv', headers={'Accept-Encoding': 'identity'})
+        assert await download.read() == flask_csv
+        assert (await client.get(f'/api/csv-data?{query}&cursor=nope')).status == 400
+        assert (await client.get(f'/api/csv-data?{query}&format=xml')).status == 400
+    run(async_app, scenario)
+    assert len(flask_page['data']) == 10 and flask_page['next_cursor']
+
+
+def test_concurrent_weather_misses_fetch_once(app_module, async_app, monkeypatch):
+    from weather_cache import WeatherCache
+
+    fetches = []
+    original = async_app.fetch_open_meteo_async
+
+    async def slow_fetch(key):
+        fetches.append(key)
+        await asyncio.sleep(0.05)
+        return await original(key)
+    monkeypatch.setattr(async_app, 'fetch_open_meteo_async', slow_fetch)
+    monkeypatch.setattr(app_module, 'weather_cache', WeatherCache(lambda key: None))
+    monkeypatch.setattr(async_app, 'weather_locks', {})
+
+    async def scenario(client):
+        responses = await asyncio.gather(*[client.get('/weather') for _ in range(5)])
+        bodies = [await response.json() for response in responses]
+        assert all(body == bodies[0] and 'error' not in body for body in bodies)
+    run(async_app, scenario)
+    assert len(fetches) == 1
+
+
+def test_preflight_and_unconfigured_alert(async_app):
+    async def scenario(client):
+        preflight = await client.options('/alert', headers={'Access-Control-Request-Headers': 'content-type'})
+        assert preflight.status == 200
+        assert preflight.headers['Access-Control-Allow-Headers'] == 'content-type'
+        alert = await client.post('/alert', json={'message': 'hello'})
+        assert alert.status == 500
+        assert 'not configured' in (await alert.json())['error']
+        assert (await client.post('/alert', json={})).status == 400
+    run(async_app, scenario)
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pandas')
+pytest.importorskip('lightgbm')
+pytest.importorskip('sklearn')
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+STEP = 900
+DAY = 86400
+
+
+@pytest.fixture
+def backtest(monkeypatch):
+    monkeypatch.syspath_prepend(ROOT_DIR)
+    import backtest
+    monkeypatch.setattr(backtest, 'BACKTEST_FOLDS', 5)
+    monkeypatch.setattr(backtest, 'BACKTEST_FOLD_RATIO', 0.05)
+    monkeypatch.setattr(backtest, 'BACKTEST_MAX_TRAIN_ROWS', 0)
+    return backtest
+
+
+def test_test_blocks_tile_the_end_of_the_rows(backtest):
+    ts = np.arange(2000) * float(STEP)
+    folds = backtest.plan_folds(ts, STEP)
+    assert [fold['fold'] for fold in folds] == [0, 1, 2, 3, 4]
+    assert [fold['test'] for fold in folds] == [(1500, 1600), (1600, 1700), (1700, 1800), (1800, 1900), (1900, 2000)]
+
+
+def test_training_targets_end_before_the_origin(backtest):
+    ts = np.arange(2000) * float(STEP)
+    ts[1000:] += 7 * DAY  # a week without rows
+    for fold in backtest.plan_folds(ts, STEP):
+        train_start, val_start = fold['train']
+        assert val_start == fold['val'][0]
+        train_end = fold['val'][1]
+        origin = ts[fold['test'][0]]
+        # Every training row's +1d target is known at the origin, and no later row is left out
+        assert ts[train_end - 1] + DAY <= origin < ts[train_end] + DAY
+        assert train_start == 0
+        assert val_start == train_end - int(train_end * backtest.VAL_RATIO)
+
+
+def test_sliding_window_keeps_the_latest_training_rows(backtest, monkeypatch):
+    monkeypatch.setattr(backtest, 'BACKTEST_MAX_TRAIN_ROWS', 500)
+    ts = np.arange(2000) * float(STEP)
+    for fold in backtest.plan_folds(ts, STEP):
+        train_start, train_end = fold['train'][0], fold['val'][1]
+        assert train_end - train_start == 500
+        assert fold['val'] == (train_end - 75, train_end)
+
+
+def test_folds_without_enough_history_are_skipped(backtest):
+    ts = np.arange(400) * float(STEP)
+    folds = backtest.plan_folds(ts, STEP)
+    # 20-row test blocks from row 300; a one-day (96-row) purge leaves < 200 rows to fit before 340
+    assert [fold['fold'] for fold in folds] == [2, 3, 4]
+    assert all(fold['val'][0] - fold['train'][0] >= backtest.MIN_TRAIN_ROWS for fold in folds)
+
+
+def test_summary_averages_folds_per_series_and_horizon(backtest):
+    def record(fold, horizon, mae):
+        return {'series': 'default', 'fold': fold, 'horizon': horizon, 'train_seconds': 1.0,
+                'latency_ms_p50': 0.1 * (fold + 1), 'peak_rss_mb': 100.0 + fold,
+                'metrics': {'MAE': mae, 'RMSE': 2 * mae, 'R2': 0.5}}
+    summary = backtest.summarize([record(0, '1d', 1.0), record(0, '1h', 2.0), record(1, '1h', 4.0)])
+    assert list(summary) == ['default +1h', 'default +1d']
+    hour = summary['default +1h']
+    assert (hour['folds'], hour['MAE_mean'], hour['MAE_std'], hour['RMSE_mean']) == (2, 3.0, 1.0, 6.0)
+    assert (hour['train_seconds_total'], hour['peak_rss_mb_max']) == (2.0, 101.0)
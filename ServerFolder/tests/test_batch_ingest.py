@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+
+
+def post_batch(client, body, content_type='application/json'):
+    data = body if isinstance(body, str) else json.dumps(body)
+    return client.post('/esp32-data/batch', data=data, content_type=content_type)
+
+
+def test_json_batch_updates_each_device(app_module, client):
+    readings = [
+        {'device_id': 'batch-a', 'timestamp': 1735689600 + i * 15, 'Power': i, 'batteryPercentage': 50 + i}
+        for i in range(4)
+    ] + [{'device_id': 'batch-b', 'timestamp': 1735689600, 'Power': 0, 'batteryPercentage': 90}]
+    response = post_batch(client, readings)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['received'] == 5 and body['devices'] == {'batch-a': 4, 'batch-b': 1}
+    assert [decision['device_id'] for decision in body['decisions']] == ['batch-a'] * 4 + ['batch-b']
+
+    # Device state ends as if the last reading had been posted alone
+    assert app_module.state_store.get('batch-a').power == 3.0
+    assert app_module.state_store.get('batch-a').battery_percentage == 53.0
+    assert app_module.state_store.get('batch-b').power == 0.0
+
+    app_module.ts_store.flush()
+    stored = app_module.ts_store.read(1735689600, 1735689600 + 60, ['power'], device_id='batch-a')
+    assert stored['power'].tolist() == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_batch_device_id_applies_to_every_reading(app_module, client):
+    body = {'device_id': 'batch-c', 'readings': [{'Power': 1}, {'Power': 2}]}
+    assert post_batch(client, body).get_json()['devices'] == {'batch-c': 2}
+
+
+def test_unsorted_readings_are_applied_in_time_order(app_module, client):
+    readings = [{'device_id': 'batch-d', 'timestamp': 1735690000 - i, 'Power': i} for i in range(3)]
+    post_batch(client, readings)
+    assert app_module.state_store.get('batch-d').power == 0.0  # the newest reading
+
+
+def test_ndjson_and_compact_lines(app_module, client):
+    ndjson = '\n'.join(json.dumps({'device_id': 'batch-e', 'Power': p}) for p in (1, 2))
+    assert post_batch(client, ndjson, 'application/x-ndjson').get_json()['devices'] == {'batch-e': 2}
+
+    compact = 'device_id,timestamp,power,energy\nbatch-f,1735689600,5,0.5\nbatch-f,1735689615,6,\n'
+    response = post_batch(client, compact, 'text/plain')
+    assert response.get_json()['devices'] == {'batch-f': 2}
+    assert app_module.state_store.get('batch-f').power == 6.0
+    assert app_module.state_store.get('batch-f').energy is None
+
+
+def test_invalid_batches(app_module, client):
+    assert post_batch(client, []).status_code == 400
+    assert post_batch(client, {'readings': [1, 2]}).status_code == 400
+    assert post_batch(client, '"text"').status_code == 400
+    too_many = [{'Power': 1}] * (app_module.MAX_BATCH_READINGS + 1)
+    assert post_batch(client, too_many).status_code == 413
+
+
+def test_batch_matches_single_posts(app_module, client):
+    readings = [{'timestamp': 1735700000 + i * 15, 'Power': float(i), 'lightIntensity': 60000.0 - 2000 * i,
+                 'solarVoltage': 12.0, 'solarCurrent': 10.0, 'batteryPercentage': 60.0 - i} for i in range(6)]
+    for reading in readings:
+        client.post('/esp32-data', json=dict(reading, device_id='single-g'))
+    post_batch(client, [dict(reading, device_id='batch-g') for reading in readings])
+
+    single, batched = app_module.state_store.get('single-g'), app_module.state_store.get('batch-g')
+    assert single.esp32_dict() == batched.esp32_dict()
+    assert single.alerts_dict() == batched.alerts_dict()
+    assert np.isclose(single.current_battery_percent, batched.current_battery_percent)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from binary_protocol import HEADER, RECORD_DTYPES, VERSION_FIELDS, decode_frame, encode_frame
+
+FIELDS = VERSION_FIELDS[1]
+
+
+def test_round_trip():
+    rng = np.random.default_rng(2)
+    readings = []
+    for i in range(500):
+        reading = {name: round(float(rng.uniform(-2000, 2000)), 3) for name in FIELDS}
+        reading['timestamp'] = 1735689600 + 15 * i if i % 10 else None  # None: server clock
+        reading['battery_percentage'] = 0.0 if i % 3 == 0 else None if i % 3 == 1 else 55.5
+        readings.append(reading)
+
+    device_id, timestamps, columns = decode_frame(encode_frame(readings, 'esp-ä'))
+    assert device_id == 'esp-ä'
+    np.testing.assert_array_equal(timestamps, [r['timestamp'] or np.nan for r in readings])
+    for name in FIELDS:
+        expected = [np.nan if r[name] is None else r[name] for r in readings]
+        np.testing.assert_allclose(columns[name], expected, atol=5e-4, equal_nan=True)
+
+
+def test_limits_round_trip():
+    readings = [{'timestamp': 2**32 - 1, 'power': 2147483.647, 'energy': -2147483.647, 'voltage': 0.0004}]
+    _, timestamps, columns = decode_frame(encode_frame(readings))
+    assert timestamps[0] == 2**32 - 1
+    assert columns['power'][0] == 2147483.647 and columns['energy'][0] == -2147483.647
+    assert columns['voltage'][0] == 0.0 and np.isnan(columns['current'][0])
+
+
+@pytest.mark.parametrize('reading', [
+    {'timestamp': 1735689600000},  # milliseconds
+    {'timestamp': -1},
+    {'power': 2147483.648},
+    {'power': -2147483.648},
+    {'energy': float('inf')},
+])
+def test_encode_rejects_values_out_of_range(reading):
+    with pytest.raises(ValueError):
+        encode_frame([reading])
+
+
+def test_empty_frame():
+    device_id, timestamps, columns = decode_frame(encode_frame([]))
+    assert device_id is None and len(timestamps) == 0 and len(columns['power']) == 0
+
+
+@pytest.mark.parametrize('mutate, message', [
+    (lambda body: body[:4], 'shorter'),
+    (lambda body: b'XX' + body[2:], 'magic'),
+    (lambda body: body[:2] + b'\x09' + body[3:], 'version'),
+    (lambda body: body[:-1], 'bytes'),
+])
+def test_decode_rejects_malformed_frames(mutate, message):
+    body = encode_frame([{'timestamp': 1735689600, 'power': 1.0}], 'esp')
+    assert len(body) == HEADER.size + 3 + RECORD_DTYPES[1].itemsize
+    with pytest.raises(ValueError, match=message):
+        decode_frame(mutate(body))
@@ -0,0 +1,51 @@
+import threading
+
+from device_state import DeviceState, DeviceStateStore
+
+
+def test_devices_do_not_share_state():
+    store = DeviceStateStore()
+    with store.locked('esp-a') as state:
+        state.power = 120.0
+        store.touch(state)
+    with store.locked('esp-b') as state:
+        state.power = 5.0
+        state.nonessentialrelaystate = 0
+        store.touch(state)
+
+    assert store.get('esp-a').power == 120.0
+    assert store.get('esp-a').nonessentialrelaystate == 1
+    assert store.get('esp-b').power == 5.0
+    assert store.latest().device_id == 'esp-b'
+    assert sorted(store.device_ids()) == ['esp-a', 'esp-b'] and len(store) == 2
+
+
+def test_get_does_not_create():
+    store = DeviceStateStore()
+    assert store.get('unknown') is None and store.latest() is None
+    assert store.get_or_create('esp') is store.get_or_create('esp')
+    assert len(store) == 1
+
+
+def test_new_state_defaults():
+    state = DeviceState('esp')
+    assert state.last_updated is None and state.power is None and state.alert1 is None
+    assert state.metrics_dict()['nonessentialrelaystate'] == 1
+    assert set(state.alerts_dict()) == {f'alert{i}' for i in range(1, 9)}
+    assert state.esp32_dict()['energy'] is None
+
+
+def test_locked_updates_are_serialized():
+    store = DeviceStateStore(stripes=4)
+
+    def bump(device_id):
+        for _ in range(1000):
+            with store.locked(device_id) as state:
+                state.energy = (state.energy or 0) + 1
+
+    threads = [threading.Thread(target=bump, args=(f'esp-{i % 3}',)) for i in range(9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [store.get(f'esp-{i}').energy for i in range(3)] == [3000, 3000, 3000]
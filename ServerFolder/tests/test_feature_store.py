@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from feature_store import (LAGS, ROLL_WINDOWS, TARGET, FeatureStore, OnlineFeatures,
+                           feature_names, lag_feature_matrix)
+
+pd = pytest.importorskip('pandas')
+
+
+def batch_features(values):
+    """add_lag_features as ml_model_training.py computes it, one column per feature"""
+    series = pd.Series(values, dtype='float64')
+    features = {f'{TARGET}_lag_{lag}': series.shift(lag) for lag in LAGS}
+    for w in ROLL_WINDOWS:
+        rolling = series.shift(1).rolling(w, min_periods=max(2, w // 2))
+        features[f'{TARGET}_roll_mean_{w}'] = rolling.mean()
+        features[f'{TARGET}_roll_std_{w}'] = rolling.std()
+        features[f'{TARGET}_roll_min_{w}'] = rolling.min()
+        features[f'{TARGET}_roll_max_{w}'] = rolling.max()
+    return {name: column.to_numpy() for name, column in features.items()}
+
+
+def energy_series(n, seed=3):
+    rng = np.random.default_rng(seed)
+    values = np.cumsum(rng.uniform(0, 0.5, n))
+    values[rng.random(n) < 0.1] = np.nan
+    values[150:170] = np.nan  # a gap longer than the smaller windows
+    return values
+
+
+def assert_row(features, expected, index):
+    for name in feature_names():
+        assert features[name] == pytest.approx(expected[name][index], rel=1e-9, abs=1e-9, nan_ok=True), name
+
+
+def test_online_features_match_the_batch_recompute():
+    values = energy_series(400)
+    expected = batch_features(values)
+    online = OnlineFeatures()
+    for index, value in enumerate(values):
+        assert_row(online.features(), expected, index)
+        online.push(value, fill=False)
+
+
+def test_lag_feature_matrix_matches_the_batch_recompute():
+    values = energy_series(400)
+    expected = batch_features(values)
+    matrix = lag_feature_matrix(values, chunk_rows=64)
+    for name in feature_names():
+        np.testing.assert_allclose(matrix[name], expected[name], rtol=1e-9, atol=1e-9)
+
+
+def test_store_folds_readings_onto_steps_and_fills_short_gaps():
+    store = FeatureStore(step_seconds=60)
+    readings = []
+    for step in range(60):
+        if step in (20, 40, 41, 42):
+            continue  # 20 is forward-filled; 40-42 are longer than FFILL_LIMIT
+        readings += [(step * 60 + 5, step - 0.5), (step * 60 + 50, float(step))]
+    for timestamp, energy in readings:
+        assert store.observe('dev', timestamp, energy)
+    assert not store.observe('dev', 10, 99.0)  # late reading for a completed step
+
+    grid = np.arange(60, dtype=float)
+    grid[20] = 19.0
+    grid[40:42] = 39.0
+    grid[42] = np.nan
+    expected = batch_features(grid)
+    step, features, last_known = store.current('dev')
+    assert (step, last_known) == (59, 59.0)
+    assert_row(features, expected, 59)
+
+
+def test_store_persists_completed_steps_and_warms_up(tmp_path, monkeypatch):
+    monkeypatch.setattr('time.time', lambda: 100 * 60.0)
+    store = FeatureStore(step_seconds=60).open(str(tmp_path))
+    for step in range(90):
+        store.observe('dev', step * 60 + 1, float(step))
+    store.close()
+
+    matrix = store.read_matrix()
+    assert list(matrix['timestamp']) == [step * 60.0 for step in range(90)]
+    expected = batch_features(np.arange(90, dtype=float))
+    for name in feature_names():
+        np.testing.assert_allclose(matrix[name], expected[name], rtol=1e-6, atol=1e-4)
+
+    restarted = FeatureStore(step_seconds=60).open(str(tmp_path))
+    restarted.observe('dev', 90 * 60 + 1, 90.0)
+    step, features, _ = restarted.current('dev')
+    assert step == 90
+    assert_row(features, batch_features(np.arange(91, dtype=float)), 90)
+    assert FeatureStore().current('dev') is None
@@ -0,0 +1,25 @@
+import numpy as np
+
+from forecast_service import ForecastService
+
+
+def test_observe_batch_matches_reading_by_reading(tmp_path):
+    rng = np.random.default_rng(4)
+    n = 400
+    timestamps = 1735689600 + np.cumsum(rng.choice([1, 5, 15, 60, 400], n)).astype(np.float64)
+    timestamps[100] = timestamps[99]  # readings sharing a timestamp
+    energy = rng.uniform(0, 5, n)
+    energy[rng.random(n) < 0.3] = np.nan
+    columns = {'energy': energy, 'power': rng.uniform(0, 500, n)}
+    extra = {'temperature': 31.0, 'nonessentialrelaystate': 1}
+
+    one_by_one = ForecastService(model_dir=str(tmp_path), step_seconds=300)
+    expected = []
+    for i in range(n):
+        one_by_one.observe('esp', timestamps[i], {**{name: values[i] for name, values in columns.items()}, **extra})
+        expected.append(one_by_one.predict('esp', '1h'))
+
+    batched = ForecastService(model_dir=str(tmp_path), step_seconds=300)
+    predicted = batched.observe_batch('esp', timestamps, columns, '1h', extra)
+    np.testing.assert_array_equal(predicted, expected)
+    assert batched.forecast('esp') == one_by_one.forecast('esp')
@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+from forwarder import DeliveryError, OutboundQueue
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class Recorder:
+    """send_batch that records batches, blocks while the gate is closed and fails on demand"""
+
+    def __init__(self, fail=None):
+        self.batches = []
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.fail = fail or (lambda items, call: None)
+
+    def __call__(self, items):
+        self.calls.append((time.time(), list(items)))
+        self.gate.wait(5)
+        error = self.fail(items, len(self.calls))
+        if error is not None:
+            raise error
+        self.batches.append(list(items))
+
+    def delivered(self):
+        return [item for batch in self.batches for item in batch]
+
+
+def test_newer_payload_replaces_queued_one():
+    send = Recorder()
+    send.gate.clear()
+    queue = OutboundQueue('test-coalesce', send, workers=1, batch_size=10)
+    queue.submit('a', 1)
+    wait_until(lambda: queue.depth() == 0)  # taken by the worker, which is now blocked
+    queue.submit('a', 2)
+    queue.submit('b', 1)
+    queue.submit('a', 3)
+    send.gate.set()
+    wait_until(lambda: queue.stats()['sent'] == 3)
+    assert send.batches == [[('a', 1)], [('b', 1), ('a', 3)]]
+    assert queue.stats()['coalesced'] == 1
+    queue.stop()
+
+
+def test_full_queue_drops_the_oldest():
+    send = Recorder()
+    send.gate.clear()
+    queue = OutboundQueue('test-drop', send, maxsize=2, workers=1, batch_size=10)
+    queue.submit('x', 0)
+    wait_until(lambda: queue.depth() == 0)
+    assert queue.submit('a', 1) and queue.submit('b', 1)
+    assert not queue.submit('c', 1)
+    send.gate.set()
+    wait_until(lambda: queue.stats()['sent'] == 3)
+    assert send.delivered() == [('x', 0), ('b', 1), ('c', 1)]
+    assert queue.stats()['dropped'] == 1
+    queue.stop()
+
+
+def test_backoff_does_not_hold_up_other_items():
+    def fail_a(items, call):
+        tries = sum(1 for _, sent in send.calls if sent == [('a', 1)])
+        return OSError("down") if items == [('a', 1)] and tries <= 3 else None
+    send = Recorder(fail_a)
+    queue = OutboundQueue('test-backoff', send, workers=1, batch_size=1,
+                          max_retries=5, backoff_base=0.1, backoff_max=1.0)
+    queue.submit('a', 1)
+    wait_until(lambda: len(send.calls) == 1)
+    queue.submit('b', 1)  # delivered while 'a' waits for its retry
+    wait_until(lambda: queue.stats()['sent'] == 2)
+    assert send.delivered() == [('b', 1), ('a', 1)]
+
+    attempts = [at for at, items in send.calls if items == [('a', 1)]]
+    assert len(attempts) == 4
+    for retry, (before, after) in enumerate(zip(attempts, attempts[1:]), start=1):
+        delay = min(1.0, 0.1 * 2 ** (retry - 1))
+        assert delay / 2 - 0.01 <= after - before <= delay + 0.2
+    assert queue.stats()['retries'] == 3 and queue.stats()['retrying'] == 0
+    queue.stop()
+
+
+def test_gives_up_after_max_retries():
+    given_up = []
+    send = Recorder(lambda items, call: OSError("down"))
+    queue = OutboundQueue('test-give-up', send, workers=1, max_retries=2, backoff_base=0.01,
+                          on_give_up=given_up.extend)
+    queue.submit('a', 1)
+    wait_until(lambda: given_up)
+    assert given_up == [('a', 1)] and len(send.calls) == 3
+    assert queue.stats()['failed'] == 1
+    queue.stop()
+
+
+def test_newer_payload_replaces_a_parked_retry():
+    send = Recorder(lambda items, call: OSError("down") if call == 1 else None)
+    queue = OutboundQueue('test-parked', send, workers=1, backoff_base=0.3)
+    queue.submit('a', 1)
+    wait_until(lambda: queue.stats()['retrying'] == 1)
+    queue.submit('a', 2)
+    wait_until(lambda: queue.stats()['sent'] == 1)
+    time.sleep(0.4)  # the parked retry's time passes without it being sent
+    assert send.delivered() == [('a', 2)]
+    queue.stop()
+
+
+def test_only_failed_items_are_retried():
+    def fail_b_once(items, call):
+        if call == 1:
+            return DeliveryError(['b', 'c'], OSError("down"))
+    send = Recorder(fail_b_once)
+    send.gate.clear()
+    queue = OutboundQueue('test-partial', send, workers=1, batch_size=10, backoff_base=0.01)
+    for key in 'abc':
+        queue.submit(key, 1)
+    send.gate.set()
+    wait_until(lambda: queue.stats()['sent'] == 3)
+    assert [sorted(batch) for batch in send.batches] == [[('b', 1), ('c', 1)]]  # 'a' went out in the first call
+    assert [items for _, items in send.calls][0] == [('a', 1), ('b', 1), ('c', 1)]
+    assert queue.stats()['retries'] == 2
+    queue.stop()
+
+
+def test_post_to_app_reports_undelivered_items(app_module):
+    session = app_module.app_session
+    session.posts.clear()
+    session.fail.append(lambda body: body.get('n') == 2)
+    try:
+        items = [(f'dev-{n}', {'n': n}) for n in range(1, 5)]
+        with pytest.raises(DeliveryError) as raised:
+            app_module.post_to_app(items)
+        assert raised.value.failed == {'dev-2', 'dev-3', 'dev-4'}
+        assert [body for _, body in session.posts] == [{'n': 1}]
+    finally:
+        session.fail.clear()
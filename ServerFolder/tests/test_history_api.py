@@ -0,0 +1,73 @@
+import csv
+import io
+
+import pytest
+
+START = 1736000000.0
+
+
+@pytest.fixture(scope='module')
+def history(app_module):
+    rows = [{'timestamp': START + i * 15, 'device_id': 'hist-a', 'power': float(i), 'energy': i / 100,
+             'data_source': 'esp32_live'} for i in range(2500)]
+    app_module.ts_store.append_many(rows)
+    app_module.ts_store.flush()
+    return rows
+
+
+def window(**params):
+    query = {'device': 'hist-a', 'start': START, 'end': START + 2499 * 15, **params}
+    return '&'.join(f'{key}={value}' for key, value in query.items())
+
+
+def test_default_page_size(app_module, client, history):
+    body = client.get(f'/api/csv-data?{window()}').get_json()
+    assert body['total_records'] == app_module.DEFAULT_QUERY_LIMIT
+    assert body['next_cursor'] is not None
+
+
+def test_pages_cover_the_window_once(client, history):
+    powers, cursor = [], ''
+    while True:
+        body = client.get(f'/api/csv-data?{window(columns="power", limit=700)}&cursor={cursor}').get_json()
+        powers.extend(row['power'] for row in body['data'])
+        assert set(body['data'][0]) == {'timestamp', 'power'}
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert powers == [row['power'] for row in history]
+
+
+@pytest.mark.parametrize('params', ['cursor=garbage', 'cursor=1.5:-2', 'limit=0', 'limit=many',
+                                    'limit=50001', 'columns=power,nope'])
+def test_bad_parameters_are_400(client, history, params):
+    response = client.get(f'/api/csv-data?{window()}&{params}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_csv_download_writes_timestamp_once(client, history):
+    response = client.get(f'/api/csv-data?{window(format="csv", gzip="false", columns="timestamp,power")}')
+    assert response.status_code == 200
+    table = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert table[0] == ['timestamp', 'power']
+    assert len(table) == 1 + len(history)
+
+
+def test_missing_data_is_logged_when_a_gap_opens_and_closes(app_module, capsys, monkeypatch):
+    state = app_module.state_store.get_or_create('gap-dev')
+    now = app_module.time.time()
+    for device_id in app_module.state_store.device_ids():
+        monkeypatch.setattr(app_module.state_store.get(device_id), 'last_updated', now)
+    state.last_updated = now - 60
+    app_module.check_missing_data()
+    app_module.check_missing_data()
+    state.last_updated = app_module.time.time()
+    app_module.check_missing_data()
+    app_module.check_missing_data()
+    lines = [line for line in capsys.readouterr().out.splitlines() if 'gap-dev' in line]
+    assert len(lines) == 2
+    assert 'gap opened for gap-dev' in lines[0]
+    assert 'gap closed for gap-dev' in lines[1]
+    gaps = app_module.ts_store.gaps.read(now - 120, device_id='gap-dev')
+    assert len(gaps['start']) == 1 and gaps['start'][0] == pytest.approx(now - 60)
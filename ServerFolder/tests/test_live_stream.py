@@ -0,0 +1,73 @@
+import json
+
+from live_stream import LiveBroker, diff
+
+
+def events(chunk):
+    """(event, data) pairs of an SSE chunk"""
+    parsed = []
+    for frame in chunk.decode('utf-8').strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in frame.split('\n') if not line.startswith(':'))
+        if 'event' in fields:
+            parsed.append((fields['event'], json.loads(fields['data'])))
+    return parsed
+
+
+def test_diff_reports_changed_nested_and_removed_fields():
+    old = {'power': 1, 'alerts': {'battery': 'low', 'solar': None}, 'gone': 3, 'same': 'x'}
+    new = {'power': 2, 'alerts': {'battery': 'ok', 'solar': None, 'load': 'high'}, 'same': 'x', 'added': 0}
+    assert diff(old, new) == {'power': 2, 'alerts': {'battery': 'ok', 'load': 'high'}, 'added': 0, 'gone': None}
+    assert diff({'alerts': {'a': 1}}, {'alerts': {}}) == {'alerts': {'a': None}}
+
+
+def test_client_gets_a_snapshot_then_only_changes():
+    broker = LiveBroker()
+    broker.publish('esp', {'power': 1, 'energy': 5, 'timestamp': 't0'})
+    subscriber = broker.subscribe('esp')
+    stream = broker.stream(subscriber)
+    assert next(stream).startswith(b'retry:')
+    assert events(next(stream)) == [('snapshot', {'device_id': 'esp', 'seq': 1,
+                                                  'data': {'power': 1, 'energy': 5, 'timestamp': 't0'}})]
+    assert broker.publish('esp', {'power': 1, 'energy': 5, 'timestamp': 't1'}) is None  # only the time moved
+    broker.publish('esp', {'power': 2, 'energy': 5, 'timestamp': 't2'})
+    assert events(next(stream)) == [('delta', {'device_id': 'esp', 'seq': 2,
+                                               'changes': {'power': 2, 'timestamp': 't2'}})]
+    stream.close()
+    assert broker.stats()['subscribers'] == 0
+
+
+def test_delta_is_encoded_once_for_every_matching_client():
+    broker = LiveBroker()
+    broker.publish('a', {'power': 1})
+    broker.publish('b', {'power': 1})
+    only_a, everything, only_b = broker.subscribe('a'), broker.subscribe(), broker.subscribe('b')
+    for subscriber in (only_a, everything, only_b):
+        subscriber.take(0)
+    event = broker.publish('a', {'power': 2})
+    assert only_a.take(0) == (False, [event])
+    assert everything.take(0)[1][0] is event
+    assert only_b.take(0) == (False, [])
+
+
+def test_slow_client_is_resynced_with_the_latest_snapshot():
+    broker = LiveBroker(max_buffer=2)
+    broker.publish('esp', {'power': 0})
+    subscriber = broker.subscribe('esp')
+    stream = broker.stream(subscriber)
+    next(stream), next(stream)  # retry + first snapshot
+    for power in (1, 2, 3):
+        broker.publish('esp', {'power': power})
+    assert broker.stats()['dropped'] == 2
+    assert events(next(stream)) == [('snapshot', {'device_id': 'esp', 'seq': 4, 'data': {'power': 3}})]
+    broker.publish('esp', {'power': 4})
+    assert events(next(stream))[0][0] == 'delta'
+    stream.close()
+
+
+def test_subscribers_are_capped():
+    broker = LiveBroker(max_subscribers=2)
+    first = broker.subscribe('a')
+    assert broker.subscribe() is not None
+    assert broker.subscribe('b') is None
+    broker.unsubscribe(first)
+    assert broker.subscribe('b') is not None
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from conftest import FakeSession
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def install_sessions(script, monkeypatch, *tokens):
+    sessions = {token: FakeSession() for token in tokens}
+    monkeypatch.setattr(script, 'thingsboard_sessions', sessions)
+    return sessions
+
+
+def test_post_telemetry_sends_one_request_per_token(script_module, monkeypatch):
+    sessions = install_sessions(script_module, monkeypatch, 'tok-a', 'tok-b')
+    script_module.post_telemetry([
+        (('tok-a', 1000), {'Power': 1}),
+        (('tok-b', 1001), {'Power': 2}),
+        (('tok-a', 1002), {'Power': 3}),
+    ])
+    host = script_module.THINGSBOARD_HOST
+    assert sessions['tok-a'].posts == [(f"{host}/api/v1/tok-a/telemetry",
+                                        [{'ts': 1000, 'values': {'Power': 1}},
+                                         {'ts': 1002, 'values': {'Power': 3}}])]
+    assert sessions['tok-b'].posts == [(f"{host}/api/v1/tok-b/telemetry",
+                                        [{'ts': 1001, 'values': {'Power': 2}}])]
+
+
+def test_post_telemetry_raises_on_failed_post(script_module, monkeypatch):
+    sessions = install_sessions(script_module, monkeypatch, 'tok-a')
+    sessions['tok-a'].fail.append(lambda body: True)
+    with pytest.raises(OSError):
+        script_module.post_telemetry([(('tok-a', 1000), {'Power': 1})])
+
+
+def test_reading_is_answered_before_it_is_forwarded(script_module, monkeypatch):
+    sessions = install_sessions(script_module, monkeypatch, 'tok-q')
+    sent = script_module.thingsboard_forwarder.stats()['sent']
+    response = script_module.app.test_client().post(
+        '/esp32-data', json={'THINGSBOARD_TOKEN': 'tok-q', 'power': 120, 'battery_percentage': 80})
+    assert response.status_code == 200
+    assert response.get_json()['thingsboard_status'] == 'queued'
+    wait_until(lambda: script_module.thingsboard_forwarder.stats()['sent'] == sent + 1)
+    (url, points), = sessions['tok-q'].posts
+    assert url.endswith('/api/v1/tok-q/telemetry')
+    assert points[0]['values']['Power'] == 120
+    assert points[0]['values']['BatteryPercentage'] == 80
+
+
+def test_reading_without_token_is_not_forwarded(script_module):
+    response = script_module.app.test_client().post('/esp32-data', json={'power': 5})
+    assert response.get_json()['thingsboard_status'] == 'no_token'
+
+
+def test_weather_key_rounds_to_the_grid(script_module):
+    assert script_module.weather_key(28.437, 79.412) == '28.40,79.40'
+    assert script_module.weather_key('28.46', '79.44') == script_module.weather_key(28.5, 79.4)
+
+
+def test_current_slot_picks_the_hour_containing_now(script_module):
+    forecast = {'time': [3600, 7200, 10800], 'temperature_2m': [20.0, 21.0]}
+    assert script_module.current_slot(forecast, now=7300) == 1
+    assert script_module.current_slot(forecast, now=100) is None
+    assert script_module.slot_value(forecast, 'temperature_2m', 1) == 21.0
+    assert script_module.slot_value(forecast, 'temperature_2m', 2) is None
+
+
+def test_forecast_is_fetched_once_per_hour(script_module, monkeypatch):
+    """Devices post and the scheduler runs every minute for two hours"""
+    fetches = []
+    cache = script_module.forecast_cache
+    monkeypatch.setattr(cache, 'fetch', lambda key: fetches.append(key) or {'time': []})
+    clock = [12 * 3600 + 30.0]
+    monkeypatch.setattr(time, 'time', lambda: clock[0])
+    key = 'fetch-count-cell'
+    for _ in range(120):
+        assert cache.get(key) == {'time': []}
+        cache.refresh_ahead()
+        clock[0] += 60
+    # First request, then one refresh ahead of 13:00 and of 14:00
+    assert fetches == [key] * 3
+    assert cache.peek(key).expires_at == 15 * 3600
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from resample import ffill_limited, interpolate_limited
+
+pd = pytest.importorskip('pandas')
+
+
+def with_gaps(rng, n):
+    values = rng.normal(10, 2, n)
+    values[rng.random(n) < 0.35] = np.nan
+    values[5:17] = np.nan  # a gap longer than 2 * limit
+    values[:3] = np.nan    # leading and trailing runs
+    values[-2:] = np.nan
+    return values
+
+
+@pytest.mark.parametrize('limit', [1, 2, 4, 10])
+def test_interpolate_limited_matches_pandas(limit):
+    rng = np.random.default_rng(limit)
+    values = with_gaps(rng, 500)
+    expected = pd.Series(values).interpolate(limit=limit, limit_direction='both').to_numpy()
+    np.testing.assert_allclose(interpolate_limited(values, limit), expected, rtol=1e-12, equal_nan=True)
+
+
+@pytest.mark.parametrize('limit', [1, 2, 5])
+def test_ffill_limited_matches_pandas(limit):
+    rng = np.random.default_rng(100 + limit)
+    values = with_gaps(rng, 500)
+    expected = pd.Series(values).ffill(limit=limit).to_numpy()
+    np.testing.assert_array_equal(ffill_limited(values, limit), expected)
+
+
+def test_columns_are_filled_independently():
+    rng = np.random.default_rng(5)
+    matrix = np.column_stack([with_gaps(rng, 200) for _ in range(3)])
+    frame = pd.DataFrame(matrix)
+    np.testing.assert_allclose(interpolate_limited(matrix, 4),
+                               frame.interpolate(limit=4, limit_direction='both').to_numpy(), equal_nan=True)
+    np.testing.assert_array_equal(ffill_limited(matrix, 2), frame.ffill(limit=2).to_numpy())
+
+
+@pytest.mark.parametrize('values', [[], [np.nan, np.nan], [1.0, 2.0]])
+def test_trivial_inputs(values):
+    values = np.array(values, dtype=np.float64)
+    np.testing.assert_array_equal(interpolate_limited(values), values)
+    np.testing.assert_array_equal(ffill_limited(values), values)
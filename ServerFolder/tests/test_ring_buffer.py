@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from ring_buffer import RingBuffer
+
+
+def reference(ts, values, window, capacity):
+    """count, mean, variance and np.polyfit slope of what the buffer should hold after the last reading"""
+    keep = (ts >= ts[-1] - window) & (np.arange(len(ts)) >= len(ts) - capacity)
+    t, x = ts[keep], values[keep]
+    present = ~np.isnan(x)
+    t, x = t[present], x[present]
+    if not len(x):
+        return 0, np.nan, np.nan, np.nan
+    slope = np.polyfit(t - t[0], x, 1)[0] if len(x) >= 2 and np.ptp(t) > 0 else np.nan
+    return len(x), x.mean(), x.var(), slope
+
+
+def random_series(rng, n):
+    ts = 1.7e9 + np.cumsum(rng.uniform(0.5, 30, n))
+    values = 50 + 0.02 * (ts - ts[0]) + rng.normal(0, 3, n)
+    values[rng.random(n) < 0.1] = np.nan
+    return ts, values
+
+
+@pytest.mark.parametrize('window, capacity', [(300.0, 256), (120.0, 8), (1e9, 32)])
+def test_append_matches_polyfit(window, capacity):
+    rng = np.random.default_rng(7)
+    ts, values = random_series(rng, 600)  # several sum rebuilds and evictions
+    buffer = RingBuffer(window=window, capacity=capacity)
+    for i in range(len(ts)):
+        assert buffer.append(ts[i], [values[i]])
+        count, mean, variance, slope = reference(ts[:i + 1], values[:i + 1], window, capacity)
+        stats = buffer.stats('value')
+        assert stats['count'] == count
+        np.testing.assert_allclose(stats['mean'], mean, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(stats['variance'], variance, rtol=1e-6, atol=1e-6)
+        np.testing.assert_allclose(buffer.slope(), slope, rtol=1e-6, atol=1e-9)
+
+
+def test_slope_needs_two_distinct_times():
+    buffer = RingBuffer()
+    assert np.isnan(buffer.slope())
+    buffer.append(100.0, [1.0])
+    buffer.append(100.0, [2.0])
+    assert np.isnan(buffer.slope())
+    buffer.append(110.0, [3.0])
+    assert buffer.slope() == pytest.approx(np.polyfit([100.0, 100.0, 110.0], [1.0, 2.0, 3.0], 1)[0])
+
+
+def test_older_readings_are_ignored():
+    buffer = RingBuffer()
+    buffer.append(100.0, [1.0])
+    assert not buffer.append(90.0, [5.0])
+    assert len(buffer) == 1 and buffer.mean() == 1.0
+
+
+def test_extend_matches_append():
+    rng = np.random.default_rng(11)
+    ts, values = random_series(rng, 400)
+    ts[50] = ts[40]  # an out-of-order reading is ignored by both
+    fields = ('light', 'battery')
+    values = np.column_stack([values, values[::-1]])
+    one_by_one = RingBuffer(fields, window=200.0, capacity=16)
+    batched = RingBuffer(fields, window=200.0, capacity=16)
+    one_by_one.append(ts[0] - 5, [1.0, 2.0])
+    batched.append(ts[0] - 5, [1.0, 2.0])
+
+    result = batched.extend(ts, values)
+    for i in range(len(ts)):
+        one_by_one.append(ts[i], values[i])
+        for j, name in enumerate(fields):
+            expected = one_by_one.stats(name)
+            count, mean, variance, slope = (array[i] for array in result[name])
+            assert count == expected['count']
+            np.testing.assert_allclose([mean, variance, slope],
+                                       [expected['mean'], expected['variance'], expected['slope']],
+                                       rtol=1e-6, atol=1e-9)
+    for name in fields:
+        np.testing.assert_allclose(batched.slope(name), one_by_one.slope(name), rtol=1e-9)
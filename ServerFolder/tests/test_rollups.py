@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from rollups import RollupStore
+
+START = 1735689600.0
+
+
+def readings(rng, n, devices=('roll-a', 'roll-b')):
+    timestamps = START + np.sort(rng.uniform(0, 6 * 3600, n))
+    device = rng.choice(devices, n)
+    power = rng.uniform(0, 500, n)
+    power[rng.random(n) < 0.2] = np.nan
+    energy = np.full(n, np.nan)
+    for name in devices:
+        mine = device == name
+        energy[mine] = np.cumsum(rng.uniform(0, 0.01, mine.sum()))
+    energy[rng.random(n) < 0.2] = np.nan
+    return timestamps, device, power, energy
+
+
+def expected_buckets(timestamps, power, energy, seconds):
+    """Per-bucket aggregates straight from the raw readings"""
+    result = {}
+    buckets = np.floor(timestamps / seconds) * seconds
+    for bucket in np.unique(buckets):
+        mine = buckets == bucket
+        p, e = power[mine], energy[mine]
+        p_known, e_known = p[~np.isnan(p)], e[~np.isnan(e)]
+        result[bucket] = {
+            'power_mean': p_known.mean() if len(p_known) else np.nan,
+            'power_min': p_known.min() if len(p_known) else np.nan,
+            'power_max': p_known.max() if len(p_known) else np.nan,
+            'power_last': p_known[-1] if len(p_known) else np.nan,
+            'energy_delta': e_known[-1] - e_known[0] if len(e_known) else np.nan,
+        }
+    return result
+
+
+def fill(store, timestamps, device, power, energy, chunks):
+    for part in np.array_split(np.arange(len(timestamps)), chunks):
+        for name in np.unique(device[part]):
+            mine = part[device[part] == name]
+            store.add_columns(name, timestamps[mine], {'power': power[mine], 'energy': energy[mine]})
+
+
+@pytest.mark.parametrize('tier, seconds', [('1m', 60), ('15m', 900), ('1h', 3600)])
+def test_per_device_buckets_match_raw_readings(tmp_path, tier, seconds):
+    rng = np.random.default_rng(seconds)
+    timestamps, device, power, energy = readings(rng, 3000)
+    store = RollupStore(str(tmp_path), metrics=('power', 'energy'))
+    fill(store, timestamps, device, power, energy, chunks=37)
+    store.flush()  # open buckets become partials merged on read
+
+    for name in ('roll-a', 'roll-b'):
+        mine = device == name
+        expected = expected_buckets(timestamps[mine], power[mine], energy[mine], seconds)
+        data = store.query(tier, START, START + 6 * 3600, name)
+        assert list(data['timestamp']) == sorted(expected)
+        for i, bucket in enumerate(data['timestamp']):
+            for column, value in expected[bucket].items():
+                np.testing.assert_allclose(data[column][i], value, rtol=1e-9, atol=1e-12, err_msg=column)
+
+
+def test_last_skips_partials_without_the_metric(tmp_path):
+    store = RollupStore(str(tmp_path), metrics=('power', 'energy'))
+    store.add('roll-c', START + 1, {'power': 100.0, 'energy': 1.0})
+    store.flush()
+    store.add('roll-c', START + 2, {'power': None, 'energy': 1.5})  # newer partial, power missing
+    data = store.query('1m', START, START + 60, 'roll-c')
+    assert data['power_last'][0] == 100.0
+    assert data['energy_last'][0] == 1.5 and data['energy_delta'][0] == 0.5
+
+
+def test_without_device_one_point_per_bucket(tmp_path):
+    rng = np.random.default_rng(9)
+    timestamps, device, power, energy = readings(rng, 2000, devices=('roll-a', 'roll-b', 'roll-c'))
+    store = RollupStore(str(tmp_path), metrics=('power', 'energy'))
+    fill(store, timestamps, device, power, energy, chunks=5)
+
+    data = store.query('15m', START, START + 6 * 3600)
+    assert 'device_id' not in data
+    assert np.all(np.diff(data['timestamp']) > 0)
+    per_device = {name: store.query('15m', START, START + 6 * 3600, name) for name in ('roll-a', 'roll-b', 'roll-c')}
+    for i, bucket in enumerate(data['timestamp']):
+        mine = np.floor(timestamps / 900) * 900 == bucket
+        known = power[mine][~np.isnan(power[mine])]
+        np.testing.assert_allclose(data['power_mean'][i], known.mean())
+        assert data['power_max'][i] == known.max()
+        assert data['devices'][i] == len(set(device[mine]))
+        deltas = [series['energy_delta'][list(series['timestamp']).index(bucket)]
+                  for series in per_device.values() if bucket in series['timestamp']]
+        np.testing.assert_allclose(data['energy_delta'][i], np.nansum(deltas))
+
+    listed = store.query('15m', START, START + 6 * 3600, ['roll-a', 'roll-b'])
+    assert set(listed['device_id']) == {'roll-a', 'roll-b'}
+    assert np.all(np.diff(listed['timestamp']) >= 0)
+
+
+def test_choose_tier_counts_every_series(tmp_path):
+    store = RollupStore(str(tmp_path), metrics=('power',))
+    month = 30 * 86400
+    assert store.choose_tier(0, month, 1000) == '1h'
+    assert store.choose_tier(0, month, 1000, devices=2) == '1d'
+    assert store.choose_tier(0, 3600, 1000, devices=10) == '1m'
+
+
+def test_history_api(app_module, client):
+    for name in ('hist-x', 'hist-y'):
+        app_module.rollup_store.add_columns(name, np.arange(0, 7200, 15.0), {'power': np.full(480, 10.0)})
+
+    body = client.get('/api/history?start=0&end=7200&columns=power').get_json()
+    assert body['tier'] == '1m' and body['total_points'] == 120  # start=0 is not "missing"
+    assert all(point['devices'] == 2 for point in body['points'])
+
+    body = client.get('/api/history?start=0&end=7200&columns=power&device=hist-x,hist-y&max_points=200').get_json()
+    assert body['tier'] == '15m' and body['total_points'] == 16
+    assert [point['timestamp'] for point in body['points']] == sorted(point['timestamp'] for point in body['points'])
@@ -0,0 +1,67 @@
+import gzip
+import json
+
+import pytest
+
+import snapshot_cache
+from snapshot_cache import SnapshotCache, accepted_encodings, encode_json
+
+BIG = {'values': list(range(400))}
+
+
+@pytest.fixture(autouse=True)
+def no_brotli(monkeypatch):
+    monkeypatch.setattr(snapshot_cache, 'brotli', None)
+
+
+def test_snapshot_is_built_once_per_version():
+    cache, builds = SnapshotCache(), []
+    build = lambda: builds.append(1) or BIG
+    first = cache.get('k', 1, build)
+    assert cache.get('k', 1, build) is first
+    second = cache.get('k', 2, build)
+    assert len(builds) == 2 and cache.stats() == {'hits': 1, 'builds': 2, 'entries': 1}
+    assert second.etag == first.etag  # same body, same tag
+
+
+def test_oldest_key_is_evicted():
+    cache = SnapshotCache(max_entries=2)
+    for key in 'abc':
+        cache.get(key, 1, lambda: {})
+    assert cache.stats()['entries'] == 2
+    assert 'a' not in cache._entries
+
+
+@pytest.mark.parametrize('if_none_match', ['{etag}', 'W/{etag}', '"other", {etag}', '*'])
+def test_current_etag_gets_304(if_none_match):
+    snapshot = SnapshotCache().get('k', 1, lambda: BIG)
+    status, body, headers = snapshot.negotiate(if_none_match.format(etag=snapshot.etag), 'gzip')
+    assert (status, body, headers['ETag']) == (304, b'', snapshot.etag)
+
+
+def test_gzip_only_when_accepted_and_worth_it():
+    snapshot = SnapshotCache().get('k', 1, lambda: BIG)
+    status, body, headers = snapshot.negotiate('"stale"', 'br, gzip;q=0.8')
+    assert status == 200 and headers['Content-Encoding'] == 'gzip' and headers['Vary'] == 'Accept-Encoding'
+    assert json.loads(gzip.decompress(body)) == BIG
+    assert snapshot.negotiate('', 'gzip')[1] is body  # compressed once, kept with the snapshot
+    assert 'Content-Encoding' not in snapshot.negotiate('', 'gzip;q=0, identity')[2]
+    _, body, headers = SnapshotCache().get('s', 1, lambda: {'a': 1}).negotiate('', 'gzip')
+    assert body == encode_json({'a': 1}) and 'Content-Encoding' not in headers
+
+
+def test_accepted_encodings():
+    assert accepted_encodings('gzip, deflate;q=0.5, br;q=0') == {'gzip', 'deflate'}
+    assert accepted_encodings(None) == set()
+
+
+def test_dashboard_poll_gets_304_until_the_device_reports(app_module, client):
+    client.post('/esp32-data', json={'device_id': 'etag-dev', 'power': 100})
+    first = client.get('/api/dashboard-data?device=etag-dev')
+    assert first.status_code == 200 and first.get_json()['esp32_data']['device_id'] == 'etag-dev'
+    etag = first.headers['ETag']
+    again = client.get('/api/dashboard-data?device=etag-dev', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.data == b''
+    client.post('/esp32-data', json={'device_id': 'etag-dev', 'power': 200})
+    changed = client.get('/api/dashboard-data?device=etag-dev', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
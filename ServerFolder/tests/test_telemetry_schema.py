@@ -0,0 +1,78 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+import telemetry_schema as ts
+
+KEYS = [alias for _, _, aliases in ts.FIELDS for alias in aliases] + ['Ssid', 'Password', 'junk']
+VALUES = [0, 0.0, 1, -2.5, '3.25', ' 4 ', '', None, 'abc', True, False, float('nan'), float('inf'),
+          '1e400', 'nan', {}, [], 10**400, 1.7e12, '2025-01-01T00:00:00Z', 'dev']
+
+
+def same(a, b):
+    return a == b or (isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b))
+
+
+def random_document(rng, keys):
+    return {key: rng.choice(VALUES) for key in keys}
+
+
+def test_zero_is_a_reading():
+    reading, invalid = ts.parse_reading({'Power': 0, 'batteryPercentage': 0, 'lightIntensity': 0.0})
+    assert (reading.power, reading.battery_percentage, reading.light_intensity) == (0.0, 0.0, 0.0)
+    assert reading.voltage is None and not invalid
+
+
+def test_first_alias_wins_and_invalid_values_are_reported():
+    reading, invalid = ts.parse_reading({'SolarVoltage': 5.0, 'solar_voltage': 6.1, 'Voltage': 'abc'})
+    assert reading.solar_voltage == 6.1
+    assert reading.voltage is None and invalid == ['Voltage']
+
+
+def test_compiled_plan_matches_general_path():
+    rng = random.Random(1)
+    for _ in range(2000):
+        document = random_document(rng, rng.sample(KEYS, rng.randint(1, 12)))
+        fast, invalid = ts.parse_reading(document)
+        general, general_invalid = ts._parse_keys(document)
+        assert all(map(same, fast, general)), document
+        assert not invalid or invalid == general_invalid
+
+
+@pytest.mark.parametrize('same_keys', [True, False])
+def test_parse_batch_matches_parse_reading(same_keys):
+    rng = random.Random(2)
+    for _ in range(500):
+        keys = rng.sample(KEYS, rng.randint(1, 12))
+        batch = [random_document(rng, keys if same_keys else rng.sample(KEYS, rng.randint(1, 12)))
+                 for _ in range(rng.randint(1, 6))]
+        columns = ts.parse_batch(batch)
+        expected = ts._columns_of([ts.parse_reading(document)[0] for document in batch])
+        for name in ts.FIELD_NAMES:
+            if isinstance(expected[name], np.ndarray):
+                np.testing.assert_array_equal(columns[name], expected[name], err_msg=f"{name}: {batch}")
+            else:
+                assert columns[name] == expected[name], (name, batch)
+
+
+def test_parse_batch_of_one_firmware():
+    batch = [{'Power': i % 7, 'Energy': i / 10, 'Voltage': '230.5', 'Ssid': 'wifi'} for i in range(1000)]
+    columns = ts.parse_batch(batch)
+    np.testing.assert_array_equal(columns['power'], [i % 7 for i in range(1000)])
+    np.testing.assert_array_equal(columns['energy'], [i / 10 for i in range(1000)])
+    assert np.all(columns['voltage'] == 230.5) and np.all(np.isnan(columns['box_temp']))
+
+
+def test_plan_cache_keeps_the_key_sets_in_use(monkeypatch):
+    monkeypatch.setattr(ts, 'MAX_PLANS', 2)
+    monkeypatch.setattr(ts, '_plans', ts.OrderedDict())
+    a, b, c = {'power': 1}, {'Power': 1, 'energy': 2}, {'voltage': 230}
+    for data in (a, b, a, c):
+        ts.parse_reading(data)
+    assert list(ts._plans) == [('power',), ('voltage',)]  # b was the least recently used
+    plan = ts._plans[('power',)]
+    ts.parse_reading(a)
+    assert ts._plans[('power',)] is plan
+    assert ts.parse_reading(b)[0].energy == 2.0
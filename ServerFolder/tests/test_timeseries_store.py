@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+
+from timeseries_store import TimeSeriesStore
+
+START = 1735689600.0  # 2025-01-01 00:00 UTC
+
+
+def make_rows(n, start=START, interval=15.0, devices=('esp-a', 'esp-b')):
+    rows = []
+    for i in range(n):
+        rows.append({
+            'timestamp': start + i * interval,
+            'device_id': devices[i % len(devices)],
+            'power': float(i),
+            'energy': i / 10 if i % 5 else None,
+            'battery_percentage': 0,
+            'alert1': 'Overcharge!' if i % 7 == 0 else None,
+            'nonessentialrelaystate': i % 2,
+            'data_source': 'esp32_live',
+        })
+    return rows
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TimeSeriesStore(str(tmp_path / 'store'), flush_rows=50)
+
+
+def test_round_trip_across_days_and_buffer(store):
+    rows = make_rows(12000)  # 50 hours: three day segments plus rows still buffered
+    store.append_many(rows[:11990])
+    store.append_many(rows[11990:])
+    assert store.count() == len(rows)
+
+    data = store.read()
+    assert np.array_equal(data['timestamp'], [row['timestamp'] for row in rows])
+    assert np.array_equal(data['power'], [row['power'] for row in rows])
+    assert np.array_equal(data['energy'], [np.nan if row['energy'] is None else row['energy'] for row in rows],
+                          equal_nan=True)
+    assert np.all(data['battery_percentage'] == 0)
+    assert list(data['device_id']) == [row['device_id'] for row in rows]
+    assert list(data['alert1']) == [row['alert1'] for row in rows]
+    assert np.array_equal(data['nonessentialrelaystate'], [row['nonessentialrelaystate'] for row in rows])
+
+    # A fresh instance sees the same data from disk
+    store.flush()
+    reopened = TimeSeriesStore(store.root)
+    assert reopened.count() == len(rows)
+    assert list(reopened.read(columns=['alert1'])['alert1']) == [row['alert1'] for row in rows]
+
+
+def test_read_window_and_device(store):
+    rows = make_rows(1000)
+    store.append_many(rows)
+    start, end = START + 100 * 15, START + 200 * 15
+    data = store.read(start, end, device_id='esp-b')
+    expected = [row for row in rows if start <= row['timestamp'] <= end and row['device_id'] == 'esp-b']
+    assert np.array_equal(data['timestamp'], [row['timestamp'] for row in expected])
+    assert set(data['device_id']) == {'esp-b'}
+
+
+def test_csv_export_imports_back(store, tmp_path):
+    rows = make_rows(300)
+    store.append_many(rows)
+    headers = ['timestamp', 'device_id', 'power', 'energy', 'alert1', 'nonessentialrelaystate', 'data_source']
+    path = tmp_path / 'export.csv'
+    with open(path, 'w', newline='') as f:
+        store.export_csv(f, headers)
+
+    copy = TimeSeriesStore(str(tmp_path / 'copy'))
+    assert copy.import_csv_once(str(path)) == len(rows)
+    assert copy.import_csv_once(str(path)) == 0  # only once
+    original, imported = store.read(columns=headers[1:]), copy.read(columns=headers[1:])
+    for name in headers:
+        if imported[name].dtype == object:
+            assert list(imported[name]) == list(original[name])
+        else:
+            np.testing.assert_allclose(imported[name], original[name], equal_nan=True)
+
+
+
+@pytest.mark.parametrize('limit', [1, 7, 50, 999, 1000, 5000])
+def test_cursor_paging_returns_every_row_once(store, limit):
+    rows = make_rows(1000)
+    # Several rows share a timestamp, including across a page boundary
+    for row in rows[300:320]:
+        row['timestamp'] = START + 300 * 15
+    store.append_many(rows)
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        records, cursor = store.query(limit=limit, cursor=cursor)
+        assert len(records) <= limit
+        seen.extend(records['power'].tolist())
+        pages += 1
+        if cursor is None:
+            break
+    assert sorted(seen) == sorted(row['power'] for row in rows)
+    assert pages == max(1, -(-len(rows) // limit))
+
+
+def test_cursor_paging_with_device_and_window(store):
+    rows = make_rows(600)
+    store.append_many(rows)
+    start, end = START + 50 * 15, START + 500 * 15
+    seen, cursor = [], None
+    while True:
+        records, cursor = store.query(start, end, 'esp-a', limit=13, cursor=cursor)
+        seen.extend(records['timestamp'].tolist())
+        if cursor is None:
+            break
+    assert seen == [row['timestamp'] for row in rows
+                    if start <= row['timestamp'] <= end and row['device_id'] == 'esp-a']
+
+
+@pytest.mark.parametrize('cursor', ['not-a-cursor', '1.5', 'abc:1', '1.5:x', 'nan:0', '1.5:-1'])
+def test_invalid_cursor(store, cursor):
+    with pytest.raises(ValueError):
+        store.query(limit=10, cursor=cursor)
+
+
+def test_gaps_merge_per_device(store):
+    assert store.gaps.mark(START, START + 15, 'esp-a')
+    assert not store.gaps.mark(START, START + 30, 'esp-a')  # the same outage, checked again
+    store.gaps.mark(START + 100, START + 115, 'esp-b')
+    store.gaps.mark(START + 1000, START + 1015)  # nothing arrived from any device
+
+    a = store.gaps.read(device_id='esp-a')
+    assert list(zip(a['start'], a['end'])) == [(START, START + 30), (START + 1000, START + 1015)]
+    b = store.gaps.summary(device_id='esp-b')
+    assert b == {'intervals': 2, 'missing_seconds': 30.0}
+
+    store.gaps.flush()
+    reopened = TimeSeriesStore(store.root)
+    assert reopened.gaps.summary(device_id='esp-a') == {'intervals': 2, 'missing_seconds': 45.0}
+
+
+def test_closed_gap_is_kept_and_the_next_outage_opens_a_new_one(store):
+    store.gaps.mark(START, START + 15, 'esp-a')
+    store.gaps.flush()  # the open gap is written once ...
+    store.gaps.mark(START, START + 30, 'esp-a')
+    assert store.gaps.close('esp-a') == (START, START + 30)  # ... and again with its final end
+    assert store.gaps.close('esp-a') is None
+    assert store.gaps.mark(START + 60, START + 75, 'esp-a')
+    store.gaps.flush()
+    gaps = TimeSeriesStore(store.root).gaps.read(device_id='esp-a')
+    assert list(zip(gaps['start'], gaps['end'])) == [(START, START + 30), (START + 60, START + 75)]
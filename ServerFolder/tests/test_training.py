@@ -0,0 +1,186 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('lightgbm')
+pytest.importorskip('sklearn')
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def training(monkeypatch, tmp_path):
+    """ml_model_training.py working in tmp_path, inline (no process pool) and with small trees"""
+    monkeypatch.syspath_prepend(ROOT_DIR)
+    import ml_model_training
+    monkeypatch.setattr(ml_model_training, 'FEATURE_STORE_DIR', None)
+    monkeypatch.setattr(ml_model_training, 'TRAIN_WORKERS', 1)
+    monkeypatch.setattr(ml_model_training, 'MODEL_DIR', str(tmp_path / 'models'))
+    monkeypatch.setattr(ml_model_training, 'TRAIN_PARAMS',
+                        {**ml_model_training.TRAIN_PARAMS, 'num_leaves': 8, 'min_data_in_leaf': 5})
+    return ml_model_training
+
+
+def write_history(path, devices=('esp-a',), days=4, step=900, seed=5):
+    """Readings of each device every `step` seconds, with gaps, duplicates and off-grid rows"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for device in devices:
+        ts = 1735689600 + np.arange(days * 86400 // step) * step
+        hours = (ts % 86400) / 3600
+        frame = pd.DataFrame({
+            'timestamp': pd.to_datetime(ts, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+            'device_id': device,
+            'Energy': np.round(np.cumsum(np.clip(np.sin((hours - 6) / 12 * np.pi), 0, None)) / 10, 4),
+            'power': rng.uniform(0, 500, len(ts)).round(1),
+            'temperature': (25 + 5 * np.sin(hours / 24 * 2 * np.pi)).round(2),
+        })
+        frame.loc[rng.random(len(frame)) < 0.05, 'temperature'] = np.nan
+        frame = frame.drop(index=frame.index[40:44])  # a gap longer than FFILL_LIMIT
+        frames.append(frame)
+    history = pd.concat(frames).sort_values('timestamp', kind='stable')
+    extra = history.iloc[[10, 11]].copy()
+    extra['power'] = -1.0  # same timestamp again: the first row wins
+    history = pd.concat([history, extra]).sort_values('timestamp', kind='stable')
+    history.to_csv(path, index=False)
+    return history
+
+
+def prepared_rows(training, work_dir, wanted=None):
+    metas = training.prepare(str(work_dir), wanted, None, training.TRAIN_PARAMS)
+    return {series: training.load_rows(os.path.join(str(work_dir), training.series_dir_name(series)), meta)
+            for series, meta in metas.items()}, metas
+
+
+def test_training_rows_do_not_depend_on_chunk_size(training, monkeypatch, tmp_path):
+    csv = tmp_path / 'history.csv'
+    write_history(csv, devices=('esp-a', 'esp-b'))
+    monkeypatch.setattr(training, 'csv_path', str(csv))
+    whole, metas = prepared_rows(training, tmp_path / 'whole', 'all')
+    monkeypatch.setattr(training, 'CHUNK_ROWS', 37)
+    chunked, _ = prepared_rows(training, tmp_path / 'chunked', 'all')
+    assert sorted(metas) == ['esp-a', 'esp-b']
+    for series in metas:
+        assert metas[series]['rows'] > 0
+        for a, b in zip(whole[series], chunked[series]):
+            np.testing.assert_array_equal(np.asarray(a), np.asarray(b))
+
+
+def test_training_rows_match_a_whole_history_pass(training, monkeypatch, tmp_path):
+    csv = tmp_path / 'history.csv'
+    history = write_history(csv)
+    monkeypatch.setattr(training, 'csv_path', str(csv))
+    monkeypatch.setattr(training, 'CHUNK_ROWS', 50)
+    rows, metas = prepared_rows(training, tmp_path / 'work')
+    X, y, ts = (np.asarray(a) for a in rows[training.DEFAULT_MODEL])
+    meta = metas[training.DEFAULT_MODEL]
+
+    # Reference: the whole history on the grid in memory (the grid itself is float32)
+    frame = history.drop_duplicates('timestamp')
+    frame = frame.set_index(pd.to_datetime(frame['timestamp'])).asfreq('900s')
+    energy = frame['Energy'].astype(np.float32).astype(np.float64).ffill(limit=training.FFILL_LIMIT).to_numpy()
+    grid_ts = (frame.index - pd.Timestamp(0)).total_seconds().to_numpy()
+    features = training.lag_feature_matrix(energy)
+    steps_per_hour, steps_per_day = training.horizon_steps(900)
+
+    index = np.searchsorted(grid_ts, ts)
+    np.testing.assert_array_equal(grid_ts[index], ts)
+    assert (frame['power'].to_numpy()[index] != -1).all()
+    names = meta['features']
+    for name in training.feature_names():
+        np.testing.assert_allclose(X[:, names.index(name)], features[name][index], rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(X[:, names.index('power')], frame['power'].to_numpy()[index], rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(y[:, 0], energy[index + steps_per_hour], rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(y[:, 1], energy[index + steps_per_day], rtol=1e-6, atol=1e-6)
+
+
+def test_training_series_selection(training):
+    assert training.wanted_series(None) is None
+    assert training.wanted_series(' ALL ') == 'all'
+    assert training.wanted_series('a, b,') == {'a', 'b'}
+    devices = np.array(['a', 'b', 'a', None, ''], dtype=object)
+    assert {k: list(v) for k, v in training.group_rows(devices, {'a'}).items()} == {'a': [0, 2]}
+    assert set(training.group_rows(devices, 'all')) == {'a', 'b'}
+    assert training.group_rows(devices, None) == {training.DEFAULT_MODEL: slice(None)}
+    assert training.series_dir_name('esp/1 a') == 'esp_1_a'
+
+
+def train_and_publish(training, monkeypatch, tmp_path, devices):
+    csv = tmp_path / 'history.csv'
+    write_history(csv, devices=('esp-a', 'esp-b'))
+    monkeypatch.setattr(training, 'csv_path', str(csv))
+    monkeypatch.setattr(training, 'WORK_DIR', str(tmp_path / 'work'))
+    monkeypatch.setattr(training, 'TRAIN_DEVICES', devices)
+    training.main()
+    registry = training.registry_dir()
+    with open(os.path.join(registry, 'CURRENT')) as f:
+        version = f.read().strip()
+    with open(os.path.join(registry, version, 'manifest.json')) as f:
+        return version, json.load(f)
+
+
+def test_per_device_models_are_published_and_served(training, monkeypatch, tmp_path):
+    from forecast_service import ForecastService
+
+    version, manifest = train_and_publish(training, monkeypatch, tmp_path, 'all')
+    assert manifest['version'] == version
+    assert sorted(manifest['models']) == ['esp-a', 'esp-b']
+    assert set(manifest['models']['esp-a']['horizons']) == set(training.HORIZONS)
+    assert not [name for name in os.listdir(training.registry_dir()) if name.endswith('.tmp')]
+
+    service = ForecastService(model_dir=training.MODEL_DIR)
+    assert (service.version, service.source, service.step_seconds) == (version, 'lightgbm', 900)
+    assert set(service.models) == {(device, horizon) for device in ('esp-a', 'esp-b')
+                                   for horizon in training.HORIZONS}
+    assert service._model_name('esp-a', '1h') == 'lightgbm (device)'
+    assert service._model_name('esp-c', '1h') == 'persistence'  # no default model was trained
+    service.observe('esp-a', 1735689600, {'energy': 1.0, 'power': 200.0, 'temperature': 25.0})
+    assert np.isfinite(service.predict('esp-a', '1d'))
+
+
+def test_publish_switches_current_and_prunes_old_versions(training, monkeypatch, tmp_path):
+    version, manifest = train_and_publish(training, monkeypatch, tmp_path, None)
+    assert list(manifest['models']) == [training.DEFAULT_MODEL]
+    monkeypatch.setattr(training, 'REGISTRY_KEEP', 2)
+    metas = {training.DEFAULT_MODEL: {'step_seconds': 900.0, 'rows': 1, 'features': ['Energy_lag_1']}}
+    registry = training.registry_dir()
+    for newer in ('99990101-000000', '99990102-000000'):
+        staging = os.path.join(registry, f'.{newer}.tmp')
+        os.makedirs(os.path.join(staging, training.series_dir_name(training.DEFAULT_MODEL)))
+        training.publish(staging, newer, metas, [], 'test')
+    with open(os.path.join(registry, 'CURRENT')) as f:
+        assert f.read().strip() == '99990102-000000'
+    assert sorted(name for name in os.listdir(registry) if name != 'CURRENT') == \
+        ['99990101-000000', '99990102-000000']
+
+
+def test_stored_readings_train_like_the_csv_export(training, monkeypatch, tmp_path):
+    from timeseries_store import TimeSeriesStore
+
+    history = write_history(tmp_path / 'history.csv', devices=('esp-a', 'esp-b'))
+    history = history.drop_duplicates(['timestamp', 'device_id'])
+    history.to_csv(tmp_path / 'history.csv', index=False)
+    # The server stores readings when they arrive, a little after the step boundary
+    jitter = np.random.default_rng(8).uniform(0, 30, len(history))
+    store = TimeSeriesStore(str(tmp_path / 'solar_data'))
+    store.append_many([
+        {'timestamp': (pd.Timestamp(row.timestamp) - pd.Timestamp(0)).total_seconds() + offset,
+         'device_id': row.device_id, 'energy': row.Energy, 'power': row.power, 'temperature': row.temperature}
+        for row, offset in zip(history.itertuples(), jitter)
+    ])
+    store.flush()
+
+    monkeypatch.setattr(training, 'csv_path', str(tmp_path / 'history.csv'))
+    from_csv, csv_metas = prepared_rows(training, tmp_path / 'csv', 'all')
+    monkeypatch.setattr(training, 'TRAIN_STORE_DIR', str(tmp_path / 'solar_data'))
+    monkeypatch.setattr(training, 'CHUNK_ROWS', 64)
+    from_store, store_metas = prepared_rows(training, tmp_path / 'store', 'all')
+
+    for series in ('esp-a', 'esp-b'):
+        assert store_metas[series]['step_seconds'] == 900
+        assert store_metas[series]['features'] == csv_metas[series]['features']
+        for a, b in zip(from_csv[series], from_store[series]):
+            np.testing.assert_array_equal(np.asarray(a), np.asarray(b))
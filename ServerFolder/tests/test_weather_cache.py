@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+
+from weather_cache import WeatherCache
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class Fetcher:
+    """fetch(key) that counts calls, can be held open and fails on demand"""
+
+    def __init__(self):
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self.error = None
+
+    def __call__(self, key):
+        self.calls += 1
+        self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return {'key': key, 'n': self.calls}
+
+
+def expire(cache, key):
+    cache.peek(key).expires_at = time.time() - 1
+
+
+def test_concurrent_misses_share_one_fetch():
+    fetch = Fetcher()
+    fetch.gate.clear()
+    cache = WeatherCache(fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('cell'))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: cache.stats()['waited'] == 4)
+    fetch.gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert fetch.calls == 1
+    assert results == [{'key': 'cell', 'n': 1}] * 5
+
+
+def test_expired_value_is_served_while_revalidating():
+    fetch = Fetcher()
+    cache = WeatherCache(fetch)
+    cache.get('cell')
+    expire(cache, 'cell')
+    fetch.gate.clear()
+    assert cache.get('cell') == {'key': 'cell', 'n': 1}  # returned without waiting on the fetch
+    assert cache.get('cell') == {'key': 'cell', 'n': 1}
+    fetch.gate.set()
+    wait_until(lambda: cache.stats()['revalidated'] == 1)
+    assert fetch.calls == 2  # one background fetch for both stale reads
+    assert cache.get('cell') == {'key': 'cell', 'n': 2}
+
+
+def test_value_older_than_stale_ttl_is_refetched_inline():
+    fetch = Fetcher()
+    cache = WeatherCache(fetch, stale_ttl=60)
+    cache.get('cell')
+    cache.peek('cell').fetched_at -= 120
+    expire(cache, 'cell')
+    assert cache.get('cell') == {'key': 'cell', 'n': 2}
+
+
+def test_failed_fetch_backs_off_and_serves_stale():
+    fetch = Fetcher()
+    errors = []
+    cache = WeatherCache(fetch, error_ttl=60, on_error=lambda key, e: errors.append(key))
+    cache.get('cell')
+    expire(cache, 'cell')
+    fetch.error = OSError('open-meteo down')
+    assert cache.get('cell', force_refresh=True) == {'key': 'cell', 'n': 1}
+    assert cache.get('cell', force_refresh=True) == {'key': 'cell', 'n': 1}
+    assert fetch.calls == 2  # the second call was backed off
+    assert errors == ['cell']
+    assert cache.stats()['backing_off'] == 1
+
+
+def test_failed_fetch_without_value_raises_until_backoff_ends():
+    fetch = Fetcher()
+    fetch.error = OSError('open-meteo down')
+    cache = WeatherCache(fetch, error_ttl=60)
+    with pytest.raises(OSError):
+        cache.get('cell')
+    with pytest.raises(OSError):
+        cache.get('cell')
+    assert fetch.calls == 1
+    cache._failures['cell'] = (time.time() - 1, fetch.error)
+    fetch.error = None
+    assert cache.get('cell') == {'key': 'cell', 'n': 2}
+
+
+def test_refresh_ahead_refetches_entries_close_to_expiry():
+    fetch = Fetcher()
+    cache = WeatherCache(fetch, refresh_ahead=300)
+    cache.get('soon')
+    cache.get('later')
+    cache.peek('soon').expires_at = time.time() + 100
+    assert cache.refresh_ahead() == 1
+    assert fetch.calls == 3
+    assert cache.get('soon') == {'key': 'soon', 'n': 3}
+
+
+def test_refresh_ahead_skips_keys_backing_off():
+    fetch = Fetcher()
+    cache = WeatherCache(fetch, refresh_ahead=300, error_ttl=60)
+    cache.get('cell')
+    cache.peek('cell').expires_at = time.time() + 100
+    cache.failed('cell', OSError('open-meteo down'))
+    assert cache.refresh_ahead() == 0
+    assert fetch.calls == 1
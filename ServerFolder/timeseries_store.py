@@ -0,0 +1,761 @@
+"""Append-only time-series storage for solar readings.
+
+Layout under ``root``::
+
+    meta.json              column schema of the segment files
+    strings.log            dictionary for string columns (line N holds code N)
+    segments/2025-01-31.seg  fixed-width binary records for one UTC day
+    gaps.log               (start, end, device) intervals without readings
+
+Each record is a packed NumPy structured row (float64 timestamp and
+measurements, int8 relay state, uint16 codes for strings such as device_id
+and alert texts), so appending a reading is a single ``write`` at the end of
+the day's file and reading a time range memory-maps only the days it covers.
+Rows are buffered in memory and flushed by size (``flush_rows``) or age
+(``flush_interval``). Periods without readings are kept as interval records
+(``GapLog``) rather than NaN rows; ``resample.read_grid`` builds a regular
+grid for a window when one is needed.
+"""
+import csv
+import io
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+SECONDS_PER_DAY = 86400
+
+# (name, kind) - kind is 'f' float64, 'i' int8 or 's' dictionary-encoded string
+DEFAULT_COLUMNS = [
+    ('device_id', 's'),
+    ('box_temp', 'f'), ('frequency', 'f'), ('power_factor', 'f'),
+    ('voltage', 'f'), ('current', 'f'), ('power', 'f'), ('energy', 'f'),
+    ('solar_voltage', 'f'), ('solar_current', 'f'), ('solar_power', 'f'),
+    ('battery_percentage', 'f'), ('light_intensity', 'f'), ('battery_voltage', 'f'),
+    ('temperature', 'f'), ('humidity', 'f'), ('cloud_cover', 'f'),
+    ('wind_speed', 'f'), ('precipitation', 'f'), ('weather_code', 'f'),
+    ('alert1', 's'), ('alert2', 's'), ('alert3', 's'), ('alert4', 's'),
+    ('alert5', 's'), ('alert6', 's'), ('alert7', 's'), ('alert8', 's'),
+    ('nonessentialrelaystate', 'i'), ('data_source', 's'),
+]
+
+_KIND_DTYPES = {'f': '<f8', 'i': 'i1', 's': '<u2'}
+_GAP_DTYPE = np.dtype([('start', '<f8'), ('end', '<f8'), ('device_id', '<u2')])
+
+
+def to_epoch(value):
+    """ISO string, datetime or number -> epoch seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+
+
+def day_of(ts):
+    """UTC day name ('YYYY-MM-DD') of an epoch timestamp"""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+class TimeSeriesStore:
+    """Buffered, day-partitioned columnar store; safe for threads and worker processes"""
+
+    def __init__(self, root, columns=None, flush_rows=500, flush_interval=5.0):
+        self.root = root
+        self.columns = list(columns or DEFAULT_COLUMNS)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.kinds = dict(self.columns)
+        self.dtype = np.dtype(
+            [('timestamp', '<f8')] + [(name, _KIND_DTYPES[kind]) for name, kind in self.columns]
+        )
+        self.segment_dir = os.path.join(root, 'segments')
+        self._strings_path = os.path.join(root, 'strings.log')
+        self._strings = []
+        self._codes = {}
+        self._buffer = []
+        self._index = {}
+        self._stats_path = os.path.join(root, 'stats.json')
+        self._stats_cache = None
+        self._pending_stats = StoreStats()
+        self._last_flush = time.time()
+        self._lock = threading.RLock()
+
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self._check_meta()
+        self._load_strings()
+        self.gaps = GapLog(os.path.join(root, 'gaps.log'), self)
+        if not os.path.exists(self._stats_path):
+            self._rebuild_stats()
+
+    # ----- schema / string dictionary -----
+    def _check_meta(self):
+        meta_path = os.path.join(self.root, 'meta.json')
+        meta = {'version': 1, 'columns': [[name, kind] for name, kind in self.columns]}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                existing = json.load(f)
+            if existing.get('columns') != meta['columns']:
+                raise ValueError(f"Storage schema in {self.root} does not match the configured columns")
+        else:
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f, indent=2)
+
+    def _load_strings(self):
+        if not os.path.exists(self._strings_path):
+            return
+        with open(self._strings_path, encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        # The last element is '' or a line another worker is still writing
+        for line in lines[len(self._strings):-1]:
+            value = json.loads(line)
+            self._strings.append(value)
+            self._codes[value] = len(self._strings)
+
+    def encode_string(self, value):
+        """String -> uint16 code (0 for None / empty), adding it to the dictionary if new"""
+        if value is None or value == '' or (isinstance(value, float) and math.isnan(value)):
+            return 0
+        value = str(value)
+        code = self._codes.get(value)
+        if code is not None:
+            return code
+        with self._lock, open(self._strings_path, 'a+', encoding='utf-8') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            # Another worker may have added strings since we last looked
+            self._load_strings()
+            code = self._codes.get(value)
+            if code is None:
+                if len(self._strings) >= 65535:
+                    raise ValueError("String dictionary is full")
+                f.write(json.dumps(value) + '\n')
+                f.flush()
+                self._strings.append(value)
+                code = self._codes[value] = len(self._strings)
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return code
+
+    def decode_strings(self, codes):
+        """Array of codes -> object array of strings (None for code 0)"""
+        if len(codes) and int(codes.max()) > len(self._strings):
+            with self._lock:
+                self._load_strings()
+        lookup = np.array([None] + self._strings, dtype=object)
+        return lookup[codes]
+
+    # ----- write path -----
+    def _to_record(self, row):
+        record = [to_epoch(row['timestamp'])]
+        for name, kind in self.columns:
+            value = row.get(name)
+            if kind == 's':
+                record.append(self.encode_string(value))
+            elif kind == 'i':
+                try:
+                    record.append(int(float(value)))
+                except (TypeError, ValueError):
+                    record.append(0)
+            else:
+                try:
+                    record.append(float(value) if value not in (None, '') else np.nan)
+                except (TypeError, ValueError):
+                    record.append(np.nan)
+        return tuple(record)
+
+    def append(self, row):
+        """Buffer one row (dict with 'timestamp' + column values)"""
+        self.append_many([row])
+
+    def append_many(self, rows):
+        records = [self._to_record(row) for row in rows]
+        with self._lock:
+            self._buffer.extend(records)
+            self._pending_stats.update(np.array(records, dtype=self.dtype), self)
+            due = len(self._buffer) >= self.flush_rows
+        if due:
+            self.flush()
+
+    def flush_if_due(self):
+        """Flush when the oldest buffered row is older than flush_interval"""
+        if self._buffer and time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+        self.gaps.flush_if_due()
+
+    def flush(self):
+        """Write buffered rows to their day segments (one append per day)"""
+        self.gaps.flush()
+        with self._lock:
+            records, self._buffer = self._buffer, []
+            pending, self._pending_stats = self._pending_stats, StoreStats()
+            self._last_flush = time.time()
+            if not records:
+                return 0
+            array = np.array(records, dtype=self.dtype)
+            days = (array['timestamp'] // SECONDS_PER_DAY).astype(np.int64)
+            for day in np.unique(days):
+                chunk = array[days == day]
+                # Keep segments time-ordered where possible so reads can binary search
+                chunk = chunk[np.argsort(chunk['timestamp'], kind='stable')]
+                path = self.segment_path(day_of(float(day) * SECONDS_PER_DAY))
+                with open(path, 'ab') as f:
+                    f.write(chunk.tobytes())
+            self._persist_stats(pending)
+            return len(records)
+
+    # ----- statistics -----
+    def _persist_stats(self, delta):
+        """Merge a stats delta into stats.json (read-modify-write under a file lock)"""
+        with open(self._stats_path + '.lock', 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            stats = self._read_stats_file()
+            if stats is None:
+                # Segments already include the rows being flushed
+                stats = self._scan_stats()
+            else:
+                stats.merge(delta)
+            tmp_path = self._stats_path + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(stats.to_dict(), f)
+            os.replace(tmp_path, self._stats_path)
+            self._stats_cache = (os.stat(self._stats_path).st_mtime_ns, stats)
+
+    def _read_stats_file(self):
+        if not os.path.exists(self._stats_path):
+            return None
+        with open(self._stats_path) as f:
+            return StoreStats.from_dict(json.load(f))
+
+    def _rebuild_stats(self):
+        """Build stats.json from the segments once (data written before stats existed)"""
+        with open(self._stats_path + '.lock', 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self._stats_path):
+                return
+            with open(self._stats_path, 'w') as f:
+                json.dump(self._scan_stats().to_dict(), f)
+
+    def _scan_stats(self):
+        stats = StoreStats()
+        for day in self.days():
+            stats.update(self.load_segment(day), self)
+        return stats
+
+    def stats(self):
+        """Running totals for everything stored, including unflushed rows (no data scan)"""
+        mtime = os.stat(self._stats_path).st_mtime_ns if os.path.exists(self._stats_path) else None
+        cached = self._stats_cache
+        if cached is None or cached[0] != mtime:
+            # Another worker flushed since we last looked
+            cached = self._stats_cache = (mtime, self._read_stats_file() or StoreStats())
+        stats = StoreStats()
+        stats.merge(cached[1])
+        with self._lock:
+            stats.merge(self._pending_stats)
+        return stats
+
+    # ----- read path -----
+    def segment_path(self, day):
+        return os.path.join(self.segment_dir, f'{day}.seg')
+
+    def days(self, start=None, end=None):
+        """Sorted day names that may hold rows in [start, end]"""
+        names = sorted(name[:-4] for name in os.listdir(self.segment_dir) if name.endswith('.seg'))
+        if start is not None:
+            first = day_of(start)
+            names = [name for name in names if name >= first]
+        if end is not None:
+            last = day_of(end)
+            names = [name for name in names if name <= last]
+        return names
+
+    def load_segment(self, day):
+        """Memory-map one day's records (ignores a torn trailing record)"""
+        path = self.segment_path(day)
+        count = os.path.getsize(path) // self.dtype.itemsize
+        if count == 0:
+            return np.empty(0, dtype=self.dtype)
+        return np.memmap(path, dtype=self.dtype, mode='r', shape=(count,))
+
+    def segment_info(self, day):
+        """Index entry (count, min/max timestamp, sorted flag) for one day.
+
+        Entries are cached per file size and extended with only the records
+        appended since the last look, so keeping the index current is O(new rows).
+        """
+        path = self.segment_path(day)
+        count = os.path.getsize(path) // self.dtype.itemsize if os.path.exists(path) else 0
+        old = self._index.get(day)
+        if old is not None and old.count == count:
+            return old
+        if old is None or old.count > count:
+            old = _SegmentInfo()
+        info = _SegmentInfo(old.count, old.min_ts, old.max_ts, old.sorted)
+        if count > old.count:
+            new = self.load_segment(day)['timestamp'][old.count:count]
+            new_sorted = bool(np.all(new[1:] >= new[:-1])) and (old.count == 0 or new[0] >= old.max_ts)
+            info.sorted = old.sorted and new_sorted
+            info.min_ts = min(old.min_ts, float(new.min()))
+            info.max_ts = max(old.max_ts, float(new.max()))
+            info.count = count
+        self._index[day] = info
+        return info
+
+    def _buffered(self):
+        with self._lock:
+            return np.array(self._buffer, dtype=self.dtype)
+
+    def _device_code(self, device_id):
+        code = self._codes.get(str(device_id))
+        if code is None:
+            with self._lock:
+                self._load_strings()
+            code = self._codes.get(str(device_id), -1)
+        return code
+
+    def _day_records(self, day, info, start, end, buffered):
+        """Sorted records of one day within [start, end], including unflushed rows"""
+        parts = []
+        needs_sort = False
+        if info is not None:
+            if info.count and not ((start is not None and info.max_ts < start)
+                                   or (end is not None and info.min_ts > end)):
+                segment = self.load_segment(day)[:info.count]
+                if info.sorted:
+                    # Binary search the time window; only those pages are touched
+                    lo = 0 if start is None else int(np.searchsorted(segment['timestamp'], start, 'left'))
+                    hi = info.count if end is None else int(np.searchsorted(segment['timestamp'], end, 'right'))
+                    parts.append(np.asarray(segment[lo:hi]))
+                else:
+                    parts.append(np.asarray(segment[_time_mask(segment['timestamp'], start, end)]))
+                    needs_sort = True
+        if len(buffered):
+            parts.append(buffered[_time_mask(buffered['timestamp'], start, end)])
+            needs_sort = True
+        if not parts:
+            return np.empty(0, dtype=self.dtype)
+        records = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        if needs_sort:
+            records = records[np.argsort(records['timestamp'], kind='stable')]
+        return records
+
+    def _snapshot(self, start, end):
+        """Days to visit, their index entries and unflushed rows grouped by day.
+
+        Buffer and segment sizes are captured together so a concurrent flush
+        cannot make rows appear twice (or not at all).
+        """
+        with self._lock:
+            buffered = self._buffered()
+            infos = {day: self.segment_info(day) for day in self.days(start, end)}
+        buffer_day_numbers = buffered['timestamp'] // SECONDS_PER_DAY
+        buffered_by_day = {
+            day_of(float(number) * SECONDS_PER_DAY): buffered[buffer_day_numbers == number]
+            for number in np.unique(buffer_day_numbers)
+        }
+        days = sorted(set(infos) | {
+            day for day in buffered_by_day
+            if (start is None or day >= day_of(start)) and (end is None or day <= day_of(end))
+        })
+        return days, infos, buffered_by_day
+
+    def iter_chunks(self, start=None, end=None, device_id=None, columns=None, chunk_rows=5000):
+        """Yield decoded column dicts of at most ``chunk_rows`` rows in time order.
+
+        Sorted segments are sliced straight from the memory map, so memory use
+        is bounded by one chunk (one day for unsorted days) whatever the history size.
+        """
+        days, infos, buffered_by_day = self._snapshot(start, end)
+        device_code = None if device_id is None else self._device_code(device_id)
+        for day in days:
+            info = infos.get(day)
+            buffered = buffered_by_day.get(day, ())
+            if info is not None and info.sorted and not len(buffered):
+                segment = self.load_segment(day)[:info.count]
+                lo = 0 if start is None else int(np.searchsorted(segment['timestamp'], start, 'left'))
+                hi = info.count if end is None else int(np.searchsorted(segment['timestamp'], end, 'right'))
+            else:
+                segment = self._day_records(day, info, start, end, buffered)
+                lo, hi = 0, len(segment)
+            for offset in range(lo, hi, chunk_rows):
+                records = np.asarray(segment[offset:min(offset + chunk_rows, hi)])
+                if device_code is not None:
+                    records = records[records['device_id'] == device_code]
+                if len(records):
+                    yield self.decode(records, columns)
+
+    def query(self, start=None, end=None, device_id=None, limit=None, cursor=None):
+        """Records in [start, end] sorted by time, one page at a time.
+
+        ``cursor`` is the ``next_cursor`` returned by the previous page. Returns
+        ``(records, next_cursor)``; next_cursor is None on the last page.
+        """
+        skip = 0
+        if cursor:
+            cursor_ts, skip = parse_cursor(cursor)
+            if start is not None and start > cursor_ts:
+                skip = 0
+            start = cursor_ts if start is None else max(start, cursor_ts)
+        days, infos, buffered_by_day = self._snapshot(start, end)
+        device_code = None if device_id is None else self._device_code(device_id)
+        skip_at_start = skip
+
+        pages = []
+        collected = 0
+        for day in days:
+            records = self._day_records(day, infos.get(day), start, end, buffered_by_day.get(day, ()))
+            if device_code is not None:
+                records = records[records['device_id'] == device_code]
+            if skip:
+                # Drop rows already returned at the cursor timestamp
+                at_cursor = int(np.searchsorted(records['timestamp'], start, 'right'))
+                records = records[min(skip, at_cursor):]
+                skip = 0
+            pages.append(records)
+            collected += len(records)
+            if limit is not None and collected > limit:
+                break
+
+        records = np.concatenate(pages) if pages else np.empty(0, dtype=self.dtype)
+        if limit is None or len(records) <= limit:
+            return records, None
+        records = records[:limit]
+        last_ts = float(records['timestamp'][-1])
+        repeated = int(np.count_nonzero(records['timestamp'] == last_ts))
+        if cursor and last_ts == start:
+            repeated += skip_at_start
+        return records, make_cursor(last_ts, repeated)
+
+    def read_records(self, start=None, end=None, device_id=None):
+        """Raw records in [start, end] (epoch seconds) sorted by timestamp"""
+        return self.query(start, end, device_id)[0]
+
+    def read(self, start=None, end=None, columns=None, device_id=None):
+        """Dict of column arrays (strings decoded) for rows in [start, end]"""
+        records = self.read_records(start, end, device_id)
+        return self.decode(records, columns)
+
+    def decode(self, records, columns=None):
+        names = ['timestamp'] + [name for name, _ in self.columns]
+        if columns:
+            names = ['timestamp'] + [name for name in columns if name in self.kinds]
+        result = {}
+        for name in names:
+            if self.kinds.get(name) == 's':
+                result[name] = self.decode_strings(records[name])
+            else:
+                result[name] = np.asarray(records[name])
+        return result
+
+    def count(self):
+        total = sum(os.path.getsize(self.segment_path(day)) // self.dtype.itemsize for day in self.days())
+        return total + len(self._buffer)
+
+    # ----- CSV compatibility -----
+    def iter_csv(self, headers, start=None, end=None, device_id=None, chunk_rows=5000):
+        """Yield CSV text (header first, then one block per chunk) with ISO local timestamps"""
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(headers)
+        for data in self.iter_chunks(start, end, device_id, chunk_rows=chunk_rows):
+            count = len(data['timestamp'])
+            timestamps = [datetime.fromtimestamp(ts).isoformat() for ts in data['timestamp'].tolist()]
+            columns = [
+                timestamps if name == 'timestamp' else _csv_values(data.get(name), count)
+                for name in headers
+            ]
+            writer.writerows(zip(*columns))
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+        if out.tell():
+            yield out.getvalue()
+
+    def export_csv(self, fileobj, headers, start=None, end=None, device_id=None):
+        """Write rows as CSV with the given header order"""
+        for text in self.iter_csv(headers, start, end, device_id):
+            fileobj.write(text)
+
+    def import_csv_once(self, path):
+        """Import a legacy CSV exactly once, even with several workers starting together"""
+        marker = os.path.join(self.root, 'legacy_import.done')
+        with open(os.path.join(self.root, 'legacy_import.lock'), 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(marker) or not os.path.exists(path):
+                return 0
+            imported = self.import_csv(path)
+            with open(marker, 'w') as f:
+                f.write(f'{path}\t{imported}\n')
+            return imported
+
+    def import_csv(self, path):
+        """Load an old solar_data.csv into the store; returns the number of rows"""
+        with open(path, newline='') as f:
+            rows = [row for row in csv.DictReader(f) if row.get('timestamp')]
+        for row in rows:
+            if not row.get('data_source'):
+                row['data_source'] = 'esp32_live'
+            if row.get('nonessentialrelaystate') in (None, ''):
+                row['nonessentialrelaystate'] = 1
+        records = [self._to_record(row) for row in rows]
+        with self._lock:
+            self._buffer.extend(records)
+            self._pending_stats.update(np.array(records, dtype=self.dtype), self)
+        self.flush()
+        return len(rows)
+
+
+class StoreStats:
+    """Running counters kept on every write: totals, data sources, nulls, time range, per day"""
+
+    def __init__(self):
+        self.total_records = 0
+        self.data_sources = {}
+        self.null_counts = {}
+        self.min_ts = None
+        self.max_ts = None
+        self.daily = {}
+
+    def update(self, records, store):
+        """Add a structured array of records (vectorized)"""
+        if not len(records):
+            return
+        self.total_records += len(records)
+        has_source = 'data_source' in store.kinds
+        if has_source:
+            codes, counts = np.unique(records['data_source'], return_counts=True)
+            for name, count in zip(store.decode_strings(codes), counts.tolist()):
+                name = name or 'unknown'
+                self.data_sources[name] = self.data_sources.get(name, 0) + count
+        for name, kind in store.columns:
+            column = records[name]
+            nulls = int(np.count_nonzero(np.isnan(column))) if kind == 'f' else (
+                int(np.count_nonzero(column == 0)) if kind == 's' else 0)
+            self.null_counts[name] = self.null_counts.get(name, 0) + nulls
+        timestamps = records['timestamp']
+        low, high = float(timestamps.min()), float(timestamps.max())
+        self.min_ts = low if self.min_ts is None else min(self.min_ts, low)
+        self.max_ts = high if self.max_ts is None else max(self.max_ts, high)
+
+        day_numbers = (timestamps // SECONDS_PER_DAY).astype(np.int64)
+        if has_source:
+            missing = records['data_source'] == store._codes.get('missing_data', -1)
+        else:
+            missing = np.zeros(len(records), dtype=bool)
+        for number in np.unique(day_numbers).tolist():
+            in_day = day_numbers == number
+            day = self.daily.setdefault(day_of(number * SECONDS_PER_DAY), {'records': 0, 'missing_data': 0})
+            day['records'] += int(np.count_nonzero(in_day))
+            day['missing_data'] += int(np.count_nonzero(in_day & missing))
+
+    def merge(self, other):
+        self.total_records += other.total_records
+        for name, count in other.data_sources.items():
+            self.data_sources[name] = self.data_sources.get(name, 0) + count
+        for name, count in other.null_counts.items():
+            self.null_counts[name] = self.null_counts.get(name, 0) + count
+        if other.min_ts is not None:
+            self.min_ts = other.min_ts if self.min_ts is None else min(self.min_ts, other.min_ts)
+            self.max_ts = other.max_ts if self.max_ts is None else max(self.max_ts, other.max_ts)
+        for name, counts in other.daily.items():
+            day = self.daily.setdefault(name, {'records': 0, 'missing_data': 0})
+            for key, value in counts.items():
+                day[key] = day.get(key, 0) + value
+
+    def to_dict(self):
+        return {
+            'total_records': self.total_records,
+            'data_sources': self.data_sources,
+            'null_counts': self.null_counts,
+            'min_ts': self.min_ts,
+            'max_ts': self.max_ts,
+            'daily': self.daily,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.total_records = data.get('total_records', 0)
+        stats.data_sources = dict(data.get('data_sources', {}))
+        stats.null_counts = dict(data.get('null_counts', {}))
+        stats.min_ts = data.get('min_ts')
+        stats.max_ts = data.get('max_ts')
+        stats.daily = {name: dict(counts) for name, counts in data.get('daily', {}).items()}
+        return stats
+
+
+class GapLog:
+    """Periods without readings, stored as (start, end, device) interval records.
+
+    Consecutive marks that touch extend one open interval in memory until
+    ``close`` (the device reports again); closed intervals are appended on the
+    next flush and a still-open one at most every ``persist_interval`` seconds
+    (re-written with a later end as it grows), so an offline device costs a
+    few bytes instead of a NaN row per check. Overlapping records are merged
+    on read.
+    """
+
+    def __init__(self, path, store, persist_interval=300.0, tolerance=1.0):
+        self.path = path
+        self.store = store
+        self.persist_interval = persist_interval
+        self.tolerance = tolerance
+        self._open = {}  # device code -> [start, end, end already written]
+        self._closed = []
+        self._last_persist = time.time()
+        self._lock = threading.Lock()
+
+    def mark(self, start, end, device_id=None):
+        """Record that no readings arrived in [start, end] (device_id None: from any device).
+
+        Returns True if this opened a new gap, False if it extended the open one.
+        """
+        code = self.store.encode_string(device_id)
+        start, end = to_epoch(start), to_epoch(end)
+        with self._lock:
+            current = self._open.get(code)
+            if current is not None and current[0] - self.tolerance <= start <= current[1] + self.tolerance:
+                current[1] = max(current[1], end)
+                return False
+            if current is not None and current[2] != current[1]:
+                self._closed.append((current[0], current[1], code))
+            self._open[code] = [start, end, None]
+            return True
+
+    def close(self, device_id=None):
+        """End the open gap of a device that reports again; returns its (start, end) or None"""
+        code = self.store.encode_string(device_id)
+        with self._lock:
+            current = self._open.pop(code, None)
+            if current is None:
+                return None
+            if current[2] != current[1]:
+                self._closed.append((current[0], current[1], code))
+            return current[0], current[1]
+
+    def flush_if_due(self):
+        """Write closed intervals; open ones only every persist_interval"""
+        self.flush(include_open=time.time() - self._last_persist >= self.persist_interval)
+
+    def flush(self, include_open=True):
+        with self._lock:
+            records, self._closed = self._closed, []
+            if include_open:
+                self._last_persist = time.time()
+                for code, current in self._open.items():
+                    if current[2] != current[1]:
+                        records.append((current[0], current[1], code))
+                        current[2] = current[1]
+            if not records:
+                return 0
+            with open(self.path, 'ab') as f:
+                f.write(np.array(records, dtype=_GAP_DTYPE).tobytes())
+            return len(records)
+
+    def _records(self):
+        records = np.empty(0, dtype=_GAP_DTYPE)
+        if os.path.exists(self.path):
+            records = np.fromfile(self.path, dtype=_GAP_DTYPE, count=os.path.getsize(self.path) // _GAP_DTYPE.itemsize)
+        with self._lock:
+            unwritten = self._closed + [(start, end, code) for code, (start, end, _) in self._open.items()]
+        if unwritten:
+            records = np.concatenate([records, np.array(unwritten, dtype=_GAP_DTYPE)])
+        return records
+
+    def read(self, start=None, end=None, device_id=None):
+        """Merged intervals overlapping [start, end], clipped to it, as column arrays"""
+        records = self._records()
+        if device_id is not None:
+            # Gaps recorded without a device (nothing arrived at all) apply to every device
+            records = records[np.isin(records['device_id'], [0, self.store._device_code(device_id)])]
+        records = records[_overlap_mask(records, start, end)]
+        records = records[np.lexsort((records['start'], records['device_id']))]
+        merged = []
+        for code in np.unique(records['device_id']):
+            group = records[records['device_id'] == code]
+            reach = np.maximum.accumulate(group['end'])
+            # A record starts a new interval when it begins after everything before it ended
+            first = np.ones(len(group), dtype=bool)
+            first[1:] = group['start'][1:] > reach[:-1] + self.tolerance
+            starts = np.flatnonzero(first)
+            ends = np.append(starts[1:], len(group)) - 1
+            merged.append(np.array(list(zip(group['start'][starts], reach[ends], [code] * len(starts))),
+                                   dtype=_GAP_DTYPE))
+        records = np.concatenate(merged) if merged else np.empty(0, dtype=_GAP_DTYPE)
+        records = records[np.argsort(records['start'], kind='stable')]
+        starts, ends = records['start'].copy(), records['end'].copy()
+        if start is not None:
+            np.maximum(starts, start, out=starts)
+        if end is not None:
+            np.minimum(ends, end, out=ends)
+        return {'start': starts, 'end': ends, 'device_id': self.store.decode_strings(records['device_id'])}
+
+    def summary(self, start=None, end=None, device_id=None):
+        """Number of gaps and seconds without readings"""
+        gaps = self.read(start, end, device_id)
+        return {'intervals': len(gaps['start']), 'missing_seconds': float(np.sum(gaps['end'] - gaps['start']))}
+
+
+class _SegmentInfo:
+    __slots__ = ('count', 'min_ts', 'max_ts', 'sorted')
+
+    def __init__(self, count=0, min_ts=math.inf, max_ts=-math.inf, sorted=True):
+        self.count = count
+        self.min_ts = min_ts
+        self.max_ts = max_ts
+        self.sorted = sorted
+
+
+def make_cursor(ts, skip):
+    """Pagination cursor: resume at timestamp ``ts`` after ``skip`` rows with that timestamp"""
+    return f'{ts!r}:{skip}'
+
+
+def parse_cursor(cursor):
+    try:
+        ts, skip = str(cursor).split(':')
+        ts, skip = float(ts), int(skip)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not math.isfinite(ts) or skip < 0:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return ts, skip
+
+
+def _time_mask(timestamps, start, end):
+    mask = np.ones(len(timestamps), dtype=bool)
+    if start is not None:
+        mask &= timestamps >= start
+    if end is not None:
+        mask &= timestamps <= end
+    return mask
+
+
+def _overlap_mask(records, start, end):
+    mask = np.ones(len(records), dtype=bool)
+    if start is not None:
+        mask &= records['end'] >= start
+    if end is not None:
+        mask &= records['start'] <= end
+    return mask
+
+
+def _csv_values(values, count):
+    if values is None:
+        return [''] * count
+    if values.dtype == object:
+        return ['' if value is None else value for value in values]
+    return ['' if value != value else value for value in values.tolist()]
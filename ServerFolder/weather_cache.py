@@ -0,0 +1,372 @@
+"""Weather cache shared by all request threads (and optionally all workers).
+
+* single-flight: concurrent misses for the same key wait for one fetch
+* refresh-ahead: ``refresh_ahead()`` (run from the scheduler) re-fetches keys
+  that are about to expire, so requests normally never wait on Open-Meteo
+* stale-while-revalidate: an expired value younger than ``stale_ttl`` is
+  returned at once and re-fetched on a background thread; only a key with
+  no usable value makes the caller wait for a fetch
+* error backoff: after a failed fetch a key is not fetched again for
+  ``error_ttl`` seconds (the stale value or the last error is served), so an
+  Open-Meteo outage costs one attempt - and one ``on_error`` call - per window
+* optional SQLite backend: gunicorn workers share fetched values and take a
+  lease before fetching, so there is one fetch per key per expiry
+* LRU eviction of the in-memory entries beyond ``max_entries``
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class _Entry:
+    __slots__ = ('value', 'fetched_at', 'expires_at', 'last_access')
+
+    def __init__(self, value, fetched_at, expires_at):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.expires_at = expires_at
+        self.last_access = time.time()
+
+
+class _Flight:
+    """One in-progress fetch that other threads can wait on"""
+    __slots__ = ('done', 'entry', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class SQLiteBackend:
+    """Values and fetch leases in one small SQLite file shared between processes"""
+
+    def __init__(self, path, lease_seconds=30):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                       'key TEXT PRIMARY KEY, value TEXT, fetched_at REAL, expires_at REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS leases ('
+                       'key TEXT PRIMARY KEY, owner TEXT, until REAL)')
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        return _Closing(db)
+
+    def get(self, key):
+        with self._connect() as db:
+            row = db.execute('SELECT value, fetched_at, expires_at FROM entries WHERE key = ?',
+                             (key,)).fetchone()
+        if row is None:
+            return None
+        return _Entry(json.loads(row[0]), row[1], row[2])
+
+    def put(self, key, entry):
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                       (key, json.dumps(entry.value), entry.fetched_at, entry.expires_at))
+
+    def acquire(self, key):
+        """Take the fetch lease for a key unless another process holds a live one"""
+        now = time.time()
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT owner, until FROM leases WHERE key = ?', (key,)).fetchone()
+            if row and row[0] != self.owner and row[1] > now:
+                db.execute('ROLLBACK')
+                return False
+            db.execute('INSERT OR REPLACE INTO leases VALUES (?, ?, ?)',
+                       (key, self.owner, now + self.lease_seconds))
+            db.execute('COMMIT')
+        return True
+
+    def release(self, key):
+        with self._connect() as db:
+            db.execute('DELETE FROM leases WHERE key = ? AND owner = ?', (key, self.owner))
+
+
+class _Closing:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.close()
+        return False
+
+
+class WeatherCache:
+    """Keyed cache around a blocking ``fetch(key)`` function.
+
+    ``expires_for(key, value, fetched_at)`` may be given to compute the expiry
+    time of a fresh value (e.g. aligned to the top of the hour); by default a
+    value lives ``ttl`` seconds.
+    """
+
+    def __init__(self, fetch, ttl=3600, refresh_ahead=300, stale_ttl=6 * 3600,
+                 max_entries=256, backend=None, expires_for=None, on_error=None,
+                 wait_timeout=20, error_ttl=60):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.refresh_margin = refresh_ahead
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self.backend = backend
+        self.expires_for = expires_for or (lambda key, value, fetched_at: fetched_at + self.ttl)
+        self.on_error = on_error
+        self.wait_timeout = wait_timeout
+
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._failures = {}  # key -> (no fetch before this time, last error)
+        self._revalidating = set()  # keys being re-fetched in the background
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'shared_hits': 0, 'fetches': 0,
+                          'errors': 0, 'stale_served': 0, 'waited': 0, 'refreshed_ahead': 0,
+                          'revalidated': 0, 'backed_off': 0, 'evicted': 0}
+
+    # ----- lookups -----
+    def get(self, key, force_refresh=False):
+        """Value for key; blocks on a fetch only when nothing usable is cached. Raises if nothing usable exists"""
+        now = time.time()
+        if not force_refresh:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and now - entry.fetched_at < self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    entry.last_access = now
+                    if entry.expires_at > now:
+                        self._counters['hits'] += 1
+                        return entry.value
+                    self._counters['stale_served'] += 1
+                else:
+                    entry = None
+                    self._counters['misses'] += 1
+            if entry is not None:
+                self._revalidate_later(key)
+                return entry.value
+        error = self.backoff_error(key)
+        if error is not None:
+            stale = self.stale(key, error)
+            if stale is not None:
+                return stale
+            raise error
+        try:
+            return self._load(key, float('inf') if force_refresh else now).value
+        except Exception as e:
+            stale = self.stale(key, e)
+            if stale is not None:
+                return stale
+            raise
+
+    def peek(self, key):
+        """Entry for key regardless of age (None if never fetched)"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None and self.backend is not None:
+            entry = self.backend.get(key)
+        return entry
+
+    def stale(self, key, error):
+        """Last value of key if younger than stale_ttl (after a failed fetch), else None"""
+        now = time.time()
+        entry = self.peek(key)
+        if entry is None or now - entry.fetched_at >= self.stale_ttl:
+            return None
+        with self._lock:
+            self._counters['stale_served'] += 1
+        print(f"⚠️ Serving stale weather for {key} ({int(now - entry.fetched_at)}s old): {error}")
+        return entry.value
+
+    # ----- externally fetched values (asyncio callers, see async_app.py) -----
+    def cached(self, key, shared=False):
+        """Fresh value for key without fetching, None on a miss (shared: also the backend)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                entry.last_access = now
+                self._counters['hits'] += 1
+                return entry.value
+        if shared and self.backend is not None:
+            entry = self.backend.get(key)
+            if entry is not None and entry.expires_at > now:
+                with self._lock:
+                    self._counters['shared_hits'] += 1
+                return self._store(key, entry).value
+        with self._lock:
+            self._counters['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        """Store a value fetched by the caller (shared through the backend too)"""
+        fetched_at = time.time()
+        entry = _Entry(value, fetched_at, self.expires_for(key, value, fetched_at))
+        with self._lock:
+            self._counters['fetches'] += 1
+        if self.backend is not None:
+            self.backend.put(key, entry)
+        return self._store(key, entry).value
+
+    def stale_value(self, key):
+        """Expired in-memory value of key younger than stale_ttl (to serve while revalidating), else None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at > now or now - entry.fetched_at >= self.stale_ttl:
+                return None
+            entry.last_access = now
+            self._counters['stale_served'] += 1
+            return entry.value
+
+    def backoff_error(self, key):
+        """Last error of key while it is backing off after a failed fetch, else None"""
+        with self._lock:
+            failure = self._failures.get(key)
+            if failure is None or failure[0] <= time.time():
+                return None
+            self._counters['backed_off'] += 1
+            return failure[1]
+
+    def failed(self, key, error):
+        """Record a fetch the caller made itself that failed (starts the error backoff)"""
+        with self._lock:
+            self._counters['errors'] += 1
+            self._failures[key] = (time.time() + self.error_ttl, error)
+        if self.on_error:
+            self.on_error(key, error)
+
+    def _load(self, key, min_expiry):
+        """Fetch key once for all waiting threads; shared values expiring after min_expiry are reused"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self._counters['waited'] += 1
+        if not leader:
+            if not flight.done.wait(self.wait_timeout):
+                raise TimeoutError(f"weather fetch for {key} still running")
+            if flight.error is not None:
+                raise flight.error
+            return flight.entry
+
+        try:
+            flight.entry = self._fetch_shared(key, min_expiry)
+            return flight.entry
+        except Exception as e:
+            flight.error = e
+            self.failed(key, e)
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _fetch_shared(self, key, min_expiry):
+        backend = self.backend
+        if backend is None:
+            return self._store(key, self._fetch(key))
+        shared = backend.get(key)
+        if shared is not None and shared.expires_at > min_expiry:
+            with self._lock:
+                self._counters['shared_hits'] += 1
+            return self._store(key, shared)
+        # Another worker is fetching: wait for its result instead of fetching too
+        deadline = time.time() + backend.lease_seconds
+        while not backend.acquire(key):
+            time.sleep(0.2)
+            shared = backend.get(key)
+            if shared is not None and shared.expires_at > min_expiry:
+                with self._lock:
+                    self._counters['shared_hits'] += 1
+                return self._store(key, shared)
+            if time.time() > deadline:
+                break
+        try:
+            entry = self._fetch(key)
+            backend.put(key, entry)
+        finally:
+            backend.release(key)
+        return self._store(key, entry)
+
+    def _fetch(self, key):
+        with self._lock:
+            self._counters['fetches'] += 1
+        value = self.fetch(key)
+        fetched_at = time.time()
+        return _Entry(value, fetched_at, self.expires_for(key, value, fetched_at))
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._failures.pop(key, None)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                entry.last_access = old.last_access
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evicted'] += 1
+        return entry
+
+    # ----- background refresh -----
+    def _revalidate_later(self, key):
+        """Re-fetch an expired key on a background thread (one at a time, not while backing off)"""
+        with self._lock:
+            failure = self._failures.get(key)
+            if key in self._revalidating or key in self._flights or (failure and failure[0] > time.time()):
+                return
+            self._revalidating.add(key)
+        threading.Thread(target=self._revalidate, args=(key,), name='weather-revalidate', daemon=True).start()
+
+    def _revalidate(self, key):
+        try:
+            self._load(key, time.time())
+            with self._lock:
+                self._counters['revalidated'] += 1
+        except Exception as e:
+            print(f"⚠️ Weather revalidation failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._revalidating.discard(key)
+
+    def refresh_ahead(self):
+        """Re-fetch entries that expire within the refresh margin and are still in use"""
+        now = time.time()
+        with self._lock:
+            due = [key for key, entry in self._entries.items()
+                   if entry.expires_at - now < self.refresh_margin
+                   and now - entry.last_access < self.ttl
+                   and key not in self._flights
+                   and self._failures.get(key, (0,))[0] <= now]
+        for key in due:
+            try:
+                self._load(key, now + self.refresh_margin)
+                with self._lock:
+                    self._counters['refreshed_ahead'] += 1
+            except Exception as e:
+                print(f"⚠️ Weather refresh-ahead failed for {key}: {e}")
+        return len(due)
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, 'entries': len(self._entries),
+                    'in_flight': len(self._flights), 'revalidating': len(self._revalidating),
+                    'backing_off': sum(1 for until, _ in self._failures.values() if until > time.time()),
+                    'shared': self.backend is not None}
@@ -0,0 +1,271 @@
+# =========================
+# Walk-forward backtest of the +1h / +1d LightGBM forecasters
+# =========================
+# Re-fits the models of ml_model_training.py over rolling forecast origins:
+# the last BACKTEST_FOLDS blocks of the prepared rows are forecast one after
+# the other, each with models trained only on rows whose +1d target was
+# already known at that origin. Every fold reports accuracy together with
+# what it cost - training time, inference latency, peak memory and model
+# size - so a model change can be judged on both.
+#
+# The prepared rows (TRAIN_WORK_DIR) are shared with ml_model_training.py and
+# the binned LightGBM datasets of each fold are cached in BACKTEST_WORK_DIR,
+# so re-running with other parameters only pays for training. Folds run in
+# parallel on the training process pool (TRAIN_WORKERS); with
+# BACKTEST_MODE=warm each fold instead continues boosting from the previous
+# fold's model, as an incremental retraining schedule would.
+import os
+import json
+import time
+import shutil
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+
+from ml_model_training import (
+    HORIZONS, WORK_DIR, TRAIN_DEVICES, TRAIN_PARAMS, peak_rss_mb, log_step, series_dir_name, wanted_series,
+    horizon_steps, load_rows, binned_datasets, prepare, train_lgbm, evaluate, predict_chunked,
+    make_pool, run_jobs,
+)
+
+BACKTEST_FOLDS = int(os.environ.get('BACKTEST_FOLDS', 5))
+BACKTEST_FOLD_RATIO = float(os.environ.get('BACKTEST_FOLD_RATIO', 0.05))  # test rows per fold (share of all rows)
+BACKTEST_MAX_TRAIN_ROWS = int(os.environ.get('BACKTEST_MAX_TRAIN_ROWS', 0))  # 0: expanding window, else sliding
+BACKTEST_MODE = os.environ.get('BACKTEST_MODE', 'refit')  # 'refit' or 'warm'
+BACKTEST_WARM_ROUNDS = int(os.environ.get('BACKTEST_WARM_ROUNDS', 500))  # extra rounds per warm-started fold
+BACKTEST_WORK_DIR = os.environ.get('BACKTEST_WORK_DIR', 'backtest_cache')
+BACKTEST_REPORT = os.environ.get('BACKTEST_REPORT', 'backtest_report.json')
+VAL_RATIO = 0.15       # tail of each fold's training window used for early stopping
+MIN_TRAIN_ROWS = 200
+LATENCY_SAMPLES = 200  # single-row predictions timed per fold (the serving path)
+
+
+# =========================
+# 1) Rolling origins
+# =========================
+def plan_folds(ts, step_seconds):
+    """Train / val / test row bounds of each fold (test blocks tile the end of the rows)"""
+    n = len(ts)
+    _, steps_per_day = horizon_steps(step_seconds)
+    # Training targets must lie at or before the origin: purge the longest horizon
+    purge = steps_per_day * step_seconds
+    fold_rows = max(1, int(n * BACKTEST_FOLD_RATIO))
+    first = n - BACKTEST_FOLDS * fold_rows
+    folds = []
+    for k in range(BACKTEST_FOLDS):
+        test_start = first + k * fold_rows
+        test_end = n if k == BACKTEST_FOLDS - 1 else test_start + fold_rows
+        if test_start <= 0:
+            continue
+        train_end = int(np.searchsorted(ts, ts[test_start] - purge, side='right'))
+        train_start = max(0, train_end - BACKTEST_MAX_TRAIN_ROWS) if BACKTEST_MAX_TRAIN_ROWS else 0
+        val_start = train_end - int((train_end - train_start) * VAL_RATIO)
+        if val_start - train_start < MIN_TRAIN_ROWS or val_start == train_end:
+            print(f'⚠️ Fold {k}: not enough history before {pd.to_datetime(float(ts[test_start]), unit="s")} - skipped')
+            continue
+        folds.append({'fold': k, 'train': (train_start, val_start), 'val': (val_start, train_end),
+                      'test': (test_start, test_end)})
+    return folds
+
+
+def fold_dir(series, fold):
+    """Cache directory of a fold's binned datasets (named after its bounds, so it is reused only as is)"""
+    return os.path.join(BACKTEST_WORK_DIR, series_dir_name(series),
+                        f"fold{fold['fold']}_{fold['train'][0]}_{fold['val'][0]}_{fold['val'][1]}")
+
+
+def open_cache(fingerprint):
+    """Drop cached fold datasets built from other prepared rows"""
+    meta_path = os.path.join(BACKTEST_WORK_DIR, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f).get('fingerprint') == fingerprint:
+                return
+    if os.path.isdir(BACKTEST_WORK_DIR):
+        shutil.rmtree(BACKTEST_WORK_DIR)
+    os.makedirs(BACKTEST_WORK_DIR)
+    with open(meta_path, 'w') as f:
+        json.dump({'fingerprint': fingerprint}, f, indent=2)
+
+
+# =========================
+# 2) Pool jobs
+# =========================
+def bin_fold_job(out_dir, series_dir, meta, fold, params):
+    """Pool job: binned train / val datasets of one fold (cached)"""
+    started = time.time()
+    cached = os.path.exists(os.path.join(out_dir, 'train.bin'))
+    os.makedirs(out_dir, exist_ok=True)
+    X, y, _ = load_rows(series_dir, meta)
+    binned_datasets(out_dir, X, y, meta['features'], slice(*fold['train']), slice(*fold['val']), params)
+    return {'series': meta['series'], 'fold': fold['fold'], 'cached': cached, 'seconds': time.time() - started}
+
+
+def _warm_train(X, y, fold, h, previous, params):
+    """Continue boosting the previous fold's model on this fold's window"""
+    train, val = slice(*fold['train']), slice(*fold['val'])
+    dtrain = lgb.Dataset(X[train], label=np.ascontiguousarray(y[train, h]), params=params)
+    dval = lgb.Dataset(X[val], label=np.ascontiguousarray(y[val, h]), reference=dtrain, params=params)
+    return lgb.train(
+        params,
+        dtrain,
+        valid_sets=[dtrain, dval],
+        valid_names=['train', 'val'],
+        num_boost_round=BACKTEST_WARM_ROUNDS,
+        init_model=previous,
+        callbacks=[lgb.early_stopping(min(200, BACKTEST_WARM_ROUNDS), verbose=False)]
+    )
+
+
+def _latency_ms(model, X):
+    """p50 / p95 milliseconds of one-row predictions, as served by forecast_service"""
+    rows = np.asarray(X[np.linspace(0, len(X) - 1, min(LATENCY_SAMPLES, len(X))).astype(int)])
+    times = []
+    for row in rows:
+        t = time.perf_counter()
+        model.predict(row[None, :], num_iteration=model.best_iteration)
+        times.append((time.perf_counter() - t) * 1000)
+    return float(np.percentile(times, 50)), float(np.percentile(times, 95))
+
+
+def run_fold(series_dir, meta, fold, h, params, previous=None):
+    """Train one horizon model for one fold and measure it; returns (model, record)"""
+    horizon = HORIZONS[h]
+    X, y, ts = load_rows(series_dir, meta)
+    train, val, test = (slice(*fold[part]) for part in ('train', 'val', 'test'))
+    started = time.time()
+    if previous is None:
+        cache = fold_dir(meta['series'], fold)
+        model = train_lgbm(os.path.join(cache, 'train.bin'), os.path.join(cache, 'val.bin'),
+                           y[train, h], y[val, h], params)
+    else:
+        model = _warm_train(X, y, fold, h, previous, params)
+    train_seconds = time.time() - started
+
+    started = time.perf_counter()
+    predictions = predict_chunked(model, X[test])
+    batch_seconds = time.perf_counter() - started
+    p50, p95 = _latency_ms(model, X[test])
+    tag = f"[{meta['series']}] Fold {fold['fold']} +{horizon}"
+    record = {
+        'series': meta['series'], 'fold': fold['fold'], 'horizon': horizon,
+        'origin': pd.to_datetime(float(ts[test.start]), unit='s').isoformat(),
+        'train_rows': train.stop - train.start, 'val_rows': val.stop - val.start, 'test_rows': test.stop - test.start,
+        'metrics': evaluate(y[test, h], predictions, tag=tag),
+        'best_iteration': model.best_iteration,
+        'train_seconds': round(train_seconds, 3),
+        'batch_us_per_row': round(batch_seconds / max(1, len(predictions)) * 1e6, 3),
+        'latency_ms_p50': round(p50, 4), 'latency_ms_p95': round(p95, 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'model_kb': round(len(model.model_to_string(num_iteration=model.best_iteration)) / 1024, 1),
+    }
+    return model, record
+
+
+def fold_job(series_dir, meta, fold, h, params):
+    """Pool job: one refit fold"""
+    return [run_fold(series_dir, meta, fold, h, params)[1]]
+
+
+def warm_chain_job(series_dir, meta, folds, h, params):
+    """Pool job: the folds of one horizon in order, each warm-started from the last"""
+    records, model = [], None
+    for fold in folds:
+        model, record = run_fold(series_dir, meta, fold, h, params, previous=model)
+        records.append(record)
+    return records
+
+
+# =========================
+# 3) Report
+# =========================
+def summarize(records):
+    """Mean accuracy and cost per (series, horizon)"""
+    summary = {}
+    for key in sorted({(r['series'], r['horizon']) for r in records}, key=lambda k: (k[0], HORIZONS.index(k[1]))):
+        rows = [r for r in records if (r['series'], r['horizon']) == key]
+        summary[f'{key[0]} +{key[1]}'] = {
+            'folds': len(rows),
+            **{f'{m}_mean': float(np.mean([r['metrics'][m] for r in rows])) for m in ('MAE', 'RMSE', 'R2')},
+            'MAE_std': float(np.std([r['metrics']['MAE'] for r in rows])),
+            'train_seconds_total': round(sum(r['train_seconds'] for r in rows), 2),
+            'latency_ms_p50': float(np.median([r['latency_ms_p50'] for r in rows])),
+            'peak_rss_mb_max': max(r['peak_rss_mb'] for r in rows),
+        }
+    return summary
+
+
+def print_report(records, summary):
+    print('\nWalk-forward backtest:')
+    print(f"{'series':<12} {'h':>3} {'fold':>4} {'origin':<19} {'train':>8} {'MAE':>10} {'RMSE':>10} {'R2':>7} "
+          f"{'fit s':>7} {'p50 ms':>7} {'RSS MB':>7}")
+    for r in sorted(records, key=lambda r: (r['series'], HORIZONS.index(r['horizon']), r['fold'])):
+        m = r['metrics']
+        print(f"{str(r['series'])[:12]:<12} {r['horizon']:>3} {r['fold']:>4} {r['origin'][:19]:<19} {r['train_rows']:>8} "
+              f"{m['MAE']:>10.4f} {m['RMSE']:>10.4f} {m['R2']:>7.3f} {r['train_seconds']:>7.2f} "
+              f"{r['latency_ms_p50']:>7.3f} {r['peak_rss_mb']:>7.0f}")
+    for name, s in summary.items():
+        print(f"{name}: MAE {s['MAE_mean']:.4f} ± {s['MAE_std']:.4f}, RMSE {s['RMSE_mean']:.4f}, R2 {s['R2_mean']:.3f} "
+              f"over {s['folds']} folds; {s['train_seconds_total']}s training, "
+              f"p50 latency {s['latency_ms_p50']:.3f} ms, peak RSS {s['peak_rss_mb_max']:.0f} MB")
+
+
+def main():
+    started = time.time()
+    if BACKTEST_MODE not in ('refit', 'warm'):
+        raise SystemExit(f"BACKTEST_MODE must be 'refit' or 'warm', not {BACKTEST_MODE!r}")
+    wanted = wanted_series(TRAIN_DEVICES)
+    series_count = 1 if wanted is None else (os.cpu_count() or 1) if wanted == 'all' else len(wanted)
+    jobs = series_count * len(HORIZONS) * (BACKTEST_FOLDS if BACKTEST_MODE == 'refit' else 1)
+    # One process per job, so every fold's peak RSS is its own
+    pool, params = make_pool(jobs, fresh_workers=True)
+    try:
+        metas = prepare(WORK_DIR, wanted, pool, params)
+        with open(os.path.join(WORK_DIR, 'meta.json')) as f:
+            open_cache(json.load(f)['fingerprint'])
+
+        plans = {}
+        for series, meta in metas.items():
+            _, _, ts = load_rows(os.path.join(WORK_DIR, series_dir_name(series)), meta)
+            plans[series] = plan_folds(ts, meta['step_seconds'])
+        t = time.time()
+        binned = run_jobs(pool, bin_fold_job, [
+            (fold_dir(series, fold), os.path.join(WORK_DIR, series_dir_name(series)), metas[series], fold, params)
+            for series, folds in plans.items() for fold in folds
+            if BACKTEST_MODE == 'refit' or fold is folds[0]
+        ])
+        reused = sum(b['cached'] for b in binned)
+        log_step(f'Fold datasets ready ({reused} of {len(binned)} cached)', t)
+
+        t = time.time()
+        if BACKTEST_MODE == 'refit':
+            jobs = [(os.path.join(WORK_DIR, series_dir_name(series)), metas[series], fold, h, params)
+                    for series, folds in plans.items() for fold in folds for h in range(len(HORIZONS))]
+            results = run_jobs(pool, fold_job, jobs)
+        else:
+            jobs = [(os.path.join(WORK_DIR, series_dir_name(series)), metas[series], folds, h, params)
+                    for series, folds in plans.items() if folds for h in range(len(HORIZONS))]
+            results = run_jobs(pool, warm_chain_job, jobs)
+        log_step(f'Backtested {len(jobs)} {BACKTEST_MODE} jobs', t)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    records = [record for result in results for record in result]
+    if not records:
+        raise SystemExit('No backtest folds - not enough history')
+    summary = summarize(records)
+    print_report(records, summary)
+    with open(BACKTEST_REPORT, 'w') as f:
+        json.dump({
+            'created': datetime.now().isoformat(), 'mode': BACKTEST_MODE, 'folds': BACKTEST_FOLDS,
+            'fold_ratio': BACKTEST_FOLD_RATIO, 'max_train_rows': BACKTEST_MAX_TRAIN_ROWS,
+            'params': dict(TRAIN_PARAMS), 'summary': summary, 'records': records,
+        }, f, indent=2)
+    print(f'Report saved to {BACKTEST_REPORT}')
+    log_step('Backtest finished', started)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,229 +1,663 @@
-
-
 # =========================
 # 1) Imports & config
 # =========================
+# History is streamed in time-ordered chunks: nothing but the current chunk
+# (plus a bounded overlap) is ever held as a DataFrame. The regular step grid,
+# the engineered feature rows and the LightGBM bins all live on disk in
+# WORK_DIR, so a year of multi-device 15-second data trains on a modest machine.
+#
+# With TRAIN_STORE_DIR the readings come straight from the server's time-series
+# store instead of a CSV export: each grid window is read with
+# resample.read_grid, so nothing outside the window is loaded or resampled.
+#
+# One model pair (+1h / +1d) is trained per series: the whole history by
+# default, or one series per device with TRAIN_DEVICES. The (series x horizon)
+# jobs run on a process pool that reads the memory-mapped feature rows, and
+# the finished models are published as a new version of the model registry
+# (MODEL_DIR/registry/<version>/, selected by MODEL_DIR/registry/CURRENT).
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 import pandas as pd
 import numpy as np
 import lightgbm as lgb
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS report
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ServerFolder'))
+from feature_store import HISTORY, feature_names, lag_feature_matrix, feature_columns
+from timeseries_store import TimeSeriesStore
+from resample import ffill_limited, interpolate_limited, read_grid
+
 RANDOM_STATE = 42
+TARGET = 'Energy'
+HORIZONS = ('1h', '1d')
+DEFAULT_MODEL = 'default'  # registry entry of the whole-history model (used for devices without their own)
+
+csv_path = os.environ.get('TRAIN_CSV', 'your_data.csv')
+# Set FEATURE_STORE_DIR (e.g. solar_data/features/step_900) to train on the
+# features the server already maintains instead of recomputing them from the CSV
+FEATURE_STORE_DIR = os.environ.get('FEATURE_STORE_DIR')
+# Set TRAIN_STORE_DIR (the server's STORAGE_DIR, e.g. solar_data) to train on the stored readings
+TRAIN_STORE_DIR = os.environ.get('TRAIN_STORE_DIR')
+STORE_TARGET = 'energy'  # name of the Energy column in the server's store
+# Unset: one model on all rows; 'all': one model per device; 'a,b': those devices
+TRAIN_DEVICES = os.environ.get('TRAIN_DEVICES') or os.environ.get('TRAIN_DEVICE') or os.environ.get('FEATURE_DEVICE')
+WORK_DIR = os.environ.get('TRAIN_WORK_DIR', 'train_cache')
+MODEL_DIR = os.environ.get('MODEL_DIR', 'models')
+CHUNK_ROWS = int(os.environ.get('TRAIN_CHUNK_ROWS', 200000))
+TRAIN_WORKERS = int(os.environ.get('TRAIN_WORKERS', 0))  # 0: one per CPU (at most one per job)
+REGISTRY_KEEP = int(os.environ.get('REGISTRY_KEEP', 5))  # model versions kept in the registry
+
+INTERPOLATE_LIMIT = 4  # exogenous gaps interpolated up to 4 steps from either side
+FFILL_LIMIT = 2        # Energy gaps forward-filled up to 2 steps
+# Rows a chunk borrows from its neighbours so lags, rolling windows, gap
+# filling and the +1d target see the same values as a whole-history pass
+OVERLAP_MARGIN = 2 * INTERPOLATE_LIMIT
+
+TRAIN_PARAMS = {
+    'objective': 'regression',
+    'metric': ['l1', 'l2'],
+    'learning_rate': 0.05,
+    'num_leaves': 64,
+    'feature_fraction': 0.9,
+    'bagging_fraction': 0.8,
+    'bagging_freq': 1,
+    'min_data_in_leaf': 40,
+    'seed': RANDOM_STATE,
+    'verbose': -1
+}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KiB elsewhere
+
+
+def log_step(message, started):
+    print(f'{message} in {time.time() - started:.1f}s (peak RSS {peak_rss_mb():.0f} MB)')
+
+
+def series_dir_name(series):
+    """Filesystem-safe directory name of a series (device id)"""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(series)) or '_'
 
-# 2) Load CSV
-# =========================
-csv_path = 'your_data.csv'  
-df = pd.read_csv(csv_path)
-
-# Ensure expected columns exist
-assert 'timestamp' in df.columns, "timestamp column missing"
-assert 'Energy' in df.columns, "Energy column missing"
-
-# 3) Basic cleaning
-# =========================
-def basic_clean(df):
-    df = df.copy()
-    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-    df = df.dropna(subset=['timestamp'])
-    df = df.sort_values('timestamp')
-    df = df.drop_duplicates(subset=['timestamp'])
-    # Coerce non-time columns to numeric
-    for c in df.columns:
-        if c != 'timestamp':
-            df[c] = pd.to_numeric(df[c], errors='coerce')
-    return df
-
-df = basic_clean(df)
-
-# 4) Infer frequency and resample
-# =========================
-def infer_and_resample(df, target_col='Energy'):
-    df = df.set_index('timestamp').sort_index()
-    deltas = df.index.to_series().diff().dropna()
-    median_delta = deltas.median()
-    if pd.isna(median_delta):
-        median_delta = pd.Timedelta(minutes=15)
-    full_index = pd.date_range(df.index.min(), df.index.max(), freq=median_delta)
-    df = df.reindex(full_index)
-
-    # Interpolate exogenous features; conservative ffill for Energy
-    for c in df.columns:
-        if c != target_col:
-            df[c] = df[c].interpolate(limit=4, limit_direction='both')
-    df[target_col] = df[target_col].fillna(method='ffill', limit=2)
-
-    df = df.rename_axis('timestamp').reset_index()
-    return df, median_delta
-
-df, freq_delta = infer_and_resample(df, target_col='Energy')
-
-# 5) Feature engineering
-# =========================
-def add_time_features(df):
-    d = pd.to_datetime(df['timestamp'])
-    df['hour'] = d.dt.hour
-    df['dayofweek'] = d.dt.dayofweek
-    df['month'] = d.dt.month
-    df['is_weekend'] = (df['dayofweek'] >= 5).astype(int)
-    return df
-
-def add_lag_features(df, target_col='Energy', lags=None, roll_windows=None):
-    df = df.copy()
-    if lags is None:
-        lags = [1, 2, 3, 4, 6, 12, 24, 48, 96]
-    if roll_windows is None:
-        roll_windows = [4, 12, 24, 48]
-    for lag in lags:
-        df[f'{target_col}_lag_{lag}'] = df[target_col].shift(lag)
-    for w in roll_windows:
-        df[f'{target_col}_roll_mean_{w}'] = df[target_col].shift(1).rolling(w, min_periods=max(2, w//2)).mean()
-        df[f'{target_col}_roll_std_{w}']  = df[target_col].shift(1).rolling(w, min_periods=max(2, w//2)).std()
-        df[f'{target_col}_roll_min_{w}']  = df[target_col].shift(1).rolling(w, min_periods=max(2, w//2)).min()
-        df[f'{target_col}_roll_max_{w}']  = df[target_col].shift(1).rolling(w, min_periods=max(2, w//2)).max()
-    return df
-
-df = add_time_features(df)
-df = add_lag_features(df, target_col='Energy')
-
-# =========================
-# 6) Build horizon targets (+1 hour, +1 day)
-# =========================
-def build_horizon_targets(df, freq_delta, target_col='Energy'):
-    df = df.copy()
-    step_minutes = int(freq_delta.total_seconds() // 60)
-    if step_minutes == 0:
-        step_minutes = 15
-    steps_per_hour = max(1, int(round(60 / step_minutes)))
-    steps_per_day = steps_per_hour * 24
-    df['Energy_t_plus_1h'] = df[target_col].shift(-steps_per_hour)
-    df['Energy_t_plus_1d'] = df[target_col].shift(-steps_per_day)
-    return df, steps_per_hour, steps_per_day
-
-df, steps_per_hour, steps_per_day = build_horizon_targets(df, freq_delta, target_col='Energy')
-
-# Drop NaNs from engineered features and targets
-df_model = df.dropna().copy()
-
-# 7) Time-based split
-# =========================
-def time_split(df, test_ratio=0.15, val_ratio=0.15):
-    n = len(df)
+
+def wanted_series(spec):
+    """None (one whole-history series), 'all', or a set of device ids"""
+    if not spec:
+        return None
+    if spec.strip().lower() == 'all':
+        return 'all'
+    return {device.strip() for device in spec.split(',') if device.strip()}
+
+
+def group_rows(devices, wanted):
+    """{series: row selector} of one chunk"""
+    if wanted is None:
+        return {DEFAULT_MODEL: slice(None)}
+    groups = {}
+    if devices is None:
+        return groups
+    for device in pd.unique(devices):
+        if isinstance(device, str) and device and (wanted == 'all' or device in wanted):
+            groups[device] = np.flatnonzero(devices == device)
+    return groups
+
+
+# =========================
+# 2) Scan the CSV (timestamps and which columns are numeric)
+# =========================
+def read_chunks(path):
+    """Time-ordered CSV chunks as (epoch seconds, device ids or None, numeric float32 frame)"""
+    for chunk in pd.read_csv(path, chunksize=CHUNK_ROWS, dtype=str):
+        ts = pd.to_datetime(chunk['timestamp'], errors='coerce')
+        valid = ts.notna().to_numpy()
+        devices = chunk['device_id'].to_numpy(dtype=object)[valid] if 'device_id' in chunk.columns else None
+        numeric = chunk.drop(columns=[c for c in ('timestamp', 'device_id') if c in chunk.columns])
+        # Coerce non-time columns to numeric (float32 halves the footprint of float64)
+        numeric = numeric.apply(pd.to_numeric, errors='coerce').astype(np.float32)
+        yield (ts[valid] - pd.Timestamp(0)).dt.total_seconds().to_numpy(), devices, numeric[valid]
+
+
+class _Scan:
+    """Time span, row count, numeric columns and a timestamp sample of one series"""
+
+    def __init__(self):
+        self.t_min, self.t_max, self.rows = np.inf, -np.inf, 0
+        self.has_numbers = {}
+        self.sample = []
+
+    def add(self, ts, numeric=None):
+        if not len(ts):
+            return
+        self.t_min, self.t_max = min(self.t_min, ts.min()), max(self.t_max, ts.max())
+        self.rows += len(ts)
+        if numeric is not None:
+            for c in numeric.columns:
+                self.has_numbers[c] = self.has_numbers.get(c, False) or bool(numeric[c].notna().any())
+        if len(self.sample) < 100000:
+            self.sample.extend(ts[:100000 - len(self.sample)])
+
+    def step(self):
+        # Interval = median spacing of the first rows (like infer_and_resample)
+        deltas = np.diff(np.unique(self.sample))
+        return float(np.median(deltas)) if len(deltas) else 15 * 60.0
+
+
+def _infos(scans, columns_of, step=None):
+    """Per-series grid description; all series share one step so one feature store serves them"""
+    scans = {series: scan for series, scan in scans.items() if scan.rows}
+    if not scans:
+        raise SystemExit('No rows with a valid timestamp for the selected series')
+    step = step or float(np.median([scan.step() for scan in scans.values()]))
+    return {
+        series: {'series': series, 't0': float(scan.t_min), 't_end': float(scan.t_max), 'step_seconds': step,
+                 'columns': columns_of(scan), 'source_rows': scan.rows}
+        for series, scan in scans.items()
+    }
+
+
+def scan_csv(path, wanted=None):
+    """First pass over the CSV for every selected series at once"""
+    header = pd.read_csv(path, nrows=0).columns
+    assert 'timestamp' in header, "timestamp column missing"
+    assert TARGET in header, "Energy column missing"
+    scans = {}
+    for ts, devices, numeric in read_chunks(path):
+        for series, rows in group_rows(devices, wanted).items():
+            scans.setdefault(series, _Scan()).add(ts[rows], numeric.iloc[rows])
+
+    def columns_of(scan):
+        columns = [c for c in header if scan.has_numbers.get(c)]
+        return columns if TARGET in columns else columns + [TARGET]
+    return _infos(scans, columns_of)
+
+
+# =========================
+# 3) Place readings on the regular step grid (memory-mapped, float32)
+# =========================
+def grid_length(info):
+    return int(round((info['t_end'] - info['t0']) / info['step_seconds'])) + 1
+
+
+def _place(grid, claimed, info, ts, values):
+    """Rows whose timestamp falls on the grid (first one wins, like drop_duplicates)"""
+    position = (ts - info['t0']) / info['step_seconds']
+    index = np.rint(position).astype(np.int64)
+    on_grid = (np.abs(position - index) < 1e-6) & (index >= 0) & (index < len(grid))
+    index, values = index[on_grid], values[on_grid]
+    index, first = np.unique(index, return_index=True)
+    fresh = ~claimed[index]
+    grid[index[fresh]] = values[first[fresh]]
+    claimed[index[fresh]] = True
+
+
+def fill_grids_from_csv(path, infos, grids, wanted=None):
+    """Second pass: every selected series is filled from the same read of the CSV"""
+    claimed = {series: np.zeros(len(grid), dtype=bool) for series, grid in grids.items()}
+    for ts, devices, numeric in read_chunks(path):
+        for series, rows in group_rows(devices, wanted).items():
+            if series in grids:
+                values = numeric.iloc[rows].reindex(columns=infos[series]['columns']).to_numpy()
+                _place(grids[series], claimed[series], infos[series], ts[rows], values)
+
+
+def _store_name(column):
+    return STORE_TARGET if column == TARGET else column
+
+
+def scan_readings(root, wanted=None):
+    """First pass over the server's TimeSeriesStore (readings are bucketed, so the grid is epoch-aligned)"""
+    store = TimeSeriesStore(root)
+    numeric_columns = [name for name, kind in store.columns if kind == 'f']
+    scans = {}
+    for data in store.iter_chunks(columns=['device_id'] + numeric_columns, chunk_rows=CHUNK_ROWS):
+        numeric = pd.DataFrame({name: data[name] for name in numeric_columns})
+        for series, rows in group_rows(np.asarray(data['device_id'], dtype=object), wanted).items():
+            scans.setdefault(series, _Scan()).add(data['timestamp'][rows], numeric.iloc[rows])
+
+    def columns_of(scan):
+        columns = [TARGET if c == STORE_TARGET else c for c in numeric_columns if scan.has_numbers.get(c)]
+        return columns if TARGET in columns else columns + [TARGET]
+    steps = [scan.step() for scan in scans.values() if scan.rows]
+    # Whole seconds, so every step boundary is exact in float64
+    step = max(1.0, float(round(np.median(steps)))) if steps else None
+    infos = _infos(scans, columns_of, step)
+    for info in infos.values():
+        info['t0'] = float(np.floor(info['t0'] / step) * step)
+        info['t_end'] = float(np.floor(info['t_end'] / step) * step)
+    return infos
+
+
+def fill_grids_from_readings(root, infos, grids):
+    """Each series' grid window by window through resample.read_grid (last reading of a step wins).
+
+    Gaps are left open here: build_training_rows fills them with the chunk
+    overlap, as for the other sources.
+    """
+    store = TimeSeriesStore(root)
+    for series, grid in grids.items():
+        info = infos[series]
+        step, names = info['step_seconds'], [_store_name(c) for c in info['columns']]
+        device_id = None if series == DEFAULT_MODEL else series
+        for start in range(0, len(grid), CHUNK_ROWS):
+            end = min(start + CHUNK_ROWS, len(grid))
+            window = read_grid(store, info['t0'] + start * step, info['t0'] + (end - 1) * step, step, names,
+                               device_id=device_id, interpolate_limit=0, ffill_limit=0)
+            grid[start:end] = np.column_stack([window[name] for name in names])
+
+
+def scan_feature_store(root, wanted=None):
+    store = TimeSeriesStore(root, columns=feature_columns())
+    step = float(os.path.basename(os.path.normpath(root)).split('_')[-1])
+    scans, devices = {}, set()
+    for data in store.iter_chunks(columns=['device_id'], chunk_rows=CHUNK_ROWS):
+        device_ids = np.asarray(data['device_id'], dtype=object)
+        devices.update(device_ids)
+        for series, rows in group_rows(device_ids, wanted).items():
+            scans.setdefault(series, _Scan()).add(data['timestamp'][rows])
+    if wanted is None and len(devices) > 1:
+        raise SystemExit('Feature store holds several devices - set TRAIN_DEVICES')
+    return _infos(scans, lambda scan: [TARGET] + feature_names(), step)
+
+
+def fill_grids_from_store(root, infos, grids, wanted=None):
+    """Persisted feature rows onto the grids (the last row written for a step wins)"""
+    store = TimeSeriesStore(root, columns=feature_columns())
+    for data in store.iter_chunks(chunk_rows=CHUNK_ROWS):
+        values = np.column_stack([data['energy']] + [data[name] for name in feature_names()])
+        for series, rows in group_rows(np.asarray(data['device_id'], dtype=object), wanted).items():
+            if series in grids:
+                info = infos[series]
+                index = np.rint((data['timestamp'][rows] - info['t0']) / info['step_seconds']).astype(np.int64)
+                grids[series][index] = values[rows]
+
+
+# =========================
+# 4) Features and horizon targets, chunk by chunk
+# =========================
+def horizon_steps(step_seconds):
+    steps_per_hour = max(1, int(round(3600 / step_seconds)))
+    return steps_per_hour, steps_per_hour * 24
+
+
+def time_feature_block(timestamps):
+    d = pd.DatetimeIndex(pd.to_datetime(timestamps, unit='s'))
+    dayofweek = d.dayofweek.to_numpy()
+    return np.column_stack([d.hour.to_numpy(), dayofweek, d.month.to_numpy(), dayofweek >= 5]).astype(np.float32)
+
+
+def build_training_rows(grid, info, out_dir, precomputed=False):
+    """Write complete feature rows (dropna) to X / y / timestamp files; returns the row count.
+
+    Each chunk is processed together with HISTORY + margin rows before it and
+    one day + margin rows after it, so results do not depend on CHUNK_ROWS.
+    Only exogenous gaps longer than that overlap which straddle a chunk
+    boundary are filled differently (as at the edge of the series).
+    """
+    columns = info['columns']
+    steps_per_hour, steps_per_day = horizon_steps(info['step_seconds'])
+    before = (0 if precomputed else HISTORY) + OVERLAP_MARGIN
+    after = steps_per_day + OVERLAP_MARGIN
+    n = len(grid)
+    rows = 0
+    with open(os.path.join(out_dir, 'X.f32'), 'wb') as fx, \
+            open(os.path.join(out_dir, 'y.f32'), 'wb') as fy, \
+            open(os.path.join(out_dir, 'ts.f64'), 'wb') as ft:
+        for start in range(0, n, CHUNK_ROWS):
+            end = min(start + CHUNK_ROWS, n)
+            lo, hi = max(0, start - before), min(n, end + after)
+            block = np.array(grid[lo:hi])
+            target = columns.index(TARGET)
+            if precomputed:
+                energy = block[:, target].astype(np.float64)
+                exogenous = np.empty((hi - lo, 0), dtype=np.float32)
+                lagged = block[:, [columns.index(name) for name in feature_names()]]
+            else:
+                # Interpolate exogenous features; conservative ffill for Energy
+                exo_cols = [i for i, c in enumerate(columns) if c != TARGET]
+                exogenous = interpolate_limited(block[:, exo_cols], INTERPOLATE_LIMIT).astype(np.float32)
+                energy = ffill_limited(block[:, target].astype(np.float64), FFILL_LIMIT)
+                lagged = np.column_stack(list(lag_feature_matrix(energy).values())).astype(np.float32)
+            targets = np.full((hi - lo, 2), np.nan, dtype=np.float32)
+            targets[:-steps_per_hour, 0] = energy[steps_per_hour:]
+            targets[:-steps_per_day, 1] = energy[steps_per_day:]
+            timestamps = info['t0'] + np.arange(lo, hi) * info['step_seconds']
+
+            keep = slice(start - lo, end - lo)
+            X = np.hstack([exogenous[keep], time_feature_block(timestamps[keep]), lagged[keep]])
+            y = targets[keep]
+            complete = ~(np.isnan(X).any(axis=1) | np.isnan(y).any(axis=1) | np.isnan(energy[keep]))
+            X[complete].tofile(fx)
+            y[complete].tofile(fy)
+            timestamps[keep][complete].tofile(ft)
+            rows += int(complete.sum())
+    return rows
+
+
+def feature_list(info, precomputed=False):
+    exogenous = [] if precomputed else [c for c in info['columns'] if c != TARGET]
+    return exogenous + ['hour', 'dayofweek', 'month', 'is_weekend'] + feature_names()
+
+
+def load_rows(series_dir, meta):
+    """Read-only memory maps of the prepared rows (shared by every job through the page cache)"""
+    n, k = meta['rows'], len(meta['features'])
+    X = np.memmap(os.path.join(series_dir, 'X.f32'), dtype=np.float32, mode='r', shape=(n, k))
+    y = np.memmap(os.path.join(series_dir, 'y.f32'), dtype=np.float32, mode='r', shape=(n, 2))
+    ts = np.memmap(os.path.join(series_dir, 'ts.f64'), dtype=np.float64, mode='r', shape=(n,))
+    return X, y, ts
+
+
+# =========================
+# 5) Time-based split
+# =========================
+def time_split(n, test_ratio=0.15, val_ratio=0.15):
     test_start = int(n * (1 - test_ratio))
     val_start = int(n * (1 - test_ratio - val_ratio))
-    train = df.iloc[:val_start].copy()
-    val = df.iloc[val_start:test_start].copy()
-    test = df.iloc[test_start:].copy()
-    return train, val, test
+    return slice(0, val_start), slice(val_start, test_start), slice(test_start, n)
 
-train_df, val_df, test_df = time_split(df_model, test_ratio=0.15, val_ratio=0.15)
 
 # =========================
-# 8) Prepare X, y
+# 6) LightGBM datasets from binary-cached bins
 # =========================
-drop_cols_common = {
-    'timestamp',
-    'Energy',
-    'Energy_t_plus_1h',
-    'Energy_t_plus_1d'
-}
+def binned_datasets(series_dir, X, y, features, train, val, params=None):
+    """Bin train/val once, save them as LightGBM binary files and load those.
+
+    Bins are shared by both horizons (only the label differs) and reused
+    across runs while the prepared rows are unchanged; raw rows are freed
+    right after binning.
+    """
+    params = params or TRAIN_PARAMS
+    train_bin, val_bin = os.path.join(series_dir, 'train.bin'), os.path.join(series_dir, 'val.bin')
+    if not (os.path.exists(train_bin) and os.path.exists(val_bin)):
+        started = time.time()
+        dtrain = lgb.Dataset(X[train], label=np.ascontiguousarray(y[train, 0]), feature_name=features, params=params)
+        dval = lgb.Dataset(X[val], label=np.ascontiguousarray(y[val, 0]), reference=dtrain, params=params)
+        dtrain.save_binary(train_bin)
+        dval.save_binary(val_bin)
+        del dtrain, dval
+        log_step(f'Binned training data in {series_dir}', started)
+    return train_bin, val_bin
+
+
+def prepare_series_job(series_dir, info, precomputed, params):
+    """Pool job: grid -> complete feature rows -> LightGBM bins for one series"""
+    started = time.time()
+    grid_path = os.path.join(series_dir, 'grid.npy')
+    grid = np.load(grid_path, mmap_mode='r')
+    rows = build_training_rows(grid, info, series_dir, precomputed)
+    del grid
+    os.remove(grid_path)
+    log_step(f"[{info['series']}] Built {rows} complete feature rows", started)
+    meta = {**info, 'rows': rows, 'features': feature_list(info, precomputed)}
+    if rows:
+        X, y, _ = load_rows(series_dir, meta)
+        train, val, _ = time_split(rows)
+        binned_datasets(series_dir, X, y, meta['features'], train, val, params)
+    return meta
+
+
+def prepare(work_dir, wanted, pool, params):
+    """Stream the source into training rows per series; reused while the source is unchanged"""
+    source = FEATURE_STORE_DIR or TRAIN_STORE_DIR or csv_path
+    stat = os.stat(os.path.join(source, 'stats.json') if source != csv_path else source)
+    fingerprint = {'source': os.path.abspath(source), 'size': stat.st_size, 'mtime': stat.st_mtime,
+                   'series': sorted(wanted) if isinstance(wanted, set) else wanted, 'version': 2}
+    meta_path = os.path.join(work_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            metas = json.load(f)
+        if metas.get('fingerprint') == fingerprint:
+            print(f'Reusing prepared training rows in {work_dir}')
+            return metas['series']
+    if os.path.isdir(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir)
+
+    started = time.time()
+    precomputed = bool(FEATURE_STORE_DIR)
+    if precomputed:
+        infos = scan_feature_store(FEATURE_STORE_DIR, wanted)
+    elif TRAIN_STORE_DIR:
+        infos = scan_readings(TRAIN_STORE_DIR, wanted)
+    else:
+        infos = scan_csv(csv_path, wanted)
+    grids = {}
+    for series, info in infos.items():
+        series_dir = os.path.join(work_dir, series_dir_name(series))
+        os.makedirs(series_dir)
+        n = grid_length(info)
+        grid = np.lib.format.open_memmap(os.path.join(series_dir, 'grid.npy'), mode='w+', dtype=np.float32,
+                                         shape=(n, len(info['columns'])))
+        for start in range(0, n, CHUNK_ROWS):
+            grid[start:start + CHUNK_ROWS] = np.nan
+        grids[series] = grid
+    if precomputed:
+        fill_grids_from_store(FEATURE_STORE_DIR, infos, grids, wanted)
+    elif TRAIN_STORE_DIR:
+        fill_grids_from_readings(TRAIN_STORE_DIR, infos, grids)
+    else:
+        fill_grids_from_csv(csv_path, infos, grids, wanted)
+    for grid in grids.values():
+        grid.flush()
+    del grids
+    rows = sum(info['source_rows'] for info in infos.values())
+    step = next(iter(infos.values()))['step_seconds']
+    log_step(f'Placed {rows} readings of {len(infos)} series on a {step:.0f}s grid', started)
+
+    jobs = [(os.path.join(work_dir, series_dir_name(series)), info, precomputed, params)
+            for series, info in infos.items()]
+    metas = {meta['series']: meta for meta in run_jobs(pool, prepare_series_job, jobs)}
+    for series in [series for series, meta in metas.items() if not meta['rows']]:
+        print(f'⚠️ [{series}] No complete feature rows - not enough history, skipped')
+        del metas[series]
+    if not metas:
+        raise SystemExit('No complete feature rows - not enough history')
+    with open(meta_path, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'series': metas}, f, indent=2)
+    return metas
 
-def make_xy(df, target):
-    features = [c for c in df.columns if c not in drop_cols_common]
-    X = df[features]
-    y = df[target]
-    return X, y, features
-
-Xtr_1h, ytr_1h, feats_1h = make_xy(train_df, 'Energy_t_plus_1h')
-Xva_1h, yva_1h, _ = make_xy(val_df, 'Energy_t_plus_1h')
-Xte_1h, yte_1h, _ = make_xy(test_df, 'Energy_t_plus_1h')
-
-Xtr_1d, ytr_1d, feats_1d = make_xy(train_df, 'Energy_t_plus_1d')
-Xva_1d, yva_1d, _ = make_xy(val_df, 'Energy_t_plus_1d')
-Xte_1d, yte_1d, _ = make_xy(test_df, 'Energy_t_plus_1d')
-
-# =========================
-# 9) Train LightGBM with early stopping
-# =========================
-def train_lgbm(X_train, y_train, X_val, y_val, params=None):
-    if params is None:
-        params = {
-            'objective': 'regression',
-            'metric': ['l1', 'l2'],
-            'learning_rate': 0.05,
-            'num_leaves': 64,
-            'feature_fraction': 0.9,
-            'bagging_fraction': 0.8,
-            'bagging_freq': 1,
-            'min_data_in_leaf': 40,
-            'seed': RANDOM_STATE,
-            'verbose': -1
-        }
-    dtrain = lgb.Dataset(X_train, label=y_train, free_raw_data=False)
-    dval = lgb.Dataset(X_val, label=y_val, reference=dtrain, free_raw_data=False)
+
+# =========================
+# 7) Train LightGBM with early stopping
+# =========================
+def train_lgbm(train_bin, val_bin, y_train, y_val, params=None):
+    params = params or TRAIN_PARAMS
+    dtrain = lgb.Dataset(train_bin, params=params).construct()
+    dtrain.set_label(np.ascontiguousarray(y_train))
+    dval = lgb.Dataset(val_bin, reference=dtrain, params=params).construct()
+    dval.set_label(np.ascontiguousarray(y_val))
     model = lgb.train(
         params,
         dtrain,
         valid_sets=[dtrain, dval],
         valid_names=['train', 'val'],
         num_boost_round=5000,
-        early_stopping_rounds=200,
-        verbose_eval=200
+        callbacks=[lgb.early_stopping(200, verbose=False)]
     )
     return model
 
-model_1h = train_lgbm(Xtr_1h, ytr_1h, Xva_1h, yva_1h)
-model_1d = train_lgbm(Xtr_1d, ytr_1d, Xva_1d, yva_1d)
 
 # =========================
-# 10) Evaluate
+# 8) Evaluate
 # =========================
 def evaluate(y_true, y_pred, tag=''):
     mae = mean_absolute_error(y_true, y_pred)
-    rmse = mean_squared_error(y_true, y_pred, squared=False)
+    rmse = float(np.sqrt(mean_squared_error(y_true, y_pred)))
     r2 = r2_score(y_true, y_pred)
     print(f'{tag} MAE:  {mae:.6f}')
     print(f'{tag} RMSE: {rmse:.6f}')
     print(f'{tag} R2:   {r2:.6f}')
     return {'MAE': mae, 'RMSE': rmse, 'R2': r2}
 
-pred_va_1h = model_1h.predict(Xva_1h, num_iteration=model_1h.best_iteration)
-pred_te_1h = model_1h.predict(Xte_1h, num_iteration=model_1h.best_iteration)
-
-pred_va_1d = model_1d.predict(Xva_1d, num_iteration=model_1d.best_iteration)
-pred_te_1d = model_1d.predict(Xte_1d, num_iteration=model_1d.best_iteration)
 
-print('\\nValidation (+1h):')
-metrics_1h_val = evaluate(yva_1h, pred_va_1h, tag='Val +1h')
+def predict_chunked(model, X):
+    return np.concatenate([
+        model.predict(X[start:start + CHUNK_ROWS], num_iteration=model.best_iteration)
+        for start in range(0, len(X), CHUNK_ROWS)
+    ]) if len(X) else np.empty(0)
+
+
+def train_job(series_dir, meta, h, out_path, params):
+    """Pool job: train, evaluate and save one (series, horizon) model"""
+    started = time.time()
+    horizon = HORIZONS[h]
+    X, y, ts = load_rows(series_dir, meta)
+    train, val, test = time_split(len(X), test_ratio=0.15, val_ratio=0.15)
+    model = train_lgbm(os.path.join(series_dir, 'train.bin'), os.path.join(series_dir, 'val.bin'),
+                       y[train, h], y[val, h], params)
+    train_seconds = time.time() - started
+    tag = f"[{meta['series']}]"
+    metrics = {
+        'val': evaluate(y[val, h], predict_chunked(model, X[val]), tag=f'{tag} Val +{horizon}'),
+        'test': evaluate(y[test, h], predict_chunked(model, X[test]), tag=f'{tag} Test +{horizon}'),
+    }
+    # Forecast from the most recent row that has all features
+    latest = float(model.predict(np.asarray(X[-1:]), num_iteration=model.best_iteration)[0])
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    model.save_model(out_path, num_iteration=model.best_iteration)
+    log_step(f'{tag} Trained +{horizon} model ({model.best_iteration} rounds)', started)
+    return {
+        'series': meta['series'], 'horizon': horizon, 'best_iteration': model.best_iteration,
+        'metrics': metrics, 'train_seconds': round(train_seconds, 2), 'peak_rss_mb': round(peak_rss_mb(), 1),
+        'latest': {'as_of': pd.to_datetime(float(ts[-1]), unit='s').isoformat(), 'energy': latest},
+    }
 
-print('\\nTest (+1h):')
-metrics_1h_test = evaluate(yte_1h, pred_te_1h, tag='Test +1h')
-
-print('\\nValidation (+1d):')
-metrics_1d_val = evaluate(yva_1d, pred_va_1d, tag='Val +1d')
-
-print('\\nTest (+1d):')
-metrics_1d_test = evaluate(yte_1d, pred_te_1d, tag='Test +1d')
 
 # =========================
-# 11) Inference for next timestamps
+# 9) Process pool (thread budget split between jobs)
 # =========================
-# To predict the next 1 hour and next 1 day from the most recent row that has all features:
-def get_latest_feature_row(df_full, features):
-    last_valid = df_full.dropna().iloc[-1]
-    return last_valid[features].to_frame().T
-
-latest_1h_X = get_latest_feature_row(df_model, feats_1h)
-latest_1d_X = get_latest_feature_row(df_model, feats_1d)
+def _limit_threads(threads):
+    for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[name] = str(threads)
+
+
+def make_pool(jobs, fresh_workers=False):
+    """Pool of TRAIN_WORKERS processes and the LightGBM threads each job may use.
+
+    fresh_workers runs every job in a new process, so the peak RSS a job
+    reports is its own (Python 3.11+).
+    """
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(TRAIN_WORKERS or cpus, jobs))
+    threads = max(1, cpus // workers)
+    params = {**TRAIN_PARAMS, 'num_threads': threads}
+    if workers == 1:
+        return None, params
+    # spawn: forked children of a process that already used OpenMP can deadlock
+    extra = {'max_tasks_per_child': 1} if fresh_workers and sys.version_info >= (3, 11) else {}
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_limit_threads, initargs=(threads,), **extra)
+    print(f'Training pool: {workers} workers x {threads} LightGBM threads')
+    return pool, params
+
+
+def run_jobs(pool, fn, jobs):
+    if pool is None:
+        return [fn(*job) for job in jobs]
+    futures = [pool.submit(fn, *job) for job in jobs]
+    return [future.result() for future in futures]
 
-next_1h_energy = model_1h.predict(latest_1h_X, num_iteration=model_1h.best_iteration)
-next_1d_energy = model_1d.predict(latest_1d_X, num_iteration=model_1d.best_iteration)
-
-print('\\nForecasts from last available time:')
-print('Next 1 hour Energy:', next_1h_energy)
-print('Next 1 day Energy :', next_1d_energy)
 
 # =========================
-# 12) (Optional) Save models
+# 10) Versioned model registry (loaded by ServerFolder/forecast_service.py)
 # =========================
-# model_1h.save_model('lgbm_energy_plus1h.txt')
-# model_1d.save_model('lgbm_energy_plus1d.txt')
+def registry_dir():
+    return os.path.join(MODEL_DIR, 'registry')
+
+
+def model_file(horizon):
+    return f'lgbm_energy_plus{horizon}.txt'
+
+
+def publish(staging, version, metas, results, source):
+    """Write metadata, move the staged version into place and point CURRENT at it"""
+    registry = registry_dir()
+    step_seconds = next(iter(metas.values()))['step_seconds']
+    steps_per_hour, steps_per_day = horizon_steps(step_seconds)
+    models = {}
+    for series, meta in metas.items():
+        name = series_dir_name(series)
+        with open(os.path.join(staging, name, 'forecast_meta.json'), 'w') as f:
+            json.dump({
+                'step_seconds': int(step_seconds),
+                'steps_per_hour': steps_per_hour,
+                'steps_per_day': steps_per_day,
+                **{f'features_{horizon}': meta['features'] for horizon in HORIZONS},
+            }, f, indent=2)
+        models[series] = {
+            'dir': name, 'rows': meta['rows'],
+            'horizons': {r['horizon']: {**r, 'file': model_file(r['horizon'])}
+                         for r in results if r['series'] == series},
+        }
+    manifest = {'version': version, 'created': datetime.now().isoformat(), 'source': source,
+                'step_seconds': int(step_seconds), 'models': models}
+    with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    os.replace(staging, os.path.join(registry, version))
+    with open(os.path.join(registry, 'CURRENT.tmp'), 'w') as f:
+        f.write(version + '\n')
+    os.replace(os.path.join(registry, 'CURRENT.tmp'), os.path.join(registry, 'CURRENT'))
+
+    versions = sorted(v for v in os.listdir(registry) if os.path.isfile(os.path.join(registry, v, 'manifest.json')))
+    for old in versions[:-REGISTRY_KEEP] if REGISTRY_KEEP > 0 else []:
+        shutil.rmtree(os.path.join(registry, old), ignore_errors=True)
+    return os.path.join(registry, version)
+
+
+def main():
+    started = time.time()
+    wanted = wanted_series(TRAIN_DEVICES)
+    # Size the pool for the (series x horizon) training jobs
+    if wanted is None:
+        jobs = len(HORIZONS)
+    elif wanted == 'all':
+        jobs = os.cpu_count() or 1
+    else:
+        jobs = len(wanted) * len(HORIZONS)
+    pool, params = make_pool(jobs)
+    try:
+        metas = prepare(WORK_DIR, wanted, pool, params)
+
+        version = datetime.now().strftime('%Y%m%d-%H%M%S')
+        staging = os.path.join(registry_dir(), f'.{version}.tmp')
+        jobs = [
+            (os.path.join(WORK_DIR, series_dir_name(series)), meta, h,
+             os.path.join(staging, series_dir_name(series), model_file(horizon)), params)
+            for series, meta in metas.items()
+            for h, horizon in enumerate(HORIZONS)
+        ]
+        t = time.time()
+        results = run_jobs(pool, train_job, jobs)
+        log_step(f'Trained {len(jobs)} models', t)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    print('\nForecasts from last available time:')
+    for r in results:
+        print(f"[{r['series']}] +{r['horizon']} from {r['latest']['as_of']}: {r['latest']['energy']:.6f} "
+              f"(test MAE {r['metrics']['test']['MAE']:.6f}, {r['train_seconds']}s)")
+
+    path = publish(staging, version, metas, results, FEATURE_STORE_DIR or TRAIN_STORE_DIR or csv_path)
+    print(f'Models saved to {path} (registry version {version})')
+    log_step('Training pipeline finished', started)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,20 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template
 import requests
 import time
+import os
+import bisect
+import threading
+import atexit
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+
+from ServerFolder.forwarder import OutboundQueue, pooled_session
+from ServerFolder.weather_cache import WeatherCache
+from ServerFolder.alert_rules import SCRIPT_RULES
+from ServerFolder.ring_buffer import RingBuffer
+from ServerFolder.live_stream import LiveBroker
+from ServerFolder.snapshot_cache import SnapshotCache
+from ServerFolder.telemetry_schema import parse_reading
 
 app = Flask(__name__)
 
@@ -8,119 +22,194 @@ app = Flask(__name__)
 THINGSBOARD_TOKEN = None
 frequency = power_factor = voltage = current = power = energy = None
 solar_voltage = solar_current = solar_power = battery_percentage = light_intensity = None
-battery_voltage = inverter_load = prev_batterypercent = None
-temperature = cloudcover = windspeed = precipitation = irradiance = prev_irradiance = None
+battery_voltage = inverter_load = None
+temperature = cloudcover = windspeed = precipitation = irradiance = None
 LAT = LON = IP = RoomEsp = None
-prev_time = time.time()
+TREND_WINDOW = 300  # seconds of readings the sunlight/battery slopes are fitted over
+trend_buffers = {}  # device key -> RingBuffer of (irradiance, battery %) readings
 battery_alert = solar_alert = overload_status = sunlight_alert = charging_alert = None
 payload = {}
+payload_version = 0  # bumped with every new payload; the rendered dashboard is cached per version
+page_cache = SnapshotCache(max_entries=4)
 
 
 # ===================== ALERT GENERATION ===================
-def generate_alerts():
-    global battery_alert, solar_alert, sunlight_alert, charging_alert, prev_time
+def device_key():
+    return THINGSBOARD_TOKEN or IP or "default"
+
+
+def to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def generate_alerts(timestamp=None):
+    global battery_alert, solar_alert, sunlight_alert, charging_alert
     global solar_power, voltage, current, inverter_load, overload_status, power
-    global battery_percentage, light_intensity, prev_batterypercent, prev_irradiance
+    global battery_percentage, light_intensity
+
+    # Slopes are fitted over the real arrival times of this device's readings
+    trends = trend_buffers.get(device_key())
+    if trends is None:
+        trends = trend_buffers[device_key()] = RingBuffer(("irradiance", "battery"), window=TREND_WINDOW)
+    light = to_number(light_intensity)
+    trends.append(
+        timestamp if timestamp is not None else time.time(),
+        [light / 120 if light is not None else None, to_number(battery_percentage)],
+    )
 
-    # Reset alerts and calculate irradiance
-    battery_alert = solar_alert = overload_status = sunlight_alert = charging_alert = (
-        None
+    # Rules are shared with the batch path, see ServerFolder/alert_rules.py
+    alerts, _ = SCRIPT_RULES.evaluate_one(
+        {
+            "battery_percentage": battery_percentage,
+            "light_intensity": light_intensity,
+            "solar_voltage": solar_voltage,
+            "solar_current": solar_current,
+            "solar_power": solar_power,
+            "power": power,
+            "inverter_load": inverter_load,
+            "light_slope": trends.slope("irradiance"),
+            "battery_slope": trends.slope("battery"),
+        }
     )
-    irradiance = light_intensity / 120
-
-    # Fixed timegap (seconds)
-    if prev_time is None:
-        timegap = 0
-    else:
-        timegap = time.time() - prev_time
-
-    # ----- 1. Battery Overcharge / Low -----
-    if battery_percentage is not None:
-        if battery_percentage >= 100:
-            battery_alert = "Battery fully charged (100%) - Overcharge risk!"
-        elif battery_percentage < 15:
-            battery_alert = "Battery critically low (<15%) - Discharge risk!"
-
-    # ----- 2. Solar Panel Underperformance -----
-    if solar_voltage is not None and irradiance is not None:
-        solar_power_calc = (solar_power) / 1000
-
-        if 900 <= irradiance <= 1200 and not (0.31 <= solar_power_calc <= 0.37):
-            solar_alert = (
-                "Sunlight strong but solar panel underperforming (900-1200 W/m²)"
-            )
-        elif 600 <= irradiance < 900 and not (0.22 <= solar_power_calc <= 0.30):
-            solar_alert = (
-                "Sunlight moderate but solar panel underperforming (600-900 W/m²)"
-            )
-        elif 350 <= irradiance < 600 and not (0.14 <= solar_power_calc <= 0.22):
-            solar_alert = "Sunlight low but solar panel underperforming (350-600 W/m²)"
-        elif 150 <= irradiance < 350 and not (0.05 <= solar_power_calc <= 0.14):
-            solar_alert = (
-                "Sunlight very low but solar panel underperforming (150-350 W/m²)"
-            )
-        elif irradiance < 150 and solar_power_calc > 0.05:
-            solar_alert = "Unexpected power generated in very low sunlight (<150 W/m²)"
-
-    # ----- 3. Inverter Overload -----
-    if power is not None and inverter_load is not None:
-
-        # Define thresholds dynamically
-        warning_limit = inverter_load * 0.90  # 90% load pe warning
-        overload_limit = inverter_load * 1.00  # 100% se upar overload
-
-        if power > overload_limit:
-            overload_status = f"Overload! ({power:.2f}W > {inverter_load}W)"
-        elif power > warning_limit:
-            overload_status = f"High Load Warning. ({power:.2f}W / {inverter_load}W)"
-        else:
-            overload_status = f"Load Normal ({power:.2f} W)"
-
-    # ----- 4. Sudden Drop in Sunlight -----
-    if irradiance is not None and prev_irradiance is not None and timegap:
-        lightslope = (irradiance - prev_irradiance) / timegap
-        thresholdslope = -0.1
-        if lightslope < thresholdslope:
-            sunlight_alert = "Sudden drop in sunlight detected!"
-
-    # ----- 5. Solar Power Generated but Battery Not Charging -----
-    if (
-        solar_voltage
-        and solar_current
-        and battery_percentage is not None
-        and prev_batterypercent is not None
-        and timegap
-    ):
-        if solar_power > 0:
-            battery_slope = (battery_percentage - prev_batterypercent) / timegap
-            threshold_battery_slope = 0.05
-            if battery_slope < threshold_battery_slope:
-                charging_alert = "Solar generating power but battery not charging!"
+    battery_alert = alerts["battery_alert"]
+    solar_alert = alerts["solar_alert"]
+    overload_status = alerts["overload_status"]
+    sunlight_alert = alerts["sunlight_alert"]
+    charging_alert = alerts["charging_alert"]
+
+
+# ===================== THINGSBOARD FORWARDING ===================
+THINGSBOARD_HOST = os.environ.get("THINGSBOARD_HOST", "http://demo.thingsboard.io")
+thingsboard_sessions = {}  # one keep-alive session per device token
+thingsboard_sessions_lock = threading.Lock()
+
+
+def thingsboard_session(token):
+    with thingsboard_sessions_lock:
+        session = thingsboard_sessions.get(token)
+        if session is None:
+            session = pooled_session(pool_size=2)
+            thingsboard_sessions[token] = session
+        return session
+
+
+def post_telemetry(items):
+    """Send queued readings, one array-telemetry POST per device token.
+
+    Every point carries its own ts, so re-sending a batch after a failure
+    does not create duplicates on ThingsBoard.
+    """
+    by_token = {}
+    for (token, ts), values in items:
+        by_token.setdefault(token, []).append({"ts": ts, "values": values})
+    for token, points in by_token.items():
+        url = f"{THINGSBOARD_HOST}/api/v1/{token}/telemetry"
+        response = thingsboard_session(token).post(url, json=points, timeout=5)
+        response.raise_for_status()
+
+
+# Bounded buffer: when ThingsBoard is down the oldest readings are dropped first
+thingsboard_forwarder = OutboundQueue(
+    "thingsboard",
+    post_telemetry,
+    maxsize=int(os.environ.get("THINGSBOARD_QUEUE_SIZE", 5000)),
+    workers=2,
+    batch_size=100,
+    max_retries=5,
+    linger=0.5,
+)
+
+
+# Open dashboards get each payload pushed over /stream (changed fields only)
+live_broker = LiveBroker(
+    max_buffer=int(os.environ.get("STREAM_BUFFER", 100)),
+    # Each open stream holds a gunicorn thread: stay below --threads (Procfile) so devices still get one
+    max_subscribers=int(os.environ.get("STREAM_MAX_CLIENTS", 80)),
+)
 
 
 # ===================== WEATHER DATA ===================+
 
 
-def safe_first(lst):
-    """Safely return the first element of a list, or None if empty"""
-    return lst[0] if lst and len(lst) > 0 else None
+WEATHER_GRID = 0.1  # degrees; devices in the same ~10 km cell share one forecast
+WEATHER_HOURLY = ("temperature_2m", "cloudcover", "windspeed_10m", "precipitation")
+
+
+def weather_key(lat, lon):
+    """Round coordinates to the weather grid cell, e.g. '28.4,79.4'"""
+    return f"{round(float(lat) / WEATHER_GRID) * WEATHER_GRID:.2f},{round(float(lon) / WEATHER_GRID) * WEATHER_GRID:.2f}"
+
+
+def fetch_forecast(key):
+    """Two days of hourly weather for a grid cell, hour slots as UTC epoch seconds"""
+    lat, lon = key.split(",")
+    url = (
+        f"https://api.open-meteo.com/v1/forecast?"
+        f"latitude={lat}&longitude={lon}&hourly={','.join(WEATHER_HOURLY)}"
+        f"&timezone=GMT&timeformat=unixtime&forecast_days=2"
+    )
+    response = requests.get(url, timeout=10)
+    response.raise_for_status()
+    hourly = response.json().get("hourly", {})
+    return {"time": hourly.get("time", []), **{name: hourly.get(name, []) for name in WEATHER_HOURLY}}
+
+
+WEATHER_REFRESH_AHEAD = 300  # seconds before the top of the hour a forecast is re-fetched
+
+
+def next_hour(key, value, fetched_at):
+    """Open-Meteo data is hourly, so a forecast is good until the top of the next hour.
+
+    A forecast refreshed ahead (within WEATHER_REFRESH_AHEAD of the hour) is good
+    until the end of the coming hour; otherwise its expiry would not move and the
+    scheduler would re-fetch it every minute until the hour turns.
+    """
+    return (int(fetched_at + WEATHER_REFRESH_AHEAD) // 3600 + 1) * 3600
+
+
+forecast_cache = WeatherCache(
+    fetch_forecast, expires_for=next_hour, refresh_ahead=WEATHER_REFRESH_AHEAD, max_entries=512
+)
+
+# Re-fetch forecasts shortly before the top of the hour so a device POST never waits on Open-Meteo
+scheduler = BackgroundScheduler()
+scheduler.add_job(
+    func=forecast_cache.refresh_ahead,
+    trigger=IntervalTrigger(seconds=60),
+    id="weather_refresh",
+    name="Refresh cached forecasts ahead of expiry",
+    replace_existing=True,
+)
+scheduler.start()
+atexit.register(lambda: scheduler.shutdown(wait=False))
+
+
+def current_slot(forecast, now=None):
+    """Index of the hourly slot containing now (None if outside the forecast)"""
+    times = forecast.get("time") or []
+    index = bisect.bisect_right(times, now if now is not None else time.time()) - 1
+    return index if 0 <= index < len(times) else None
+
+
+def slot_value(forecast, name, index):
+    values = forecast.get(name) or []
+    return values[index] if index is not None and index < len(values) else None
 
 
 def fetch_weather():
     global temperature, cloudcover, windspeed, precipitation, light_intensity
     try:
-        url = (
-            f"https://api.open-meteo.com/v1/forecast?"
-            f"latitude={LAT}&longitude={LON}&hourly=temperature_2m,cloudcover,windspeed_10m,precipitation"
-        )
-        response = requests.get(url, timeout=10)
-        data = response.json()
-
-        hourly = data.get("hourly", {})
-        temperature = safe_first(hourly.get("temperature_2m", []))
-        cloudcover = safe_first(hourly.get("cloudcover", []))
-        windspeed = safe_first(hourly.get("windspeed_10m", []))
-        precipitation = safe_first(hourly.get("precipitation", []))
+        if LAT is None or LON is None:
+            raise ValueError("device sent no coordinates")
+        forecast = forecast_cache.get(weather_key(LAT, LON))
+        index = current_slot(forecast)
+        temperature = slot_value(forecast, "temperature_2m", index)
+        cloudcover = slot_value(forecast, "cloudcover", index)
+        windspeed = slot_value(forecast, "windspeed_10m", index)
+        precipitation = slot_value(forecast, "precipitation", index)
     except Exception as e:
         print("Error fetching weather:", str(e))
         temperature = cloudcover = windspeed = precipitation = None
@@ -129,49 +218,42 @@ def fetch_weather():
 # ===================== ESP32 DATA =====================
 @app.route("/esp32-data", methods=["POST"])
 def receive_data():
-    global payload, LAT, LON, THINGSBOARD_TOKEN, IP, inverter_load, prev_batterypercent
-    global frequency, power_factor, voltage, current, power, energy, prev_irradiance
+    global payload, payload_version, LAT, LON, THINGSBOARD_TOKEN, IP, inverter_load
+    global frequency, power_factor, voltage, current, power, energy
     global solar_voltage, solar_current, solar_power, battery_percentage, overload_status
-    global light_intensity, battery_voltage, RoomEsp, prev_time
+    global light_intensity, battery_voltage, RoomEsp
     global battery_alert, solar_alert, sunlight_alert, charging_alert
     try:
         data = request.get_json()
 
-        # Update globals
-        inverter_load = data.get("InverterLoad")
-        frequency = data.get("Frequency")
-        power_factor = data.get("PowerFactor")
-        voltage = data.get("Voltage")
-        current = data.get("Current")
-        power = data.get("Power")
-        energy = data.get("Energy")
-        solar_voltage = data.get("solarVoltage")
-        solar_current = data.get("solarCurrent")
-        solar_power = data.get("solarPower")
-        battery_percentage = data.get("batteryPercentage")
-        light_intensity = data.get("lightIntensity")
-        battery_voltage = data.get("batteryVoltage")
-        THINGSBOARD_TOKEN = data.get("THINGSBOARD_TOKEN")
-        LAT = data.get("latitude")
-        LON = data.get("longitude")
-        IP = data.get("deviceIP")
-        RoomEsp = data.get("RoomEsp")
-
-        # update time
-        if prev_time is None:
-            prev_time = time.time()
-        else:
-            prev_time = time.time()
+        # Update globals with typed values (any firmware's key names; 0 stays 0)
+        reading, invalid_fields = parse_reading(data)
+        if invalid_fields:
+            print("Ignoring invalid values for:", ", ".join(invalid_fields))
+        inverter_load = reading.inverter_load
+        frequency = reading.frequency
+        power_factor = reading.power_factor
+        voltage = reading.voltage
+        current = reading.current
+        power = reading.power
+        energy = reading.energy
+        solar_voltage = reading.solar_voltage
+        solar_current = reading.solar_current
+        solar_power = reading.solar_power
+        battery_percentage = reading.battery_percentage
+        light_intensity = reading.light_intensity
+        battery_voltage = reading.battery_voltage
+        THINGSBOARD_TOKEN = reading.thingsboard_token
+        LAT = reading.latitude
+        LON = reading.longitude
+        IP = reading.device_ip
+        RoomEsp = reading.room_esp
 
         # Update weather
         fetch_weather()
 
         # Check alerts
-        generate_alerts()
-
-        # After alerts, update previous values
-        prev_batterypercent = battery_percentage
-        prev_irradiance = light_intensity / 120
+        generate_alerts(reading.timestamp)
 
         # Build payload once and store globally
         payload = {
@@ -206,19 +288,23 @@ def receive_data():
             }.items()
             if v is not None
         }
+        payload_version += 1
 
-        # Send to ThingsBoard
-        THINGSBOARD_URL = (
-            f"http://demo.thingsboard.io/api/v1/{THINGSBOARD_TOKEN}/telemetry"
-        )
-        response = requests.post(THINGSBOARD_URL, json=payload, timeout=5)
+        # Hand over to the background forwarder and answer the device right away
+        if THINGSBOARD_TOKEN:
+            ts = int(time.time() * 1000)
+            thingsboard_forwarder.submit((THINGSBOARD_TOKEN, ts), payload)
+            thingsboard_status = "queued"
+        else:
+            thingsboard_status = "no_token"
+        live_broker.publish(device_key(), payload)
 
         return (
             jsonify(
                 {
                     "status": "success",
                     "message": "ESP32 data received",
-                    "thingsboard_status": response.status_code,
+                    "thingsboard_status": thingsboard_status,
                     "payload_sent": payload,
                 }
             ),
@@ -233,8 +319,43 @@ def receive_data():
 # ===================== HOME PAGE =====================
 @app.route("/")
 def home():
-    global payload
-    return render_template("dashboard.html", data=payload)
+    """Dashboard page, rendered once per payload and served with an ETag"""
+    page = page_cache.get(
+        "home",
+        payload_version,
+        lambda: render_template("dashboard.html", data=payload, device=device_key()),
+        encode=lambda html: html.encode("utf-8"),
+        mimetype="text/html",
+    )
+    return page.response(request)
+
+
+# ===================== LIVE STREAM =====================
+@app.route("/stream")
+def stream():
+    """Server-Sent Events: the payload once, then only the fields each reading changes"""
+    subscriber = live_broker.subscribe(request.args.get("device"))
+    if subscriber is None:
+        return jsonify({"status": "error", "message": "Too many live clients"}), 503
+    return Response(
+        live_broker.stream(subscriber),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ===================== METRICS =====================
+@app.route("/metrics")
+def metrics():
+    """ThingsBoard queue depth, forward latency and weather cache counters"""
+    return jsonify(
+        {
+            "thingsboard": thingsboard_forwarder.stats(),
+            "weather_cache": forecast_cache.stats(),
+            "live_stream": live_broker.stats(),
+            "page_cache": page_cache.stats(),
+        }
+    )
 
 
 # ===================== MAIN APP =====================